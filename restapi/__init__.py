@@ -26,6 +26,13 @@ __all__ = ['MapServiceLayer',  'ImageService', 'Geocoder', 'FeatureService', 'Fe
            'requestClient', 'set_request_client', 'get_request_client', 'get_request_method'] + \
            [d for d in dir(_strings) if not d.startswith('__')]
 
+# async request engine requires python 3.6+
+try:
+    from .async_utils import *
+    __all__ += async_utils.__all__
+except SyntaxError:
+    pass
+
 # package info
 __author__ = 'Caleb Mackey'
 __organization__ = 'Bolton & Menk, Inc.'
@@ -0,0 +1,30 @@
+"""Helpers for features that differ between python 2 and 3."""
+import os
+from array import array
+
+try:
+    array('q')
+    INT64_TYPECODE = 'q'
+except ValueError:
+    # python 2 has no long long arrays
+    INT64_TYPECODE = 'l'
+
+
+def replace(src, dst):
+    """Renames a file, overwriting dst if it exists, like os.replace() on python 3.
+
+    Args:
+        src: Path of the file to move.
+        dst: Destination path.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # python 2 on windows cannot rename over an existing file
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
@@ -15,6 +15,7 @@ FLOAT_FIELD = 'esriFieldTypeSingle'
 DOUBLE_FIELD = 'esriFieldTypeDouble'
 SHORT_FIELD = 'esriFieldTypeSmallInteger'
 LONG_FIELD = 'esriFieldTypeInteger'
+BIG_INTEGER_FIELD = 'esriFieldTypeBigInteger'
 GUID_FIELD = 'esriFieldTypeGUID'
 RASTER_FIELD = 'esriFieldTypeRaster'
 BLOB_FIELD = 'esriFieldTypeBlob'
@@ -69,6 +70,9 @@ LOCATORS = 'locators'
 OUT_FIELDS = 'outFields'
 RETURN_GEOMETRY = 'returnGeometry'
 GEOMETRY_PRECISION = 'geometryPrecision'
+MAX_ALLOWABLE_OFFSET = 'maxAllowableOffset'
+QUANTIZATION_PARAMETERS = 'quantizationParameters'
+TRANSFORM = 'transform'
 RELATION_PARAM = 'relationParam'
 MAX_RECORD_COUNT = 'maxRecordCount'
 RETURN_Z = 'returnZ'
@@ -77,6 +81,17 @@ HAS_Z = 'hasZ'
 HAS_M = 'hasM'
 RETURN_TRUE_CURVES = 'returnTrueCurves'
 RETURN_IDS_ONLY = 'returnIdsOnly'
+RETURN_COUNT_ONLY = 'returnCountOnly'
+COUNT = 'count'
+OUT_STATISTICS = 'outStatistics'
+GROUP_BY_FIELDS_FOR_STATISTICS = 'groupByFieldsForStatistics'
+STATISTIC_TYPE = 'statisticType'
+ON_STATISTIC_FIELD = 'onStatisticField'
+OUT_STATISTIC_FIELD_NAME = 'outStatisticFieldName'
+SUPPORTS_STATISTICS = 'supportsStatistics'
+RETURN_EXTENT_ONLY = 'returnExtentOnly'
+SUPPORTS_RETURNING_QUERY_EXTENT = 'supportsReturningQueryExtent'
+RETURN_DISTINCT_VALUES = 'returnDistinctValues'
 RESULT_RECORD_COUNT = 'resultRecordCount' # added at 10.3
 RETURN_ATTACHMENTS = 'returnAttachments'
 HAS_ATTACHMENTS = 'hasAttachments'
@@ -209,6 +224,13 @@ TRANSPARENT = 'transparent'
 RESULTS = 'results'
 EDITING_INFO = 'editingInfo'
 LAST_EDIT_DATE = 'lastEditDate'
+EDIT_FIELDS_INFO = 'editFieldsInfo'
+EDIT_DATE_FIELD = 'editDateField'
+CREATION_DATE_FIELD = 'creationDateField'
+SERVER_GENS = 'serverGens'
+SERVER_GEN = 'serverGen'
+LAYER_SERVER_GENS = 'layerServerGens'
+DELETE_IDS = 'deleteIds'
 VALUE = 'value'
 EXTENT = 'extent'
 INITIAL_EXTENT = 'initialExtent'
@@ -268,6 +290,8 @@ TIFF = 'tiff'
 FORMAT = 'format'
 PJSON = 'pjson'
 JSON = 'json'
+PBF = 'pbf'
+SUPPORTED_QUERY_FORMATS = 'supportedQueryFormats'
 GEOJSON_FORMAT = 'geoJSON'
 ESRI_JSON_FORMAT = 'esriJSON'
 COORDINATES = 'coordinates'
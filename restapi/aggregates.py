@@ -0,0 +1,184 @@
+"""Client side merging of outStatistics query results.  Statistics computed by the
+server for parts of a layer (OID ranges, or pages of groups) are combined here into
+the statistics of the whole layer.  Counts, sums, minimums and maximums are merged
+directly, averages from sums and counts, and variances and standard deviations from
+the count, average and variance of each part.
+"""
+import math
+import six
+from collections import OrderedDict
+from ._strings import STATISTIC_TYPE, ON_STATISTIC_FIELD, OUT_STATISTIC_FIELD_NAME
+
+__all__ = ['StatisticsMerger', 'normalize_statistics']
+
+# the statistics requested from the server to merge each statistic type
+COMPONENTS = {
+    'count': ('count',),
+    'sum': ('sum',),
+    'min': ('min',),
+    'max': ('max',),
+    'avg': ('count', 'sum'),
+    'var': ('count', 'avg', 'var'),
+    'stddev': ('count', 'avg', 'var'),
+}
+
+
+def normalize_statistics(statistics):
+    """Returns a list of outStatistics definitions.
+
+    Args:
+        statistics: A list of outStatistics dicts, or of (statisticType, onStatisticField)
+            tuples with an optional outStatisticFieldName, or a dict of
+            {outStatisticFieldName: (statisticType, onStatisticField)}.
+    """
+    if isinstance(statistics, dict):
+        if STATISTIC_TYPE in statistics:
+            statistics = [statistics]
+        else:
+            statistics = [(stat[0], stat[1], name) for name, stat in six.iteritems(statistics)]
+    definitions = []
+    for stat in statistics:
+        if isinstance(stat, dict):
+            stat = dict(stat)
+        else:
+            stat = dict(zip([STATISTIC_TYPE, ON_STATISTIC_FIELD, OUT_STATISTIC_FIELD_NAME], stat))
+        stat[STATISTIC_TYPE] = stat[STATISTIC_TYPE].lower()
+        if not stat.get(OUT_STATISTIC_FIELD_NAME):
+            stat[OUT_STATISTIC_FIELD_NAME] = '{}_{}'.format(stat[STATISTIC_TYPE], stat[ON_STATISTIC_FIELD])
+        definitions.append(stat)
+    return definitions
+
+
+class StatisticsMerger(object):
+    """Merges the results of outStatistics queries over parts of a layer.
+
+    Attributes:
+        statistics: The requested outStatistics definitions.
+        group_by: List of the groupByFieldsForStatistics.
+        out_statistics: The outStatistics definitions to send to the server, these
+            request the parts needed to merge each statistic.
+    """
+
+    def __init__(self, statistics, group_by=None):
+        """Inits class with the requested statistics.
+
+        Args:
+            statistics: The statistics, see normalize_statistics().
+            group_by: Optional list or comma delimited string of fields to group by.
+        """
+        if isinstance(group_by, six.string_types):
+            group_by = [f.strip() for f in group_by.split(',') if f.strip()]
+        self.statistics = normalize_statistics(statistics)
+        self.group_by = list(group_by or [])
+        self.out_statistics = []
+        self._components = []
+        requested = {}
+        for stat in self.statistics:
+            names = {}
+            for component in COMPONENTS.get(stat[STATISTIC_TYPE], (stat[STATISTIC_TYPE],)):
+                key = (component, stat[ON_STATISTIC_FIELD])
+                if key not in requested:
+                    requested[key] = 'stat{}_{}'.format(len(self.out_statistics), component)
+                    self.out_statistics.append({
+                        STATISTIC_TYPE: component,
+                        ON_STATISTIC_FIELD: stat[ON_STATISTIC_FIELD],
+                        OUT_STATISTIC_FIELD_NAME: requested[key]
+                    })
+                names[component] = requested[key]
+            self._components.append(names)
+        self._groups = OrderedDict()
+
+    @property
+    def unmergeable(self):
+        """List of the requested statistic types that cannot be merged from several parts."""
+        return [stat[STATISTIC_TYPE] for stat in self.statistics if stat[STATISTIC_TYPE] not in COMPONENTS]
+
+    def add(self, rows):
+        """Adds the result rows of one part.
+
+        Args:
+            rows: List of attribute dicts returned for the part.
+
+        Raises:
+            ValueError: A statistic that cannot be merged was returned by more than one part.
+        """
+        for row in rows:
+            lookup = {k.lower(): v for k, v in six.iteritems(row)}
+            key = tuple(lookup.get(f.lower()) for f in self.group_by)
+            parts = [{component: lookup.get(name.lower()) for component, name in six.iteritems(names)}
+                     for names in self._components]
+            group = self._groups.get(key)
+            if group is None:
+                self._groups[key] = [self._start(stat, part) for stat, part in zip(self.statistics, parts)]
+            else:
+                self._groups[key] = [self._merge(stat, value, part) for stat, value, part in zip(self.statistics, group, parts)]
+
+    @staticmethod
+    def _start(stat, part):
+        """Returns the merge state of a statistic for its first part."""
+        stat_type = stat[STATISTIC_TYPE]
+        if stat_type in ('var', 'stddev'):
+            n, mean, var = part['count'] or 0, part['avg'], part['var']
+            return (n, mean or 0, (var or 0) * (n - 1) if n > 1 else 0)
+        if stat_type == 'avg':
+            return (part['count'] or 0, part['sum'] or 0)
+        return part[COMPONENTS.get(stat_type, (stat_type,))[0]]
+
+    @staticmethod
+    def _merge(stat, state, part):
+        """Returns the merge state of a statistic with another part added."""
+        stat_type = stat[STATISTIC_TYPE]
+        if stat_type not in COMPONENTS:
+            raise ValueError('"{}" statistics cannot be merged across parts'.format(stat_type))
+        if stat_type in ('var', 'stddev'):
+            # parallel algorithm for the sums of squared differences
+            n_a, mean_a, m2_a = state
+            n_b, mean_b, m2_b = StatisticsMerger._start(stat, part)
+            n = n_a + n_b
+            if not n_b:
+                return state
+            if not n_a:
+                return (n_b, mean_b, m2_b)
+            delta = mean_b - mean_a
+            return (n, mean_a + delta * n_b / float(n), m2_a + m2_b + delta ** 2 * n_a * n_b / float(n))
+        if stat_type == 'avg':
+            return (state[0] + (part['count'] or 0), state[1] + (part['sum'] or 0))
+        value = part[stat_type]
+        if value is None:
+            return state
+        if state is None:
+            return value
+        if stat_type in ('count', 'sum'):
+            return state + value
+        return min([state, value]) if stat_type == 'min' else max([state, value])
+
+    @staticmethod
+    def _finish(stat, state):
+        """Returns the value of a statistic from its merge state."""
+        stat_type = stat[STATISTIC_TYPE]
+        if stat_type in ('var', 'stddev'):
+            n, mean, m2 = state
+            if not n:
+                return None
+            var = m2 / float(n - 1) if n > 1 else 0
+            return math.sqrt(var) if stat_type == 'stddev' else var
+        if stat_type == 'avg':
+            count, total = state
+            return total / float(count) if count else None
+        return state
+
+    def results(self):
+        """Returns a list of dicts with the group by fields and the merged statistics."""
+        results = []
+        for key, group in six.iteritems(self._groups):
+            row = OrderedDict(zip(self.group_by, key))
+            for stat, state in zip(self.statistics, group):
+                row[stat[OUT_STATISTIC_FIELD_NAME]] = self._finish(stat, state)
+            results.append(row)
+        return results
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __repr__(self):
+        return '<{}: {} statistics, {} groups>'.format(self.__class__.__name__, len(self.statistics), len(self._groups))
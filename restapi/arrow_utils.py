@@ -0,0 +1,422 @@
+"""Conversion of feature sets to Apache Arrow.  An ArrowConverter derives an Arrow
+schema once from the field definitions of a layer and converts each page of a query
+(as a ColumnarFeatureSet) to a RecordBatch.  Numeric and date columns are wrapped
+without copying their arrays, coded value domains become dictionary arrays and
+geometries are encoded as WKB with GeoParquet metadata.
+
+Requires pyarrow, pyproj is used for the CRS definition when it is installed.
+"""
+import json
+import struct
+import six
+from array import array
+from ._strings import *
+from .columnar import ColumnarFeatureSet, TYPECODES
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+__all__ = ['ArrowConverter', 'esri_to_wkb', 'wkb_to_esri', 'projjson']
+
+GEOPARQUET_VERSION = '1.0.0'
+
+# WKB geometry type codes, z geometries add 1000
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+GEOMETRY_TYPES = {
+    ESRI_POINT: ['Point'],
+    ESRI_MULTIPOINT: ['MultiPoint'],
+    ESRI_POLYLINE: ['LineString', 'MultiLineString'],
+    ESRI_POLYGON: ['Polygon', 'MultiPolygon'],
+}
+
+
+def _ring_area(ring):
+    """Returns the signed area of a ring, negative when it is clockwise."""
+    return sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:])) / 2.0
+
+
+def _contains(ring, point):
+    """Checks if a point is inside a ring (ray casting)."""
+    x, y = point[0], point[1]
+    inside = False
+    for a, b in zip(ring, ring[1:]):
+        if (a[1] > y) != (b[1] > y) and x < (b[0] - a[0]) * (y - a[1]) / float(b[1] - a[1]) + a[0]:
+            inside = not inside
+    return inside
+
+
+def _polygons(rings):
+    """Groups Esri rings into polygons, clockwise rings are exterior rings and counter
+            clockwise rings are holes of the exterior ring that contains them.
+    """
+    rings = [ring for ring in rings if ring]
+    outer = [ring for ring in rings if _ring_area(ring) < 0]
+    if not outer:
+        # rings are not oriented as Esri rings, treat each as a polygon
+        return [[ring] for ring in rings]
+    polygons = [[ring] for ring in outer]
+    for ring in rings:
+        if _ring_area(ring) < 0:
+            continue
+        for polygon in polygons:
+            if _contains(polygon[0], ring[0]):
+                polygon.append(ring)
+                break
+        else:
+            polygons.append([ring])
+    return polygons
+
+
+def esri_to_wkb(geometry, has_z=False):
+    """Encodes an Esri JSON geometry as little endian WKB, m values are dropped.
+
+    Args:
+        geometry: Esri JSON geometry dict, or None.
+        has_z: Optional boolean to write z values. Defaults to False.
+
+    Returns:
+        The WKB bytes, or None for a null geometry.
+
+    Raises:
+        ValueError: The geometry has curves or an unknown type.
+    """
+    if not geometry:
+        return None
+    dims = 3 if has_z else 2
+    offset = 1000 if has_z else 0
+    coord = struct.Struct('<' + 'd' * dims)
+
+    def header(code):
+        return struct.pack('<BI', 1, code + offset)
+
+    def vertex(v):
+        v = list(v[:dims]) + [float('nan')] * (dims - len(v[:dims]))
+        return coord.pack(*[float('nan') if c is None else c for c in v])
+
+    def points(vertices):
+        return struct.pack('<I', len(vertices)) + b''.join(vertex(v) for v in vertices)
+
+    if 'curvePaths' in geometry or 'curveRings' in geometry:
+        raise ValueError('Curve geometries cannot be written as WKB')
+    if 'x' in geometry:
+        if geometry['x'] is None:
+            return header(WKB_POINT) + coord.pack(*[float('nan')] * dims)
+        return header(WKB_POINT) + vertex([geometry['x'], geometry['y'], geometry.get('z')])
+    if POINTS in geometry:
+        return header(WKB_MULTIPOINT) + struct.pack('<I', len(geometry[POINTS])) + \
+               b''.join(header(WKB_POINT) + vertex(v) for v in geometry[POINTS])
+    if PATHS in geometry:
+        paths = geometry[PATHS]
+        if len(paths) == 1:
+            return header(WKB_LINESTRING) + points(paths[0])
+        return header(WKB_MULTILINESTRING) + struct.pack('<I', len(paths)) + \
+               b''.join(header(WKB_LINESTRING) + points(path) for path in paths)
+    if RINGS in geometry:
+        polygons = _polygons(geometry[RINGS])
+        encoded = [struct.pack('<I', len(polygon)) + b''.join(points(ring) for ring in polygon) for polygon in polygons]
+        if len(encoded) == 1:
+            return header(WKB_POLYGON) + encoded[0]
+        return header(WKB_MULTIPOLYGON) + struct.pack('<I', len(encoded)) + \
+               b''.join(header(WKB_POLYGON) + polygon for polygon in encoded)
+    raise ValueError('Unsupported geometry: {}'.format(list(geometry.keys())))
+
+
+def wkb_to_esri(wkb):
+    """Decodes WKB (or ISO / EWKB with z and m values) as an Esri JSON geometry.  Exterior
+            rings are written clockwise and holes counter clockwise.
+
+    Args:
+        wkb: The WKB bytes, or None.
+
+    Returns:
+        The Esri JSON geometry dict, or None for a null geometry.
+
+    Raises:
+        ValueError: The geometry type is not supported.
+    """
+    if wkb is None:
+        return None
+    wkb = memoryview(wkb).tobytes() if not isinstance(wkb, bytes) else wkb
+
+    def read(offset):
+        order = '<' if six.indexbytes(wkb, offset) == 1 else '>'
+        code = struct.unpack_from(order + 'I', wkb, offset + 1)[0]
+        has_z, has_m = bool(code & 0x80000000), bool(code & 0x40000000)
+        code &= 0xffff
+        has_z = has_z or code // 1000 in (1, 3)
+        has_m = has_m or code // 1000 in (2, 3)
+        return order, code % 1000, 2 + has_z + has_m, has_z, has_m, offset + 5
+
+    def vertices(order, dims, offset):
+        count = struct.unpack_from(order + 'I', wkb, offset)[0]
+        values = struct.unpack_from(order + 'd' * (count * dims), wkb, offset + 4)
+        coords = iter(values)
+        return [list(v) for v in zip(*[coords] * dims)], offset + 4 + count * dims * 8
+
+    def rings(order, dims, offset):
+        count = struct.unpack_from(order + 'I', wkb, offset)[0]
+        offset += 4
+        polygon = []
+        for i in six.moves.range(count):
+            ring, offset = vertices(order, dims, offset)
+            # exterior rings are clockwise (negative area) in Esri JSON
+            if ring and (_ring_area(ring) > 0) == (i == 0):
+                ring.reverse()
+            polygon.append(ring)
+        return polygon, offset
+
+    def parts(order, offset):
+        count = struct.unpack_from(order + 'I', wkb, offset)[0]
+        offset += 4
+        geometries = []
+        for _ in six.moves.range(count):
+            sub_order, code, dims, _z, _m, offset = read(offset)
+            if code == WKB_POINT:
+                point = list(struct.unpack_from(sub_order + 'd' * dims, wkb, offset))
+                offset += dims * 8
+                geometries.append(point)
+            elif code == WKB_LINESTRING:
+                path, offset = vertices(sub_order, dims, offset)
+                geometries.append(path)
+            else:
+                polygon, offset = rings(sub_order, dims, offset)
+                geometries.extend(polygon)
+        return geometries
+
+    order, code, dims, has_z, has_m, offset = read(0)
+    if code == WKB_POINT:
+        values = struct.unpack_from(order + 'd' * dims, wkb, offset)
+        if values[0] != values[0]:
+            # empty point
+            return {'x': None, 'y': None}
+        geometry = {'x': values[0], 'y': values[1]}
+        if has_z:
+            geometry['z'] = values[2]
+        if has_m:
+            geometry['m'] = values[-1]
+        return geometry
+    if code == WKB_LINESTRING:
+        geometry = {PATHS: [vertices(order, dims, offset)[0]]}
+    elif code == WKB_POLYGON:
+        geometry = {RINGS: rings(order, dims, offset)[0]}
+    elif code == WKB_MULTIPOINT:
+        geometry = {POINTS: parts(order, offset)}
+    elif code == WKB_MULTILINESTRING:
+        geometry = {PATHS: parts(order, offset)}
+    elif code == WKB_MULTIPOLYGON:
+        geometry = {RINGS: parts(order, offset)}
+    else:
+        raise ValueError('Unsupported WKB geometry type: {}'.format(code))
+    if has_z:
+        geometry[HAS_Z] = True
+    if has_m:
+        geometry[HAS_M] = True
+    return geometry
+
+
+def projjson(wkid):
+    """Returns the PROJJSON definition of a well known id.  Without pyproj only the
+            identifier of the CRS is given.
+
+    Args:
+        wkid: The well known id.
+    """
+    authority = 'EPSG' if wkid < 100000 else 'ESRI'
+    if pyproj is not None:
+        try:
+            return pyproj.CRS.from_authority(authority, wkid).to_json_dict()
+        except Exception:
+            pass
+    return {'id': {'authority': authority, 'code': wkid}}
+
+
+
+
+def geo_metadata(geometry_column, geometry_type, has_z=False, wkid=None):
+    """Returns the GeoParquet "geo" metadata of a WKB geometry column.
+
+    Args:
+        geometry_column: Name of the geometry column.
+        geometry_type: The Esri geometry type.
+        has_z: Optional boolean for z values. Defaults to False.
+        wkid: Optional well known id of the geometries.
+    """
+    geometry_types = GEOMETRY_TYPES.get(geometry_type, [])
+    if has_z:
+        geometry_types = [t + ' Z' for t in geometry_types]
+    # a missing crs means OGC:CRS84, null means unknown
+    column = {'encoding': 'WKB', 'geometry_types': geometry_types, 'crs': projjson(int(wkid)) if wkid else None}
+    return {
+        'version': GEOPARQUET_VERSION,
+        'primary_column': geometry_column,
+        'columns': {geometry_column: column}
+    }
+
+
+class ArrowConverter(object):
+    """Converts feature sets to Arrow record batches with a fixed schema.
+
+    Attributes:
+        fields: The field definitions of the attribute columns.
+        schema: The Arrow schema of the batches.
+        geometry_column: Name of the WKB geometry column, None without geometry.
+    """
+
+    def __init__(self, fields, geometry_type=None, has_z=False, wkid=None, coded_values=True, geometry_column='geometry'):
+        """Inits class with the field definitions of a layer.
+
+        Args:
+            fields: List of field definitions, geometry fields are skipped.
+            geometry_type: Optional Esri geometry type, adds a WKB geometry column.
+            has_z: Optional boolean to write z values. Defaults to False.
+            wkid: Optional well known id of the geometries.
+            coded_values: Optional boolean to convert fields with a coded value domain to
+                dictionary arrays of the coded value names.  The domain is kept in the field
+                metadata. Defaults to True.
+            geometry_column: Optional name of the geometry column. Defaults to "geometry".
+
+        Raises:
+            ImportError: pyarrow is not installed.
+        """
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for Arrow conversion')
+        self.fields = [f for f in fields if f.get(TYPE) != SHAPE]
+        self.has_z = bool(has_z)
+        self.geometry_type = geometry_type
+        self._domains = {}
+        arrow_fields = []
+        for field in self.fields:
+            domain = field.get(DOMAIN) or {}
+            metadata = None
+            if coded_values and domain.get(TYPE) == 'codedValue' and domain.get(CODED_VALUES):
+                values = domain[CODED_VALUES]
+                self._domains[field[NAME]] = ({v['code']: i for i, v in enumerate(values)}, [v[NAME] for v in values])
+                arrow_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+                metadata = {b'domain': json.dumps(domain).encode('utf-8')}
+            else:
+                arrow_type = self.arrow_type(field.get(TYPE))
+            arrow_fields.append(pyarrow.field(field[NAME], arrow_type, metadata=metadata))
+
+        self.geometry_column = None
+        metadata = None
+        if geometry_type:
+            names = set(f[NAME] for f in self.fields)
+            self.geometry_column = geometry_column if geometry_column not in names else geometry_column + '_wkb'
+            arrow_fields.append(pyarrow.field(self.geometry_column, pyarrow.binary()))
+            metadata = {b'geo': json.dumps(geo_metadata(self.geometry_column, geometry_type, has_z, wkid)).encode('utf-8')}
+        self.schema = pyarrow.schema(arrow_fields, metadata=metadata)
+
+    @staticmethod
+    def arrow_type(field_type):
+        """Returns the Arrow type of an Esri field type.
+
+        Args:
+            field_type: The Esri field type.
+        """
+        if field_type == DATE_FIELD:
+            return pyarrow.timestamp('ms', tz='UTC')
+        if field_type == BLOB_FIELD:
+            return pyarrow.binary()
+        typecode = TYPECODES.get(field_type)
+        if typecode is None:
+            return pyarrow.string()
+        size = array(typecode).itemsize
+        if typecode in ('f', 'd'):
+            return pyarrow.float32() if size == 4 else pyarrow.float64()
+        return {2: pyarrow.int16(), 4: pyarrow.int32()}.get(size, pyarrow.int64())
+
+    @classmethod
+    def from_feature_set(cls, feature_set, **kwargs):
+        """Returns a converter for the schema of a feature set.
+
+        Args:
+            feature_set: A FeatureSet or ColumnarFeatureSet.
+            kwargs: Optional keyword arguments for the converter.
+        """
+        js = feature_set.json
+        sr = js.get(SPATIAL_REFERENCE) or {}
+        kwargs['wkid'] = kwargs.get('wkid') or sr.get(LATEST_WKID) or sr.get(WKID)
+        has_geometry = feature_set.geometry is not None if isinstance(feature_set, ColumnarFeatureSet) else bool(js.get(GEOMETRY_TYPE))
+        return cls(js.get(FIELDS) or [], js.get(GEOMETRY_TYPE) if has_geometry else None, js.get(HAS_Z), **kwargs)
+
+    def _array(self, column, arrow_type):
+        """Returns the Arrow array of a Column, typed columns are wrapped without copying."""
+        n = len(column)
+        if column.typecode:
+            null_count = column.null_count
+            validity = None
+            if null_count:
+                mask = pyarrow.Array.from_buffers(pyarrow.uint8(), n, [None, pyarrow.py_buffer(column.mask)])
+                validity = pyarrow.compute.equal(mask, 0).buffers()[1]
+            source_type = pyarrow.int64() if column.type == DATE_FIELD else self.arrow_type(column.type)
+            values = pyarrow.Array.from_buffers(source_type, n, [validity, pyarrow.py_buffer(column.values)], null_count=null_count)
+            if column.type == DATE_FIELD and pyarrow.types.is_timestamp(arrow_type):
+                # same 64 bit layout, only the type changes
+                values = values.view(arrow_type)
+        else:
+            values = pyarrow.array(column.values, pyarrow.binary() if pyarrow.types.is_binary(arrow_type) else pyarrow.string())
+        return values if values.type == arrow_type else values.cast(arrow_type)
+
+    def _dictionary_array(self, column, name):
+        """Returns the dictionary array of a coded value domain field, codes that are not
+                in the domain are added to the dictionary as text.
+        """
+        lookup, names = self._domains[name]
+        lookup, names = dict(lookup), list(names)
+        indices = []
+        for code in column.to_list():
+            if code is None:
+                indices.append(None)
+                continue
+            index = lookup.get(code)
+            if index is None:
+                names.append(six.text_type(code))
+                index = lookup[code] = len(names) - 1
+            indices.append(index)
+        return pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, pyarrow.int32()), pyarrow.array(names, pyarrow.string()))
+
+    def convert(self, feature_set):
+        """Returns a feature set as a RecordBatch.
+
+        Args:
+            feature_set: A FeatureSet, PagedFeatureSet or ColumnarFeatureSet.  Fields that
+                are not in the feature set are null.
+        """
+        columns = feature_set if isinstance(feature_set, ColumnarFeatureSet) else feature_set.to_columns()
+        n = len(columns)
+        arrays = []
+        for field in self.schema:
+            if field.name == self.geometry_column:
+                shapes = columns.geometry.iter_geometries() if columns.geometry is not None else [None] * n
+                arrays.append(pyarrow.array([esri_to_wkb(g, self.has_z) for g in shapes], pyarrow.binary()))
+                continue
+            column = columns.columns.get(field.name)
+            if column is None:
+                arrays.append(pyarrow.nulls(n, field.type))
+            elif field.name in self._domains:
+                arrays.append(self._dictionary_array(column, field.name))
+            else:
+                arrays.append(self._array(column, field.type))
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def reader(self, batches):
+        """Returns a RecordBatchReader of an iterable of batches with the schema.
+
+        Args:
+            batches: Iterable of RecordBatches from convert().
+        """
+        return pyarrow.RecordBatchReader.from_batches(self.schema, batches)
@@ -0,0 +1,365 @@
+"""asyncio request engine.  This mirrors rest_utils.do_request() so that a single
+event loop can drive many concurrent queries without a thread per request.  Token,
+cookie and proxy resolution is shared with the synchronous engine through
+rest_utils.prepare_request().
+
+Requires python 3.6+ and aiohttp.
+"""
+from __future__ import print_function
+import os
+import asyncio
+import collections
+import requests
+import six
+from ._strings import *
+from .exceptions import RequestError, RestAPIException
+from .globals import RetryPolicy
+from .rest_utils import (prepare_request, can_use_get, decode_json, lazy_munchify, RESTEndpoint, STANDARD_HEADERS,
+                         USER_AGENT, ID_MANAGER)
+from .common_types import MapServiceLayer, DEFAULT_REQUEST_FORMAT
+from . import enums
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__all__ = ['AsyncRequestClient', 'do_request_async', 'set_async_request_client',
+           'get_async_request_client', 'iter_concurrent_async']
+
+# GLOBAL ASYNC CLIENT
+asyncRequestClient = None
+
+
+class AsyncRequestClient(object):
+    """Represents an asynchronous request client backed by an aiohttp.ClientSession.  The
+            session is created lazily inside the running event loop and recreated if the
+            client is used from a different loop.
+    """
+    def __init__(self, session=None, limit=100, limit_per_host=0, headers=None, verify=None, retry_policy=None):
+        """Inits class with connection limits.
+
+        Args:
+            session: Optional aiohttp.ClientSession to use.
+            limit: Optional maximum number of open connections. Defaults to 100.
+            limit_per_host: Optional maximum number of open connections per host,
+                0 means no limit. Defaults to 0.
+            headers: Optional extra headers to send with every request.
+            verify: Optional boolean to verify certificates. Defaults to the
+                RESTAPI_VERIFY_CERT environment variable.
+            retry_policy: Optional restapi.RetryPolicy for transient failures, or True to
+                use RetryPolicy().  Defaults to None (no retries).
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for async requests, install it with "pip install aiohttp"')
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.headers = dict(STANDARD_HEADERS, **(headers or {}))
+        self.verify = verify if verify is not None else os.getenv('RESTAPI_VERIFY_CERT') != 'FALSE'
+        self.retry_policy = RetryPolicy() if retry_policy is True else retry_policy or None
+        self._session = session
+        self._loop = None
+
+    @property
+    def session(self):
+        """The aiohttp.ClientSession for the running event loop."""
+        loop = asyncio.get_event_loop()
+        if self._session is None or self._session.closed or (self._loop and self._loop is not loop):
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             ssl=None if self.verify else False)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        """Closes the underlying session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __repr__(self):
+        return '<{}: limit={}>'.format(self.__class__.__name__, self.limit)
+
+
+def set_async_request_client(client=None, *args, **kwargs):
+    """Sets the global async request client.
+
+    Args:
+        client: Optional AsyncRequestClient, if None a new one is created with
+            the remaining arguments.
+    """
+    if not isinstance(client, AsyncRequestClient):
+        client = AsyncRequestClient(*args, **kwargs)
+    global asyncRequestClient
+    asyncRequestClient = client
+    return asyncRequestClient
+
+
+def get_async_request_client(client=None):
+    """Returns the async request client to use.
+
+    Args:
+        client: Optional AsyncRequestClient, the global client is returned if None.
+    """
+    if isinstance(client, AsyncRequestClient):
+        return client
+    if not asyncRequestClient:
+        set_async_request_client()
+    return asyncRequestClient
+
+
+def _encode_params(params):
+    """Converts parameters to strings the same way requests does, None values are dropped."""
+    return {k: v if isinstance(v, six.string_types) else str(v) for k,v in six.iteritems(params) if v is not None}
+
+
+class _Retry(Exception):
+    """Raised internally to repeat a request."""
+    pass
+
+
+async def do_request_async(service, params=None, ret_json=True, token='', cookies=None, proxy=None, referer=None, client=None, method='get', **kwargs):
+    """Async counterpart of do_request().  Credentials are resolved exactly like the
+            synchronous engine, but the request is made with aiohttp.
+
+    Args:
+        service: Full path to REST endpoint of service.
+        params: Optional parameters for posting a request. Defaults to {F: JSON}.
+            A copy is made so the same dict can be reused for concurrent requests.
+        ret_json: Optional boolean that returns the response as JSON if True.
+            Default is True.
+        token: Optional token to handle security (only required if security is enabled).
+            Defaults to ''.
+        cookies: Optional arg for cookie object {'agstoken': 'your_token'}.
+            Defaults to None.
+        proxy: Option to use proxy page to handle security, need to provide
+            full path to proxy url. Defaults to None.
+        referer: Option to specify a custom referer.
+        client: Option to specify a custom AsyncRequestClient to perform the request.
+
+    Raises:
+        requests.HTTPError: The server returned an HTTP error status, like do_request().
+        NameError: '"{0}" service not found!\n{1}'
+
+    Returns:
+        The response as JSON, or the aiohttp response (with the body already read)
+            if ret_json is False.
+    """
+    params = dict(params) if params else {F: JSON}
+    url_in, kwargs_in = service, kwargs
+
+    def prepare():
+        """Resolves the credentials and builds the request, this is repeated for each
+                attempt because a token can expire while waiting to retry.
+        """
+        service, request_params, request_proxy, kwargs, request_ret_json = prepare_request(
+            url_in, dict(params), ret_json, token, cookies, proxy, **dict(kwargs_in))
+
+        # aiohttp always reads the body, stream is not a valid argument
+        kwargs.pop('stream', None)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if referer:
+            headers[enums.headers.referer] = referer
+
+        if request_proxy:
+            # IMPORTANT: this is not a regular proxy, this is the Esri Proxy
+            # see: https://github.com/Esri/resource-proxy
+            frmat = request_params.pop(F, JSON)
+            proxied_request = requests.Request('POST', service, params={F: frmat})
+            url = '{}?{}'.format(request_proxy, proxied_request.prepare().url)
+            headers['User-Agent'] = USER_AGENT
+            kwargs.pop('cookies', None)
+            request_kwargs = dict(kwargs, data=_encode_params(request_params))
+            http_method = 'POST'
+            ID_MANAGER.proxies[service.split('/rest')[0].lower() + '/rest/services'] = request_proxy
+        else:
+            url = service
+            if method == 'get' and can_use_get(service, request_params):
+                http_method = 'GET'
+                request_kwargs = dict(kwargs, params=_encode_params(request_params))
+            else:
+                http_method = 'POST' if method == 'get' else method.upper()
+                request_kwargs = dict(kwargs, data=_encode_params(request_params))
+        if not request_kwargs.get('cookies'):
+            request_kwargs.pop('cookies', None)
+        return service, url, http_method, headers, request_kwargs, request_ret_json
+
+    client = get_async_request_client(client)
+    retry_policy = client.retry_policy
+    attempt = 0
+    while True:
+        retry_after = None
+        service, url, http_method, headers, request_kwargs, ret_json = prepare()
+        try:
+            async with client.session.request(http_method, url, headers=headers, **request_kwargs) as r:
+                if r.status != 200:
+                    if retry_policy and retry_policy.should_retry(attempt, service, status_code=r.status, method=http_method):
+                        retry_after = r.headers.get('Retry-After')
+                        raise _Retry()
+                    if r.status >= 400:
+                        # the same error as raise_for_status() in do_request()
+                        kind = 'Client' if r.status < 500 else 'Server'
+                        raise requests.HTTPError('{} {} Error: {} for url: {}'.format(r.status, kind, r.reason, r.url))
+                    raise NameError('"{0}" service not found!\n{1}'.format(service, r.status))
+                body = await r.read()
+            if not ret_json:
+                return r
+            try:
+                _json = decode_json(body)
+            except:
+                return r
+            try:
+                RequestError(_json)
+            except RestAPIException as e:
+                # ArcGIS Server reports some transient failures as JSON errors with a 200 status
+                if retry_policy and retry_policy.should_retry(attempt, service, error_code=e.code, method=http_method):
+                    raise _Retry()
+                raise
+            return lazy_munchify(_json)
+        except _Retry:
+            pass
+        except Exception as e:
+            if not (retry_policy and retry_policy.should_retry(attempt, service, exception=e, method=http_method)):
+                raise
+        await asyncio.sleep(retry_policy.get_backoff(attempt, retry_after))
+        attempt += 1
+
+
+async def iter_concurrent_async(aws, max_concurrency=10):
+    """Runs awaitables concurrently, yielding results in the same order as the input.
+            Only a limited window of awaitables are scheduled at any time, pass a
+            generator so they are created lazily.
+
+    Args:
+        aws: An iterable of awaitables (coroutines or futures).
+        max_concurrency: Optional maximum number of awaitables scheduled at once.
+            Defaults to 10.
+    """
+    max_concurrency = max([max_concurrency or 1, 1])
+    pending = collections.deque()
+    try:
+        for aw in aws:
+            pending.append(asyncio.ensure_future(aw))
+            if len(pending) >= max_concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        # consumer stopped early or a request failed, do not leave orphaned tasks
+        for task in pending:
+            task.cancel()
+
+
+async def request_async(self, *args, **kwargs):
+    """Async wrapper for request to automatically pass in credentials."""
+    kwargs = self._request_kwargs(kwargs)
+    return await do_request_async(*args, **kwargs)
+
+
+async def query_async(self, where='1=1', fields='*', records=None, exceed_limit=False, f=DEFAULT_REQUEST_FORMAT, chunk_size=None, max_concurrency=10, client=None, **kwargs):
+    """Async counterpart of query().  The kmz format is not supported.
+
+    Args:
+        fields: Optional fields to return. Default is "*" to return all fields.
+        where: Optional where clause. Defaults to '1=1'.
+        records: Number of records to return.  Default is None to return all
+            records within bounds of max record count unless exceed_limit is True.
+        exceed_limit: Option to get all records in layer. Default is False.
+        f: Return format, default is JSON.
+        chunk_size: Optional. Can be used to override the default chunk size.
+        max_concurrency: Optional maximum number of chunk requests in flight when
+            exceed_limit is True. Defaults to 10.
+        client: Option to specify a custom AsyncRequestClient to perform the requests.
+        kwargs: Optional extra parameters to add to query string passed as key word arguments
+
+    Returns:
+        Response as JSON.
+    """
+    query_url = self.url + '/query'
+    params = self._validate_params(where=where, fields=fields, f=f, **kwargs)
+
+    if kwargs.get('returnIdsOnly'):
+        exceed_limit = False
+
+    server_response = {}
+    max_recs = chunk_size or self.json.get(MAX_RECORD_COUNT, 1000)
+    if isinstance(records, int) and records > max_recs:
+        exceed_limit = True
+    if exceed_limit:
+        i = 0
+        async for result in self.query_in_chunks_async(records=records, where=where, fields=fields, f=f, chunk_size=chunk_size,
+                                                       max_concurrency=max_concurrency, client=client, **kwargs):
+            if i < 1:
+                server_response = result
+            else:
+                server_response[FEATURES].extend(result[FEATURES])
+            i += 1
+
+    else:
+        if isinstance(records, int) and str(self.currentVersion) >= '10.3':
+            params[RESULT_RECORD_COUNT] = records
+
+        server_response = await self.request_async(query_url, params, client=client)
+    return self._format_server_response(server_response, records)
+
+
+async def query_in_chunks_async(self, where='1=1', fields='*', records=None, chunk_size=None, max_concurrency=10, client=None, oid_strategy=None, **kwargs):
+    """Async counterpart of query_in_chunks(), returns an async generator.  Chunks are
+            requested concurrently and yielded in order.
+
+    Args:
+        fields: Optional fields to return. Default is "*" to return all fields.
+        where: Optional where clause. Defaults to '1=1'.
+        records: Optional number of records to return.  Default is None to
+            return all.
+        chunk_size: Optional. Can be used to override the default chunk size.
+        max_concurrency: Optional maximum number of chunk requests in flight. Defaults to 10.
+        client: Option to specify a custom AsyncRequestClient to perform the requests.
+        oid_strategy: Optional OIDQueryPlan strategy for layers without pagination, see
+            query_in_chunks().
+        kwargs: Optional extra parameters to add to query string passed as keyword arguments.
+    """
+    query_url = self.url + '/query'
+    params = self._validate_params(where=where, fields=fields, **kwargs).copy()
+    if self.json.get(ADVANCED_QUERY_CAPABILITIES, {}).get(SUPPORTS_PAGINATION):
+        params[ORDER_BY_FIELDS] = '{} ASC'.format(self.OIDFieldName)
+        max_recs = chunk_size or self.json.get(MAX_RECORD_COUNT, 1000)
+        params[RESULT_RECORD_COUNT] = max_recs
+        count_params = {k: v for k,v in six.iteritems(params) if k not in (ORDER_BY_FIELDS, RESULT_RECORD_COUNT, OUT_FIELDS)}
+        count_params[RETURN_COUNT_ONLY] = TRUE
+        count_params[RETURN_GEOMETRY] = FALSE
+        total = (await self.request_async(query_url, count_params, client=client)).get(COUNT, 0)
+        if records:
+            total = min([total, records])
+
+        pages = (self.request_async(query_url, dict(params, **{RESULTOFFSET: offset}), client=client)
+                 for offset in six.moves.range(0, total, max_recs))
+        async for next_resp in iter_concurrent_async(pages, max_concurrency):
+            yield next_resp
+    else:
+        id_params = {k: v for k,v in six.iteritems(params) if k not in (OUT_FIELDS, RETURN_GEOMETRY)}
+        id_params[RETURN_IDS_ONLY] = TRUE
+        resp = await self.request_async(query_url, id_params, client=client)
+        oids = resp.get(OBJECT_IDS, [])
+        if not oids:
+            return
+
+        async def fetch_chunk(chunk):
+            chunk_params = self._chunk_params(params, where, chunk)
+            return self._format_server_response(await self.request_async(query_url, chunk_params, client=client))
+
+        plan = self.plan_oid_queries(oids, resp.get(OID_FIELD_NAME, OBJECTID), records, chunk_size, oid_strategy)
+        chunks = (fetch_chunk(chunk) for chunk in plan)
+        async for chunk in iter_concurrent_async(chunks, max_concurrency):
+            yield chunk
+
+
+RESTEndpoint.request_async = request_async
+MapServiceLayer.query_async = query_async
+MapServiceLayer.query_in_chunks_async = query_in_chunks_async
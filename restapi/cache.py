@@ -0,0 +1,551 @@
+"""Caches for service metadata and query results.  Endpoint construction requests
+"?f=json" for every object that is created, the MetadataCache keeps those responses in
+memory (and optionally on disk) so an already known endpoint can be created without a
+round trip.  The QueryCache stores query results on disk, they are reused until the
+edit state of the layer changes.
+"""
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+import tempfile
+from collections import OrderedDict
+from ._compat import replace
+
+__all__ = ['MetadataCache', 'set_metadata_cache', 'get_metadata_cache',
+           'QueryCache', 'set_query_cache', 'get_query_cache']
+
+# GLOBAL METADATA CACHE, disabled by default
+metadataCache = None
+
+# GLOBAL QUERY CACHE, disabled by default
+queryCache = None
+
+
+def token_identity(token):
+    """Returns a short, one way hash identifying a token so it is never stored in clear text.
+
+    Args:
+        token: A token string or restapi.Token, may be None.
+    """
+    token = str(token or '')
+    if not token:
+        return ''
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16]
+
+
+def _decode_json(content):
+    """Decodes a response body with the standard library json module."""
+    return json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+
+
+class MetadataCache(object):
+    """Cache for service metadata keyed on url, request parameters and token identity.
+            Entries are served without a request until the ttl expires.  After that the
+            entry is revalidated with If-None-Match/If-Modified-Since when the server
+            supplied an ETag or Last-Modified header.
+    """
+    def __init__(self, ttl=300, revalidate=True, cache_dir=None, max_entries=1000):
+        """Inits class with expiry settings.
+
+        Args:
+            ttl: Optional number of seconds an entry is used without asking the server.
+                Defaults to 300.
+            revalidate: Optional boolean to make a conditional request for expired entries
+                with an ETag or Last-Modified header. Defaults to True.
+            cache_dir: Optional folder to also store entries on disk, so they survive
+                restarts and can be shared between processes.
+            max_entries: Optional maximum number of entries kept in memory. Defaults to 1000.
+        """
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(url, params=None, token=None):
+        """Creates a cache key.
+
+        Args:
+            url: The endpoint url.
+            params: Optional request parameters, a token parameter is ignored.
+            token: Optional token, only a hash of it is part of the key.
+        """
+        params = {k: str(v) for k,v in (params or {}).items() if k != 'token'}
+        return json.dumps([url.rstrip('/'), params, token_identity(token)], sort_keys=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        """Returns the entry stored for a key, or None.
+
+        Args:
+            key: Cache key from make_key().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # reinserted as the most recently used, OrderedDict has no move_to_end() on python 2
+                self._entries[key] = self._entries.pop(key)
+                return entry
+        if self.cache_dir:
+            try:
+                with open(self._path(key), 'r') as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+            if entry.get('key') != key:
+                return None
+            self._remember(key, entry)
+            return entry
+        return None
+
+    def is_fresh(self, entry):
+        """Checks if an entry can be used without asking the server.
+
+        Args:
+            entry: A cache entry.
+        """
+        return entry is not None and (self.ttl is None or time.time() - entry['stored'] < self.ttl)
+
+    def revalidation_headers(self, entry):
+        """Returns the conditional request headers for an expired entry.
+
+        Args:
+            entry: A cache entry.
+        """
+        headers = {}
+        if entry and self.revalidate:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, key, response_json, headers=None):
+        """Stores a response.
+
+        Args:
+            key: Cache key from make_key().
+            response_json: The JSON response as a dict.
+            headers: Optional response headers for revalidation.
+        """
+        headers = headers or {}
+        entry = {
+            'key': key,
+            'json': response_json,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored': time.time()
+        }
+        self._remember(key, entry)
+        self._write(key, entry)
+        return entry
+
+    def touch(self, key, entry):
+        """Marks an entry as fresh after the server confirmed it has not changed.
+
+        Args:
+            key: Cache key from make_key().
+            entry: A cache entry.
+        """
+        entry['stored'] = time.time()
+        with self._lock:
+            self.revalidated += 1
+        self._remember(key, entry)
+        self._write(key, entry)
+
+    def fetch(self, key, request, decode=None):
+        """Returns a cached response, or makes the request and caches the result.
+
+        Args:
+            key: Cache key from make_key().
+            request: Function that takes a dict of extra request headers and returns
+                a requests.Response.
+            decode: Optional function that decodes the response body (bytes), such as
+                rest_utils.decode_json.  Defaults to the standard library json module.
+
+        Returns:
+            A tuple of (JSON response, requests.Response or None if served from the cache).
+        """
+        entry = self.get(key)
+        if self.is_fresh(entry):
+            with self._lock:
+                self.hits += 1
+            return entry['json'], None
+
+        r = request(self.revalidation_headers(entry))
+        if r.status_code == 304 and entry is not None:
+            self.touch(key, entry)
+            return entry['json'], r
+
+        with self._lock:
+            self.misses += 1
+        response_json = (decode or _decode_json)(r.content)
+        if isinstance(response_json, dict) and 'error' not in response_json:
+            self.put(key, response_json, r.headers)
+        return response_json, r
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _write(self, key, entry):
+        if not self.cache_dir:
+            return
+        # write to a temp file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            replace(tmp, self._path(key))
+        except (IOError, OSError, TypeError, ValueError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def invalidate(self, url=None):
+        """Removes entries from the cache.
+
+        Args:
+            url: Optional endpoint url, if None all entries are removed.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if url is None or json.loads(key)[0] == url.rstrip('/'):
+                    del self._entries[key]
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                if url is not None:
+                    try:
+                        with open(path, 'r') as f:
+                            if json.loads(json.load(f).get('key'))[0] != url.rstrip('/'):
+                                continue
+                    except (IOError, OSError, ValueError, TypeError):
+                        # unreadable entries may belong to another url, leave them to expire
+                        continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    clear = invalidate
+
+    def stats(self):
+        """Returns the number of hits, misses, revalidated and stored entries."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated, 'entries': len(self._entries)}
+
+    def __repr__(self):
+        return '<{}: ttl={}, entries={}>'.format(self.__class__.__name__, self.ttl, len(self._entries))
+
+
+def set_metadata_cache(cache=None, **kwargs):
+    """Enables the global metadata cache used when endpoints are created.
+
+    Args:
+        cache: Optional MetadataCache, if None a new one is created with the keyword
+            arguments. Use False to disable the cache.
+        kwargs: Optional arguments for a new MetadataCache (ttl, revalidate, cache_dir, max_entries).
+    """
+    global metadataCache
+    if cache is False:
+        metadataCache = None
+    else:
+        metadataCache = cache if isinstance(cache, MetadataCache) else MetadataCache(**kwargs)
+    return metadataCache
+
+
+def get_metadata_cache():
+    """Returns the global metadata cache, or None if it is disabled."""
+    return metadataCache
+
+
+class QueryCache(object):
+    """Cache for query results, stored as compressed files on disk.  Entries are keyed on
+            the layer url, the canonicalised query parameters and the token identity.
+            They are valid while the edit state of the layer (editingInfo dates or
+            serverGens) is unchanged, which costs one metadata request per check
+            interval.  For layers that do not report an edit state the ttl is used.
+            The least recently used entries are removed when the cache grows beyond
+            max_bytes.
+    """
+    # parameters that do not change the result
+    IGNORED_PARAMS = ('token', 'f')
+
+    def __init__(self, cache_dir=None, ttl=3600, max_bytes=256 * 1024 * 1024, check_interval=10, compresslevel=6):
+        """Inits class with the cache folder and limits.
+
+        Args:
+            cache_dir: Optional folder for the cache files. Defaults to a "restapi_query_cache"
+                folder in the temp directory.
+            ttl: Optional number of seconds an entry is used for layers without an edit
+                state. Defaults to 3600.
+            max_bytes: Optional maximum size of all cache files. Defaults to 256 MB.
+            check_interval: Optional number of seconds the edit state of a layer is reused
+                before it is requested again, so a chunked query only checks it once.
+                Defaults to 10.
+            compresslevel: Optional gzip compression level. Defaults to 6.
+        """
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'restapi_query_cache')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.compresslevel = compresslevel
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def _canonical(name, value):
+        """Returns a canonical string for a query parameter value."""
+        if isinstance(value, bool):
+            return str(value).lower()
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, sort_keys=True, separators=(',', ':'))
+        value = str(value).strip()
+        if name.lower() == 'outfields':
+            return ','.join(sorted(f.strip().lower() for f in value.split(',') if f.strip()))
+        if name.lower() == 'where':
+            return ' '.join(value.split())
+        if value[:1] in ('{', '['):
+            try:
+                return json.dumps(json.loads(value), sort_keys=True, separators=(',', ':'))
+            except ValueError:
+                pass
+        if value.lower() in ('true', 'false'):
+            return value.lower()
+        return value
+
+    def make_key(self, url, params=None, token=None):
+        """Creates a cache key from a canonical form of the query parameters, so
+                equivalent queries (field order, whitespace in the where clause, key order
+                of JSON geometries) share an entry.
+
+        Args:
+            url: The query url.
+            params: Optional query parameters.
+            token: Optional token, only a hash of it is part of the key.
+        """
+        params = params or {}
+        canonical = {k: self._canonical(k, v) for k,v in params.items()
+                     if k not in self.IGNORED_PARAMS and v not in (None, '')}
+        # geojson responses differ, pbf responses are decoded to json
+        canonical['f'] = 'geojson' if str(params.get('f')).lower() == 'geojson' else 'json'
+        return json.dumps([url.rstrip('/').lower(), canonical, token_identity(token)], sort_keys=True)
+
+    def layer_version(self, url, request):
+        """Returns the edit state of a layer, or None if the layer does not report one.
+                The state is requested at most once per check_interval.
+
+        Args:
+            url: The layer url.
+            request: Function that returns the JSON definition of the layer.
+        """
+        url = url.rstrip('/').lower()
+        with self._lock:
+            checked = self._versions.get(url)
+        if checked and time.time() - checked[0] < self.check_interval:
+            return checked[1]
+        layer_json = request() or {}
+        state = {}
+        editing_info = layer_json.get('editingInfo') or {}
+        for key in ('lastEditDate', 'dataLastEditDate', 'schemaLastEditDate'):
+            if editing_info.get(key) is not None:
+                state[key] = editing_info[key]
+        if layer_json.get('serverGens'):
+            state['serverGens'] = layer_json['serverGens']
+        version = json.dumps(state, sort_keys=True) if state else None
+        with self._lock:
+            self._versions[url] = (time.time(), version)
+        return version
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json.gz')
+
+    def get(self, key, version=None):
+        """Returns the cached response for a key, or None if there is no valid entry.
+
+        Args:
+            key: Cache key from make_key().
+            version: Optional edit state of the layer from layer_version().
+        """
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        if entry.get('key') != key or not self._is_valid(entry, version):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # the modification time orders entries for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry['json']
+
+    def _is_valid(self, entry, version):
+        """Checks if an entry can be used for the current edit state of the layer."""
+        if version is not None:
+            return entry.get('version') == version
+        return entry.get('version') is None and (self.ttl is None or time.time() - entry['stored'] < self.ttl)
+
+    def put(self, key, response_json, version=None):
+        """Stores a response.
+
+        Args:
+            key: Cache key from make_key().
+            response_json: The JSON response as a dict.
+            version: Optional edit state of the layer from layer_version().
+        """
+        if not isinstance(response_json, dict) or 'error' in response_json:
+            return
+        entry = {
+            'key': key,
+            'version': version,
+            'stored': time.time(),
+            'json': response_json
+        }
+        # write to a temp file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compresslevel) as f:
+                    f.write(json.dumps(entry).encode('utf-8'))
+            path = self._path(key)
+            size = os.path.getsize(tmp)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            replace(tmp, path)
+        except (IOError, OSError, TypeError, ValueError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += size - replaced
+        self._evict()
+
+    def _entries(self):
+        """Returns a list of (modification time, size, path) for the cache files."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json.gz'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """Total size of the cache files in bytes."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e[1] for e in self._entries())
+            return self._size
+
+    def _evict(self):
+        """Removes the least recently used entries while the cache is larger than max_bytes."""
+        if not self.max_bytes or self.size <= self.max_bytes:
+            return
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(e[1] for e in entries)
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evicted += 1
+            self._size = total
+
+    def invalidate(self, url=None):
+        """Removes entries from the cache.
+
+        Args:
+            url: Optional layer url, if None all entries are removed.
+        """
+        prefix = url.rstrip('/').lower() if url else None
+        with self._lock:
+            if prefix:
+                self._versions.pop(prefix, None)
+            else:
+                self._versions.clear()
+            for mtime, size, path in self._entries():
+                if prefix:
+                    try:
+                        with gzip.open(path, 'rb') as f:
+                            entry_url = json.loads(json.loads(f.read().decode('utf-8'))['key'])[0]
+                        if entry_url != prefix and not entry_url.startswith(prefix + '/'):
+                            continue
+                    except (IOError, OSError, ValueError, EOFError, KeyError):
+                        # unreadable entries may belong to another layer, leave them to _evict()
+                        continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = None
+
+    clear = invalidate
+
+    def stats(self):
+        """Returns the number of hits, misses, evicted entries and the size of the cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted, 'bytes': self.size}
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.cache_dir)
+
+
+def set_query_cache(cache=None, **kwargs):
+    """Enables the global query cache used by MapServiceLayer queries.
+
+    Args:
+        cache: Optional QueryCache, if None a new one is created with the keyword
+            arguments. Use False to disable the cache.
+        kwargs: Optional arguments for a new QueryCache (cache_dir, ttl, max_bytes, check_interval).
+    """
+    global queryCache
+    if cache is False:
+        queryCache = None
+    else:
+        queryCache = cache if isinstance(cache, QueryCache) else QueryCache(**kwargs)
+    return queryCache
+
+
+def get_query_cache():
+    """Returns the global query cache, or None if it is disabled."""
+    return queryCache
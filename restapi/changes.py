@@ -0,0 +1,154 @@
+"""Incremental extraction of layer edits.  A ChangeSet holds the features added and
+updated since a watermark and the object ids deleted since the last run, together
+with the state for the next run: the new watermark (an edit date or a serverGen)
+and the object ids of the layer, stored compactly as OID ranges.
+"""
+import os
+import json
+import time
+import tempfile
+from array import array
+from ._compat import replace, INT64_TYPECODE
+
+__all__ = ['ChangeSet', 'encode_oid_ranges', 'decode_oid_ranges', 'oid_difference']
+
+
+def encode_oid_ranges(oids):
+    """Returns a list of [first, last] ranges of consecutive object ids.
+
+    Args:
+        oids: Iterable of object ids.
+    """
+    ranges = []
+    for oid in sorted(oids):
+        if ranges and oid <= ranges[-1][1] + 1:
+            ranges[-1][1] = max([ranges[-1][1], oid])
+        else:
+            ranges.append([oid, oid])
+    return ranges
+
+
+def decode_oid_ranges(ranges):
+    """Returns a sorted array of the object ids in a list of [first, last] ranges.
+
+    Args:
+        ranges: List of [first, last] ranges from encode_oid_ranges().
+    """
+    oids = array(INT64_TYPECODE)
+    for first, last in ranges:
+        oids.extend(range(first, last + 1))
+    return oids
+
+
+def oid_difference(a, b):
+    """Returns the object ids that are in a but not in b, both must be sorted.
+
+    Args:
+        a: Sorted sequence of object ids.
+        b: Sorted sequence of object ids.
+    """
+    missing = array(INT64_TYPECODE)
+    j, n = 0, len(b)
+    for oid in a:
+        while j < n and b[j] < oid:
+            j += 1
+        if j >= n or b[j] != oid:
+            missing.append(oid)
+    return missing
+
+
+class ChangeSet(object):
+    """Changes to a layer since the previous run.
+
+    Attributes:
+        url: The layer url.
+        adds: FeatureSet of the features added since the previous run.
+        updates: FeatureSet of the features updated since the previous run.
+        deletes: List of the object ids deleted since the previous run, empty when the
+            object ids of the previous run are unknown.
+        since: The watermark the changes were queried from.
+        watermark: The watermark for the next run, an edit date in milliseconds or a serverGen.
+        method: How the changes were found, "extractChanges", "editorTracking" or "full".
+        oids: Sorted array of the object ids in the layer, used to find deletes next run.
+    """
+    version = 1
+    EXTRACT_CHANGES = 'extractChanges'
+    EDITOR_TRACKING = 'editorTracking'
+    FULL = 'full'
+
+    def __init__(self, url, adds, updates, deletes, since, watermark, method, oids=None):
+        """Inits class with the changes of a layer.
+
+        Args:
+            url: The layer url.
+            adds: FeatureSet of added features.
+            updates: FeatureSet of updated features.
+            deletes: Iterable of deleted object ids.
+            since: The watermark the changes were queried from.
+            watermark: The watermark for the next run.
+            method: How the changes were found.
+            oids: Optional sorted array of the object ids in the layer.
+        """
+        self.url = url
+        self.adds = adds
+        self.updates = updates
+        self.deletes = list(deletes or [])
+        self.since = since
+        self.watermark = watermark
+        self.method = method
+        self.oids = oids
+
+    @property
+    def state(self):
+        """Dict with the state for the next run."""
+        return {
+            'version': self.version,
+            'url': self.url.rstrip('/'),
+            'method': self.method,
+            'watermark': self.watermark,
+            'oids': encode_oid_ranges(self.oids) if self.oids is not None else None,
+            'updated': time.time()
+        }
+
+    @staticmethod
+    def load_state(path):
+        """Loads the state saved by a previous run, returns None if there is none.
+
+        Args:
+            path: Path of the state file.
+        """
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('version') != ChangeSet.version:
+            return None
+        if state.get('oids') is not None:
+            state['oids'] = decode_oid_ranges(state['oids'])
+        return state
+
+    def save(self, path):
+        """Writes the state for the next run, readers never see a partial file.
+
+        Args:
+            path: Path of the state file.
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.state, f)
+            replace(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return path
+
+    def __len__(self):
+        return len(self.adds) + len(self.updates) + len(self.deletes)
+
+    def __repr__(self):
+        return '<{}: {} adds, {} updates, {} deletes ({})>'.format(
+            self.__class__.__name__, len(self.adds), len(self.updates), len(self.deletes), self.method)
@@ -0,0 +1,155 @@
+"""Checkpoints for chunked layer exports.  A checkpoint file is written next to the
+output and records the pages of the export, which of them have been written and the
+state of the writer, so an interrupted export can be resumed instead of restarted.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+from ._compat import replace
+
+__all__ = ['ExportCheckpoint']
+
+# workspaces whose feature classes are not files of their own
+DATABASE_EXTENSIONS = ('.gdb', '.mdb', '.sde', '.gpkg', '.sqlite')
+
+
+class ExportCheckpoint(object):
+    """Progress of a chunked export.
+
+    Attributes:
+        path: Path of the checkpoint file.
+        key: Hash of the export settings, a checkpoint is only resumed by the same export.
+        pages: List of query parameters for each page (an OID range, objectIds or a
+            resultOffset and resultRecordCount).
+        completed: List of page indices that have been written.
+        writer: Dict with the state of the output writer.
+    """
+    version = 1
+
+    def __init__(self, path, key, pages, completed=None, writer=None, created=None):
+        """Inits class with the pages of an export.
+
+        Args:
+            path: Path of the checkpoint file, see path_for().
+            key: Key of the export settings, see make_key().
+            pages: List of query parameters for each page.
+            completed: Optional list of page indices already written.
+            writer: Optional dict with the state of the output writer.
+            created: Optional time the export was started.
+        """
+        self.path = path
+        self.key = key
+        self.pages = pages
+        self.completed = list(completed or [])
+        self.writer = writer or {}
+        self.created = created or time.time()
+        self._completed = set(self.completed)
+
+    @staticmethod
+    def path_for(out_fc):
+        """Returns the checkpoint path for an output.  The checkpoint is stored next to
+                the output, or next to its geodatabase for a feature class in a geodatabase.
+
+        Args:
+            out_fc: Full path to the output feature class or shapefile.
+        """
+        folder, name = os.path.split(os.path.abspath(out_fc))
+        names = [os.path.splitext(name)[0]]
+        head = folder
+        while head and os.path.dirname(head) != head:
+            if os.path.splitext(head)[1].lower() in DATABASE_EXTENSIONS:
+                folder, gdb = os.path.split(head)
+                names.insert(0, gdb.replace('.', '_'))
+                break
+            head = os.path.dirname(head)
+        return os.path.join(folder, '_'.join(names) + '.restapi_checkpoint.json')
+
+    @staticmethod
+    def make_key(url, out_fc, **settings):
+        """Returns a key for the settings of an export.
+
+        Args:
+            url: The layer url.
+            out_fc: The output path.
+            settings: The query settings (where clause, fields, records, etc.).
+        """
+        return hashlib.sha1(json.dumps([url.rstrip('/').lower(), os.path.abspath(out_fc), settings],
+                                       sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def load(cls, path):
+        """Loads a checkpoint, returns None if it does not exist or cannot be read.
+
+        Args:
+            path: Path of the checkpoint file.
+        """
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('version') != cls.version:
+            return None
+        return cls(path, data['key'], data['pages'], data.get('completed'), data.get('writer'), data.get('created'))
+
+    def is_complete(self, index):
+        """Checks if a page has been written.
+
+        Args:
+            index: Index of the page.
+        """
+        return index in self._completed
+
+    @property
+    def remaining(self):
+        """Indices of the pages that have not been written."""
+        return [i for i in range(len(self.pages)) if i not in self._completed]
+
+    @property
+    def done(self):
+        """True when all pages have been written."""
+        return len(self._completed) >= len(self.pages)
+
+    def complete(self, index, **writer):
+        """Marks a page as written and saves the checkpoint.
+
+        Args:
+            index: Index of the page.
+            writer: Optional new state of the output writer.
+        """
+        if index not in self._completed:
+            self._completed.add(index)
+            self.completed.append(index)
+        self.writer.update(writer)
+        self.save()
+
+    def save(self):
+        """Writes the checkpoint file, readers never see a partial file."""
+        folder = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'version': self.version,
+                    'key': self.key,
+                    'created': self.created,
+                    'updated': time.time(),
+                    'pages': self.pages,
+                    'completed': self.completed,
+                    'writer': self.writer
+                }, f)
+            replace(tmp, self.path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def remove(self):
+        """Deletes the checkpoint file."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __repr__(self):
+        return '<{}: {} of {} pages>'.format(self.__class__.__name__, len(self._completed), len(self.pages))
@@ -0,0 +1,449 @@
+"""Columnar storage for feature sets.  Each attribute field is held in a typed array
+(chosen from the Esri field type) with a null mask, and the geometries in a flat
+coordinate buffer with part and geometry offsets, so a large feature set takes a
+fraction of the memory of a list of feature dicts.  Columns convert to NumPy arrays
+when NumPy is installed, and back to Esri JSON features for applyEdits.
+"""
+import six
+from array import array
+from collections import OrderedDict
+from ._strings import *
+from ._compat import INT64_TYPECODE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['ColumnarFeatureSet', 'Column', 'GeometryColumn']
+
+# array typecodes by field type, other types are kept in a list
+TYPECODES = {
+    OID: INT64_TYPECODE,
+    SHORT_FIELD: 'h',
+    LONG_FIELD: 'i',
+    BIG_INTEGER_FIELD: INT64_TYPECODE,
+    FLOAT_FIELD: 'f',
+    DOUBLE_FIELD: 'd',
+    DATE_FIELD: INT64_TYPECODE,
+}
+
+NAN = float('nan')
+
+
+class Column(object):
+    """A column of attribute values.
+
+    Attributes:
+        name: The field name.
+        type: The Esri field type.
+        values: An array of the values, or a list for text and other types.  Null values
+            are stored as 0 in arrays.
+        mask: A bytearray that is 1 where the value is null.
+    """
+
+    def __init__(self, name, field_type, values=None, mask=None):
+        """Inits class with a field.
+
+        Args:
+            name: The field name.
+            field_type: The Esri field type, dates are stored as epoch milliseconds.
+            values: Optional initial values array or list.
+            mask: Optional initial null mask.
+        """
+        self.name = name
+        self.type = field_type
+        self.typecode = TYPECODES.get(field_type)
+        if values is None:
+            values = array(self.typecode) if self.typecode else []
+        self.values = values
+        self.mask = mask if mask is not None else bytearray(len(values))
+        self._cast = float if self.typecode in ('f', 'd') else int if self.typecode else None
+
+    def append(self, value):
+        """Adds a value to the column.
+
+        Args:
+            value: The attribute value, or None.
+        """
+        if value is None:
+            self.values.append(0 if self.typecode else None)
+            self.mask.append(1)
+        else:
+            self.values.append(self._cast(value) if self._cast else value)
+            self.mask.append(0)
+
+    @property
+    def null_count(self):
+        """The number of null values."""
+        return self.mask.count(1)
+
+    def to_list(self):
+        """Returns the values as a list with None for nulls."""
+        values = self.values.tolist() if self.typecode else list(self.values)
+        if self.null_count:
+            return [None if null else v for v, null in zip(values, self.mask)]
+        return values
+
+    def to_numpy(self):
+        """Returns the values as a NumPy array without copying, or a masked array when
+                there are nulls.  Text and other types are returned as object arrays.
+
+        Raises:
+            ImportError: NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required to convert columns to arrays')
+        if self.typecode:
+            values = numpy.frombuffer(self.values, dtype=numpy.dtype(self.typecode)) if len(self.values) else numpy.array([], dtype=self.typecode)
+        else:
+            values = numpy.array(self.values, dtype=object)
+        if self.null_count:
+            return numpy.ma.masked_array(values, mask=numpy.frombuffer(bytes(self.mask), dtype=numpy.bool_))
+        return values
+
+    def take(self, indices):
+        """Returns a new column with the values at the indices.
+
+        Args:
+            indices: Iterable of row indices.
+        """
+        indices = list(indices)
+        values = array(self.typecode, [self.values[i] for i in indices]) if self.typecode else [self.values[i] for i in indices]
+        return Column(self.name, self.type, values, bytearray(self.mask[i] for i in indices))
+
+    def __getitem__(self, index):
+        return None if self.mask[index] else self.values[index]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __repr__(self):
+        return '<{}: {} ({}, {} rows)>'.format(self.__class__.__name__, self.name, self.type, len(self))
+
+
+class GeometryColumn(object):
+    """A column of geometries as a flat coordinate buffer.
+
+    Attributes:
+        geometry_type: The Esri geometry type.
+        has_z: True if the coordinates have z values.
+        has_m: True if the coordinates have m values.
+        coords: Array of the coordinates, x, y, then z and/or m for each vertex.
+        part_offsets: Array of the first vertex of each part, with the vertex count
+            appended.  A point is a single part with one vertex.
+        geometry_offsets: Array of the first part of each geometry, with the part count
+            appended.
+        mask: A bytearray that is 1 where the geometry is null.
+    """
+
+    def __init__(self, geometry_type, has_z=False, has_m=False):
+        """Inits class with a geometry type.
+
+        Args:
+            geometry_type: The Esri geometry type.
+            has_z: Optional boolean for z values. Defaults to False.
+            has_m: Optional boolean for m values. Defaults to False.
+
+        Raises:
+            ValueError: The geometry type is not supported.
+        """
+        if geometry_type not in (ESRI_POINT, ESRI_MULTIPOINT, ESRI_POLYLINE, ESRI_POLYGON):
+            raise ValueError('Geometry type "{}" cannot be stored in columns'.format(geometry_type))
+        self.geometry_type = geometry_type
+        self.has_z = bool(has_z)
+        self.has_m = bool(has_m)
+        self.stride = 2 + self.has_z + self.has_m
+        self.coords = array('d')
+        self.part_offsets = array(INT64_TYPECODE, [0])
+        self.geometry_offsets = array(INT64_TYPECODE, [0])
+        self.mask = bytearray()
+        self._key = {ESRI_MULTIPOINT: POINTS, ESRI_POLYLINE: PATHS, ESRI_POLYGON: RINGS}.get(geometry_type)
+
+    def append(self, geometry):
+        """Adds a geometry to the column.
+
+        Args:
+            geometry: Esri JSON geometry dict, or None.
+
+        Raises:
+            ValueError: The geometry has curves.
+        """
+        if not geometry or (self._key is None and geometry.get('x') is None):
+            self.geometry_offsets.append(self.geometry_offsets[-1])
+            self.mask.append(1)
+            return
+        if self._key is None:
+            coords = [geometry['x'], geometry['y']]
+            if self.has_z:
+                coords.append(geometry.get('z'))
+            if self.has_m:
+                coords.append(geometry.get('m'))
+            self.coords.extend(NAN if v is None else v for v in coords)
+            self.part_offsets.append(self.part_offsets[-1] + 1)
+        else:
+            if 'curvePaths' in geometry or 'curveRings' in geometry:
+                raise ValueError('Curve geometries cannot be stored in columns')
+            parts = [geometry.get(self._key) or []] if self._key == POINTS else geometry.get(self._key) or []
+            stride = self.stride
+            for part in parts:
+                for vertex in part:
+                    if len(vertex) == stride and None not in vertex:
+                        self.coords.extend(vertex)
+                    else:
+                        vertex = [NAN if v is None else v for v in vertex[:stride]]
+                        self.coords.extend(vertex + [NAN] * (stride - len(vertex)))
+                self.part_offsets.append(self.part_offsets[-1] + len(part))
+        self.geometry_offsets.append(len(self.part_offsets) - 1)
+        self.mask.append(0)
+
+    def _geometry(self, values, part_offsets, first, last, offset=0):
+        """Returns a geometry dict from coordinate and part offset sequences.
+
+        Args:
+            values: Sequence of coordinates starting at vertex offset.
+            part_offsets: Sequence of part offsets.
+            first: Index of the first part.
+            last: Index after the last part.
+            offset: Optional vertex index of the first value. Defaults to 0.
+        """
+        stride = self.stride
+        parts = []
+        for p in six.moves.range(first, last):
+            coords = iter(values[(part_offsets[p] - offset) * stride:(part_offsets[p + 1] - offset) * stride])
+            if stride == 2:
+                parts.append(list(map(list, zip(coords, coords))))
+            else:
+                # missing z and m values are stored as NaN
+                parts.append([[None if v != v else v for v in vertex] for vertex in zip(*[coords] * stride)])
+        if self._key is None:
+            vertex = parts[0][0]
+            geometry = {'x': vertex[0], 'y': vertex[1]}
+            if self.has_z:
+                geometry['z'] = vertex[2]
+            if self.has_m:
+                geometry['m'] = vertex[-1]
+            return geometry
+        geometry = {self._key: parts[0] if self._key == POINTS else parts}
+        if self.has_z:
+            geometry[HAS_Z] = True
+        if self.has_m:
+            geometry[HAS_M] = True
+        return geometry
+
+    def get(self, index):
+        """Returns the Esri JSON geometry dict at an index, or None.
+
+        Args:
+            index: The row index.
+        """
+        if self.mask[index]:
+            return None
+        first, last = self.geometry_offsets[index], self.geometry_offsets[index + 1]
+        start, end = self.part_offsets[first], self.part_offsets[last]
+        values = self.coords[start * self.stride:end * self.stride].tolist()
+        return self._geometry(values, self.part_offsets, first, last, start)
+
+    def iter_geometries(self):
+        """Yields the Esri JSON geometry dicts, or None for null geometries."""
+        values, part_offsets, geometry_offsets = self.coords.tolist(), self.part_offsets.tolist(), self.geometry_offsets.tolist()
+        for i, null in enumerate(self.mask):
+            yield None if null else self._geometry(values, part_offsets, geometry_offsets[i], geometry_offsets[i + 1])
+
+    def take(self, indices):
+        """Returns a new geometry column with the geometries at the indices.
+
+        Args:
+            indices: Iterable of row indices.
+        """
+        column = GeometryColumn(self.geometry_type, self.has_z, self.has_m)
+        stride = self.stride
+        for i in indices:
+            if self.mask[i]:
+                column.append(None)
+                continue
+            first, last = self.geometry_offsets[i], self.geometry_offsets[i + 1]
+            start, end = self.part_offsets[first], self.part_offsets[last]
+            column.coords.extend(self.coords[start * stride:end * stride])
+            shift = column.part_offsets[-1] - start
+            column.part_offsets.extend(self.part_offsets[p] + shift for p in six.moves.range(first + 1, last + 1))
+            column.geometry_offsets.append(len(column.part_offsets) - 1)
+            column.mask.append(0)
+        return column
+
+    def to_numpy(self):
+        """Returns the coordinates as an (n, stride) NumPy array without copying.
+
+        Raises:
+            ImportError: NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required to convert columns to arrays')
+        return numpy.frombuffer(self.coords, dtype=numpy.float64).reshape(-1, self.stride)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __repr__(self):
+        return '<{}: {} ({} rows, {} vertices)>'.format(self.__class__.__name__, self.geometry_type, len(self), len(self.coords) // self.stride)
+
+
+class ColumnarFeatureSet(object):
+    """A feature set stored as columns, see FeatureSet.to_columns().
+
+    Attributes:
+        json: The feature set properties without features (fields, geometryType,
+            spatialReference, etc.).
+        columns: OrderedDict of the attribute Columns by field name.
+        geometry: The GeometryColumn, or None if the features have no geometry.
+    """
+
+    def __init__(self, json, columns, geometry=None):
+        """Inits class with columns.
+
+        Args:
+            json: The feature set properties without features.
+            columns: OrderedDict of Columns by field name.
+            geometry: Optional GeometryColumn.
+        """
+        self.json = json
+        self.columns = columns
+        self.geometry = geometry
+
+    @classmethod
+    def from_features(cls, features, json, fields=None):
+        """Builds the columns from an iterable of feature dicts, which are read once.
+
+        Args:
+            features: Iterable of Esri JSON feature dicts.
+            json: The feature set properties (fields, geometryType, spatialReference, etc.).
+            fields: Optional list of field names to keep.  Defaults to None (all fields).
+        """
+        json = OrderedDict((k, v) for k, v in six.iteritems(json) if k != FEATURES)
+        keep = set(f.lower() for f in fields) if fields else None
+        field_defs = [f for f in json.get(FIELDS) or []
+                      if f.get(TYPE) != SHAPE and (keep is None or f[NAME].lower() in keep)]
+        if keep is not None:
+            json[FIELDS] = field_defs
+        columns = OrderedDict((f[NAME], Column(f[NAME], f.get(TYPE))) for f in field_defs)
+        geometry = None
+        if json.get(GEOMETRY_TYPE):
+            geometry = GeometryColumn(json[GEOMETRY_TYPE], json.get(HAS_Z), json.get(HAS_M))
+
+        names = list(columns)
+        appends = [columns[name].append for name in names]
+        for feature in features:
+            attributes = feature.get(ATTRIBUTES) or {}
+            for name, append in zip(names, appends):
+                append(attributes.get(name))
+            if geometry is not None:
+                geometry.append(feature.get(GEOMETRY))
+        if geometry is not None and len(geometry) and all(geometry.mask):
+            # no geometries were returned (returnGeometry=false)
+            geometry = None
+        return cls(json, columns, geometry)
+
+    @classmethod
+    def from_feature_set(cls, feature_set, fields=None):
+        """Builds the columns from a FeatureSet or PagedFeatureSet, a PagedFeatureSet is
+                converted page by page.
+
+        Args:
+            feature_set: The FeatureSet.
+            fields: Optional list of field names to keep.  Defaults to None (all fields).
+        """
+        return cls.from_features(feature_set.features, feature_set.json, fields)
+
+    @property
+    def fields(self):
+        """The field definitions."""
+        return self.json.get(FIELDS) or []
+
+    @property
+    def field_names(self):
+        """The attribute field names."""
+        return list(self.columns)
+
+    def iter_features(self, fields=None, geometry=True):
+        """Yields the rows as Esri JSON feature dicts, for example to use as adds or
+                updates with applyEdits().
+
+        Args:
+            fields: Optional list of field names to include.  Defaults to None (all fields).
+            geometry: Optional boolean to include the geometry. Defaults to True.
+        """
+        names = [n for n in self.columns if not fields or n in fields]
+        values = [self.columns[n].to_list() for n in names]
+        rows = zip(*values) if values else ([] for _ in six.moves.range(len(self)))
+        if not geometry or self.geometry is None:
+            for row in rows:
+                yield {ATTRIBUTES: dict(zip(names, row))}
+            return
+        for row, shape in zip(rows, self.geometry.iter_geometries()):
+            yield {ATTRIBUTES: dict(zip(names, row)), GEOMETRY: shape}
+
+    def to_features(self, fields=None, geometry=True):
+        """Returns the rows as a list of Esri JSON feature dicts, see iter_features()."""
+        return list(self.iter_features(fields, geometry))
+
+    def to_json(self):
+        """Returns the Esri JSON feature set dict."""
+        json = OrderedDict(self.json)
+        json[FEATURES] = self.to_features()
+        return json
+
+    def to_feature_set(self):
+        """Returns a FeatureSet of the rows."""
+        from .rest_utils import FeatureSet
+        return FeatureSet(self.to_json())
+
+    def to_numpy(self):
+        """Returns an OrderedDict of NumPy arrays by field name, see Column.to_numpy()."""
+        return OrderedDict((name, column.to_numpy()) for name, column in six.iteritems(self.columns))
+
+    def take(self, indices):
+        """Returns a new ColumnarFeatureSet with the rows at the indices.
+
+        Args:
+            indices: Iterable of row indices.
+        """
+        indices = list(indices)
+        columns = OrderedDict((name, column.take(indices)) for name, column in six.iteritems(self.columns))
+        geometry = self.geometry.take(indices) if self.geometry is not None else None
+        return ColumnarFeatureSet(OrderedDict(self.json), columns, geometry)
+
+    def where(self, predicate):
+        """Returns the row indices where a function of the row values is true.
+
+        Args:
+            predicate: Function that takes a dict of the attribute values of a row.
+        """
+        names = list(self.columns)
+        values = [self.columns[n].to_list() for n in names]
+        return [i for i, row in enumerate(zip(*values)) if predicate(dict(zip(names, row)))]
+
+    def __getitem__(self, name):
+        """Returns the Column of a field, "SHAPE@" returns the GeometryColumn."""
+        if name == SHAPE_TOKEN:
+            return self.geometry
+        try:
+            return self.columns[name]
+        except KeyError:
+            for key, column in six.iteritems(self.columns):
+                if key.lower() == name.lower():
+                    return column
+            raise
+
+    def __len__(self):
+        if self.columns:
+            return len(next(iter(self.columns.values())))
+        return len(self.geometry) if self.geometry is not None else 0
+
+    def __repr__(self):
+        return '<{}: {} rows, {} columns>'.format(self.__class__.__name__, len(self), len(self.columns))
@@ -5,17 +5,29 @@ import sqlite3
 import base64
 import shutil
 import contextlib
+import hashlib
+import bisect
+import operator
 from .rest_utils import *
 from .exceptions import AuthExceptionCodes, RestAPIException
 from .decorator import decorator
 import sys
 import warnings
-from munch import munchify
 from . import projections
 from .conversion import *
+from .pbf import decode_feature_collection
+from .checkpoint import ExportCheckpoint
+from .aggregates import StatisticsMerger
+from .changes import ChangeSet, oid_difference
+from .quantization import GEOMETRY_PRESETS, units_per_meter, reduction_params, dequantize
+from .geoparquet import GeoParquetWriter, PARQUET_EXTENSIONS
+from .arrow_utils import ArrowConverter
+from .pandas_utils import dataframe_to_features, GEOMETRY_COLUMN
+from ._compat import INT64_TYPECODE
 
 import six
-from six.moves import urllib, zip_longest
+from six.moves import urllib
+from array import array
 
 DEFAULT_REQUEST_FORMAT = JSON
 DEFAULT_FEATURESET_CLASS = FeatureSet
@@ -288,11 +300,37 @@ def exportFeatureSet_os(feature_set, out_fc, outSR=None, **kwargs):
             outSR: Optional output spatial reference.  If none set, will default
                 to SR of result_query feature set. Defaults to None.
 
+        Returns:
+            Feature class.
+        """
+        return export_feature_sets_os([feature_set], out_fc, outSR)
+
+def export_feature_sets_os(feature_sets, out_fc, outSR=None, state=None, callback=None):
+        """Exports several feature sets with the same schema to one shapefile, only one
+                feature set is held in memory at a time.
+
+        Args:
+            feature_sets: Iterable of feature sets, the first one defines the schema.
+            out_fc: Output shapefile.
+            outSR: Optional output spatial reference.  If none set, will default
+                to SR of the first feature set. Defaults to None.
+            state: Optional writer state passed to a callback by an earlier export that
+                did not finish, the feature sets are appended to its shapefile.
+            callback: Optional function called with the writer state (see
+                shp_helper.ShpWriter.get_state()) after each feature set is written.
+
         Returns:
             Feature class.
         """
         from . import shp_helper
         out_fc = validate_name(out_fc)
+        feature_sets = iter(feature_sets)
+        feature_set = next(feature_sets, None)
+        if feature_set is None and state:
+            # all feature sets were written before, only the headers are missing
+            shp_helper.ShpWriter(out_fc, state=state).save()
+            print('Created: "{0}"'.format(out_fc))
+            return out_fc
         # validate features input (should be list or dict, preferably list)
         if not isinstance(feature_set, (FeatureSet, FeatureCollection)):
             feature_set = FeatureSet(feature_set)
@@ -311,8 +349,12 @@ def exportFeatureSet_os(feature_set, out_fc, outSR=None, **kwargs):
 
         g_type = getattr(feature_set, GEOMETRY_TYPE)
 
-        # add all fields
-        w = shp_helper.ShpWriter(out_fc, G_DICT[g_type].upper())
+        w = shp_helper.ShpWriter(out_fc, G_DICT[g_type].upper(), state=state)
+        if not state:
+            # write projection file
+            project(out_fc, outSR)
+
+        # add all fields, an appended shapefile already has them
         field_map = []
         for fld in fields:
             if fld.type not in [OID, SHAPE] + list(SKIP_FIELDS.keys()):
@@ -325,21 +367,24 @@ def exportFeatureSet_os(feature_set, out_fc, outSR=None, **kwargs):
                     field_name = fld.name.split('.')[-1][:10]
                     field_type = SHP_FTYPES[fld.type]
                     field_length = str(min([fld.length if hasattr(fld, 'length') else 50, 255]))
-                    w.add_field(field_name, field_type, field_length)
+                    if not state:
+                        w.add_field(field_name, field_type, field_length)
                     field_map.append((fld.name, field_name))
 
         # search cursor to write rows
         s_fields = [fl for fl in fields if fl.name in [f[0] for f in field_map]]
-        for feat in feature_set:
-            # print(feat)
-            row = [datetime_to_datestring(feat.get(field)) if field in date_fields else feat.get(field) for field in [f[0] for f in field_map]]
-            w.add_row(feat.getGeometry().asShape(), *row)
+        for fs in itertools.chain([feature_set], feature_sets):
+            if not isinstance(fs, (FeatureSet, FeatureCollection)):
+                fs = FeatureSet(fs)
+            for feat in fs:
+                # print(feat)
+                row = [datetime_to_datestring(feat.get(field)) if field in date_fields else feat.get(field) for field in [f[0] for f in field_map]]
+                w.add_row(feat.getGeometry().asShape(), *row)
+            if callback:
+                callback(w.get_state())
 
         w.save()
         print('Created: "{0}"'.format(out_fc))
-
-        # write projection file
-        project(out_fc, outSR)
         return out_fc
 
 if has_arcpy:
@@ -442,6 +487,8 @@ class Row(object):
         feature: A feature JSON object.
         spatialReference: A spatial reference.
     """
+    __slots__ = ('cursor', 'spatialReference', '_json', '_feature')
+
     def __init__(self, cursor, feature, spatialReference=None):
         """Row object for Cursor.
 
@@ -450,9 +497,17 @@ class Row(object):
             spatialReference: A spatial reference.
         """
         self.cursor = cursor
-        self.feature = Feature(feature) if not isinstance(feature, Feature) else feature
+        self._feature = feature if isinstance(feature, Feature) else None
+        self._json = feature.json if isinstance(feature, Feature) else feature
         self.spatialReference = spatialReference or self.cursor.spatialReference
 
+    @property
+    def feature(self):
+        """The restapi Feature() of the row, created when first used."""
+        if self._feature is None:
+            self._feature = Feature(self._json)
+        return self._feature
+
     def get(self, field):
         """Gets/returns an attribute by field name.
 
@@ -483,25 +538,7 @@ class Row(object):
     @property
     def values(self):
         """Returns values as tuple."""
-        # fix date format in milliseconds to datetime.datetime()
-        vals = []
-        for field in self.cursor.fieldOrder:
-            if field in self.cursor.date_fields and self.get(field):
-                vals.append(mil_to_date(self.get(field)))
-            elif field in self.cursor.long_fields and self.get(field):
-                vals.append(int(self.get(field)))
-            else:
-                if field == OID_TOKEN:
-                    vals.append(self.oid)
-                elif field == SHAPE_TOKEN:
-                    if self.geometry:
-                        vals.append(self.geometry.asShape())
-                    else:
-                        vals.append(None) #null Geometry
-                else:
-                    vals.append(self.get(field))
-
-        return tuple(vals)
+        return self.cursor.row_function(self._json, self.spatialReference)
 
     def __getitem__(self, i):
         """Allows for getting a field value by index.
@@ -516,6 +553,7 @@ class Row(object):
 class Cursor(object):
     json = {}
     fieldOrder = []
+    _row_function = None
     # field_names = []
 
     def __init__(self, feature_set, fieldOrder='*'):
@@ -543,9 +581,16 @@ class Cursor(object):
         return self
 
     def __exit__(self, type, value, traceback):
+        self.close()
         if isinstance(type, Exception):
             raise type(value)
 
+    def close(self):
+        """Stops fetching the remaining chunks of a lazy feature set."""
+        close = getattr(self.featureSet, 'close', None)
+        if close is not None:
+            close()
+
     @property
     def features(self):
         return self.featureSet.features
@@ -586,6 +631,75 @@ class Cursor(object):
                 names.append(f)
         return names
 
+    @property
+    def row_function(self):
+        """Function that returns the values of a feature in the field order as a tuple,
+                see _compile_row().
+        """
+        if self._row_function is None:
+            self._row_function = self._compile_row()
+        return self._row_function
+
+    def _compile_row(self):
+        """Compiles the field order into a function that takes a feature dict and a spatial
+                reference and returns the row values.  The field types are looked up once
+                here instead of for every field of every row: plain fields are read with an
+                itemgetter of the attributes, dates are converted to datetime.datetime(), long
+                integers are cast to int and "SHAPE@" returns the shape of the geometry.
+        """
+        fields = list(self.fieldOrder)
+        date_fields, long_fields = set(self.date_fields), set(self.long_fields)
+        oid_name = getattr(self.featureSet, 'OIDFieldName', None)
+        props = PROPERTIES if self.type == GEOJSON_FORMAT else ATTRIBUTES
+        is_esri_json = self.type == ESRI_JSON_FORMAT
+
+        def to_date(value):
+            return mil_to_date(value) if value else value
+
+        def to_long(value):
+            return int(value) if value else value
+
+        # attribute names read for each field, tokens are resolved from the feature
+        names = [oid_name if f == OID_TOKEN else f for f in fields]
+        converters = [to_date if f in date_fields else to_long if f in long_fields else None for f in fields]
+        shape_index = [i for i, f in enumerate(fields) if f == SHAPE_TOKEN]
+
+        def get_shape(feature, spatialReference):
+            geometry = feature.get(GEOMETRY)
+            if geometry is None:
+                return None
+            gd = dict(geometry)
+            if is_esri_json and SPATIAL_REFERENCE not in gd and spatialReference:
+                gd[SPATIAL_REFERENCE] = spatialReference
+            return Geometry(gd).asShape()
+
+        if not shape_index and not any(converters) and len(names) > 1:
+            getter = operator.itemgetter(*names)
+
+            def row_values(feature, spatialReference=None):
+                attributes = feature.get(props) or {}
+                try:
+                    return getter(attributes)
+                except KeyError:
+                    # missing attributes are null
+                    return tuple(attributes.get(n) for n in names)
+            return row_values
+
+        steps = tuple(zip(names, converters, [f == SHAPE_TOKEN for f in fields]))
+
+        def row_values(feature, spatialReference=None):
+            attributes = feature.get(props) or {}
+            values = []
+            for name, convert, is_shape in steps:
+                if is_shape:
+                    values.append(get_shape(feature, spatialReference))
+                elif convert is None:
+                    values.append(attributes.get(name))
+                else:
+                    values.append(convert(attributes.get(name)))
+            return tuple(values)
+        return row_values
+
     def _createRow(self, feature, spatialReference=None):
         """Creates a row based off of the feature and spatial reference."""
         return Row(self, feature, spatialReference or self.spatialReference)
@@ -597,8 +711,9 @@ class Cursor(object):
 
     def rows(self):
         """Returns Cursor.rows() as generator."""
+        row_values, spatialReference = self.row_function, self.spatialReference
         for feature in self.features:
-            yield self._createRow(feature, self.spatialReference).values
+            yield row_values(feature.json if isinstance(feature, Feature) else feature, spatialReference)
 
     def getRow(self, index):
         """Returns row object at index."""
@@ -659,8 +774,18 @@ class Cursor(object):
         """Returns Cursor.rows()."""
         return self.rows()
 
+    @property
+    def count(self):
+        """Returns the number of rows, a lazy cursor requests the count from the server."""
+        return self.featureSet.count
+
     def __len__(self):
-        return len(self.features)
+        return len(self.featureSet)
+
+    def __bool__(self):
+        return bool(self.featureSet)
+
+    __nonzero__ = __bool__
 
     def __repr__(self):
         return object.__repr__(self)
@@ -772,7 +897,7 @@ class InsertCursor(object):
 
 
 class SearchCursor(Cursor):
-    def __init__(self, layer, fields='*', where='1=1', records=None, exceed_limit=False, **kwargs):
+    def __init__(self, layer, fields='*', where='1=1', records=None, exceed_limit=False, lazy=False, prefetch=None, **kwargs):
         """Runs Cursor on layer, helper method that calls Cursor Object.
 
         Args:
@@ -786,9 +911,19 @@ class SearchCursor(Cursor):
                 option may be time consuming because the ArcGIS REST API uses
                 default maxRecordCount of 1000, so queries must be performed in
                 chunks to get all records.
+            lazy: Optional boolean to fetch the chunks while the rows are iterated when
+                exceed_limit is True, instead of loading all records first.  Only one chunk
+                is held in memory at a time and the rows can only be iterated once.
+                Defaults to False.
+            prefetch: Optional number of chunks to download ahead of the rows being iterated
+                on a background thread, implies lazy.  Use the cursor in a with statement,
+                or call close(), to stop the download when iteration ends early. Defaults to None.
         """
 
-        feature_set = layer.query(where=where, fields=layer._fix_fields(fields), records=records, exceed_limit=exceed_limit, **kwargs)
+        if not layer._returns_geometry(fields):
+            kwargs.setdefault(RETURN_GEOMETRY, FALSE)
+        feature_set = layer.query(where=where, fields=layer._fix_fields(fields), records=records, exceed_limit=exceed_limit,
+                                  lazy=lazy or bool(prefetch), prefetch=prefetch, **kwargs)
         super(SearchCursor, self).__init__(feature_set, fields)
         self.layer = layer
 
@@ -808,7 +943,13 @@ class UpdateCursor(Cursor):
                 and attachments in the adds, updates, deletes, and
                 attachments parameters are identified by their globalIds.
         """
-        feature_set = layer.query(where=where, fields=layer._fix_fields(fieldOrder), records=records, exceed_limit=exceed_limit, f=JSON, **kwargs)
+        # edits look up features by OID, so all features are needed in memory
+        kwargs.pop('lazy', None)
+        # geometries are written back with the edits, so they are never reduced
+        query_kwargs = dict(kwargs, geometry_reduction=None)
+        if not layer._returns_geometry(fieldOrder):
+            query_kwargs.setdefault(RETURN_GEOMETRY, FALSE)
+        feature_set = layer.query(where=where, fields=layer._fix_fields(fieldOrder), records=records, exceed_limit=exceed_limit, f=JSON, **query_kwargs)
         super(UpdateCursor, self).__init__(feature_set, fieldOrder)
         self.useGlobalIds = useGlobalIds
         self._deletes = []
@@ -824,7 +965,7 @@ class UpdateCursor(Cursor):
         }
         self._kwargs = {}
         for k,v in six.iteritems(kwargs):
-            if k not in('feature_set', 'fieldOrder', 'auto_save'):
+            if k not in('feature_set', 'fieldOrder', 'auto_save', 'geometry_reduction'):
                 self._kwargs[k] = v
 
     @property
@@ -940,8 +1081,8 @@ class UpdateCursor(Cursor):
 
     def rows(self):
         """Returns Cursor.rows() as generator."""
-        for feature in self.features:
-            yield list(self._createRow(feature, self.spatialReference).values)
+        for values in super(UpdateCursor, self).rows():
+            yield list(values)
 
     def _get_oid(self, row):
         """Returns the oid of a row.
@@ -1519,8 +1660,389 @@ class Portal(RESTEndpoint):
         return '<{}: "{}">'.format(self.__class__.__name__, self.portalHostname)
 
 
+class OIDQueryPlan(object):
+    """Plans the requests to fetch a set of object ids in chunks.  Each chunk is
+            either queried with a contiguous OID range in the where clause, or with
+            an exact objectIds list when the OIDs are sparse and a range would make
+            the server scan many deleted or filtered out records.  The OIDs are kept
+            in a compact array instead of a list.
+
+    Attributes:
+        oids: Sorted array of object ids.
+        oid_name: Name of the OID field.
+        chunk_size: Number of records per request.
+        strategy: The chosen plan: "ranges", "objectIds" or "hybrid" (both).
+    """
+    RANGES = 'ranges'
+    OBJECT_IDS = 'objectIds'
+    HYBRID = 'hybrid'
+    AUTO = 'auto'
+
+    def __init__(self, oids, oid_name, chunk_size=1000, strategy=AUTO, min_density=0.5, max_records=None):
+        """Inits class with the object ids to fetch.
+
+        Args:
+            oids: Iterable of object ids.
+            oid_name: Name of the OID field.
+            chunk_size: Optional number of records per request. Defaults to 1000.
+            strategy: Optional strategy, "ranges" or "objectIds" to use only one kind of
+                query, or "auto" to choose per chunk. Defaults to "auto".
+            min_density: Optional fraction of a chunk's OID range that must exist to query
+                it as a range when the strategy is "auto". Defaults to 0.5.
+            max_records: Optional maximum number of records, only the lowest OIDs are fetched.
+        """
+        if strategy not in (self.AUTO, self.RANGES, self.OBJECT_IDS):
+            raise ValueError('Invalid OID query strategy: "{}"'.format(strategy))
+        self.oids = array(INT64_TYPECODE, sorted(oids))
+        if max_records is not None:
+            self.oids = self.oids[:max_records]
+        self.oid_name = oid_name
+        self.chunk_size = max([int(chunk_size), 1])
+        self.min_density = min_density
+
+        # (start, stop, use range) for each chunk
+        self.chunks = []
+        for start in six.moves.range(0, len(self.oids), self.chunk_size):
+            stop = min([start + self.chunk_size, len(self.oids)])
+            if strategy == self.AUTO:
+                use_range = self._density(start, stop) >= min_density
+            else:
+                use_range = strategy == self.RANGES
+            self.chunks.append((start, stop, use_range))
+
+        ranges = sum(1 for c in self.chunks if c[2])
+        if ranges and ranges < len(self.chunks):
+            self.strategy = self.HYBRID
+        else:
+            self.strategy = self.RANGES if ranges or strategy == self.RANGES else self.OBJECT_IDS
+
+    def _density(self, start, stop):
+        """Returns the fraction of the OID range of a chunk that is in the chunk."""
+        span = self.oids[stop - 1] - self.oids[start] + 1
+        return float(stop - start) / span
+
+    @property
+    def density(self):
+        """Fraction of the full OID range that is fetched."""
+        return self._density(0, len(self.oids)) if self.oids else 1.0
+
+    def iter_where_clauses(self):
+        """Generator of an OID range where clause for each chunk, regardless of the strategy."""
+        for start, stop, use_range in self.chunks:
+            yield '{0} >= {1} and {0} <= {2}'.format(self.oid_name, self.oids[start], self.oids[stop - 1])
+
+    def __iter__(self):
+        """Generator of the query parameters for each chunk, either a where clause or objectIds."""
+        for start, stop, use_range in self.chunks:
+            if use_range:
+                yield {WHERE: '{0} >= {1} and {0} <= {2}'.format(self.oid_name, self.oids[start], self.oids[stop - 1])}
+            else:
+                yield {OBJECT_IDS: ','.join(map(str, self.oids[start:stop]))}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def summary(self):
+        """Returns a dict describing the plan."""
+        ranges = sum(1 for c in self.chunks if c[2])
+        return {
+            'strategy': self.strategy,
+            'records': len(self.oids),
+            'requests': len(self.chunks),
+            'ranges': ranges,
+            'objectIds': len(self.chunks) - ranges,
+            'density': round(self.density, 4)
+        }
+
+    def __repr__(self):
+        return '<{}: {} records in {} requests ({})>'.format(self.__class__.__name__, len(self.oids), len(self.chunks), self.strategy)
+
+
+class TilePlan(object):
+    """Partitions an extent into quadtree tiles that each hold at most max_records
+            features, for layers that can neither be paged nor queried by OID.  A tile
+            is split into four quadrants while its feature count (returnCountOnly) is
+            too high.  Features that straddle tile edges are returned by each tile
+            they intersect, so the results must be de-duplicated.
+
+    Attributes:
+        extent: Tuple of (xmin, ymin, xmax, ymax) to partition.
+        max_records: Maximum number of features per tile.
+        max_depth: Maximum number of splits, tiles at this depth are not split further.
+        spatial_reference: Spatial reference of the extent (a wkid or a dict).
+        tiles: List of (xmin, ymin, xmax, ymax, count) for each tile with features.
+        requests: Number of count requests made to build the plan.
+        truncated: Tiles at max_depth that still hold more than max_records features.
+    """
+    TILES = 'tiles'
+    OID = 'oid'
+    GEOMETRY = 'geometry'
+
+    def __init__(self, extent, max_records=1000, max_depth=12, spatial_reference=None):
+        """Inits class with the extent to partition.
+
+        Args:
+            extent: Tuple of (xmin, ymin, xmax, ymax) or an extent dict.
+            max_records: Optional maximum number of features per tile. Defaults to 1000.
+            max_depth: Optional maximum number of splits. Defaults to 12.
+            spatial_reference: Optional spatial reference of the extent.
+        """
+        if isinstance(extent, dict):
+            spatial_reference = spatial_reference or extent.get(SPATIAL_REFERENCE)
+            extent = [extent[k] for k in (XMIN, YMIN, XMAX, YMAX)]
+        self.extent = tuple(map(float, extent))
+        self.max_records = max([int(max_records), 1])
+        self.max_depth = max_depth
+        self.spatial_reference = spatial_reference
+        self.tiles = []
+        self.requests = 0
+        self.truncated = []
+
+    @staticmethod
+    def split(envelope):
+        """Returns the four quadrants of an envelope.
+
+        Args:
+            envelope: Tuple of (xmin, ymin, xmax, ymax).
+        """
+        xmin, ymin, xmax, ymax = envelope[:4]
+        x, y = (xmin + xmax) / 2.0, (ymin + ymax) / 2.0
+        return [(xmin, ymin, x, y), (x, ymin, xmax, y), (xmin, y, x, ymax), (x, y, xmax, ymax)]
+
+    def envelope_params(self, envelope):
+        """Returns the query parameters for the features intersecting an envelope.
+
+        Args:
+            envelope: Tuple of (xmin, ymin, xmax, ymax).
+        """
+        params = {
+            GEOMETRY: ','.join(map(repr, envelope[:4])),
+            GEOMETRY_TYPE: ESRI_ENVELOPE,
+            SPATIAL_REL: ESRI_INTERSECT
+        }
+        if isinstance(self.spatial_reference, dict):
+            params[IN_SR] = json.dumps(self.spatial_reference)
+        elif self.spatial_reference:
+            params[IN_SR] = self.spatial_reference
+        return params
+
+    def build(self, count, max_workers=None):
+        """Splits the extent until each tile holds at most max_records features.  The
+                tiles of each level are counted concurrently.
+
+        Args:
+            count: Function that returns the feature count for the parameters of an envelope.
+            max_workers: Optional number of threads used for the count requests.
+
+        Returns:
+            The TilePlan.
+        """
+        level = [(self.extent, 0)]
+        while level:
+            counts = list(iter_concurrent(lambda tile: count(self.envelope_params(tile[0])), level, max_workers))
+            self.requests += len(level)
+            next_level = []
+            for (envelope, depth), n in zip(level, counts):
+                if not n:
+                    continue
+                if n <= self.max_records or depth >= self.max_depth:
+                    self.tiles.append(tuple(envelope) + (n,))
+                    if n > self.max_records:
+                        self.truncated.append(self.tiles[-1])
+                else:
+                    next_level.extend((quadrant, depth + 1) for quadrant in self.split(envelope))
+            level = next_level
+        if self.truncated:
+            warnings.warn('{} tiles hold more than {} features at the maximum depth, some features may not be returned'.format(
+                len(self.truncated), self.max_records))
+        return self
+
+    @property
+    def records(self):
+        """Sum of the tile counts, features on tile edges are counted more than once."""
+        return sum(tile[4] for tile in self.tiles)
+
+    def __iter__(self):
+        """Generator of the query parameters for each tile."""
+        for tile in self.tiles:
+            yield self.envelope_params(tile)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def summary(self):
+        """Returns a dict describing the plan."""
+        return {
+            'strategy': self.TILES,
+            'records': self.records,
+            'requests': len(self.tiles),
+            'count_requests': self.requests,
+            'truncated': len(self.truncated)
+        }
+
+    def __repr__(self):
+        return '<{}: {} tiles>'.format(self.__class__.__name__, len(self.tiles))
+
+
+class AdaptiveChunkSize(object):
+    """Chooses the page size of chunked queries from measured responses.  The size
+            shrinks right away when a page takes longer than target_seconds or is
+            larger than max_bytes, and when a request fails.  It grows gradually while
+            pages are fast and small.  Vertex heavy layers therefore settle on smaller
+            pages than point layers.  Use state and from_state() to start later runs
+            from the learned size.
+    """
+    AUTO = 'auto'
+
+    def __init__(self, size=None, min_size=10, max_size=None, target_seconds=5.0, max_bytes=8 * 1024 * 1024,
+                 growth=1.5, shrink=0.5, smoothing=0.5):
+        """Inits class with the starting size and targets.
+
+        Args:
+            size: Optional starting page size. Defaults to max_size.
+            min_size: Optional smallest page size. Defaults to 10.
+            max_size: Optional largest page size, usually the maxRecordCount of the layer.
+                Defaults to 1000.
+            target_seconds: Optional response time to aim for per page. Defaults to 5.
+            max_bytes: Optional response size to aim for per page. Defaults to 8 MB.
+            growth: Optional factor by which the size may grow after a fast page. Defaults to 1.5.
+            shrink: Optional factor to apply to the size after a failed request. Defaults to 0.5.
+            smoothing: Optional weight of the latest page in the measured cost per record,
+                between 0 and 1. Defaults to 0.5.
+        """
+        self.min_size = max([int(min_size), 1])
+        self.max_size = int(max_size or 1000)
+        self.size = size or self.max_size
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.growth = growth
+        self.shrink = shrink
+        self.smoothing = smoothing
+        self.seconds_per_record = None
+        self.bytes_per_record = None
+        self.ceiling = None
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """The page size to use for the next request."""
+        return self._size
+
+    @size.setter
+    def size(self, value):
+        self._size = int(min([max([value, self.min_size]), self.max_size]))
+
+    def _smooth(self, previous, value):
+        return value if previous is None else previous + self.smoothing * (value - previous)
+
+    def record(self, records, seconds, nbytes=None):
+        """Adjusts the size after a successful request.
+
+        Args:
+            records: Number of records returned.
+            seconds: Time the request took.
+            nbytes: Optional size of the response in bytes.
+        """
+        if not records:
+            return
+        with self._lock:
+            self.requests += 1
+            self.seconds_per_record = self._smooth(self.seconds_per_record, float(seconds) / records)
+            ideal = self.target_seconds / self.seconds_per_record if self.seconds_per_record else self.max_size
+            if nbytes:
+                self.bytes_per_record = self._smooth(self.bytes_per_record, float(nbytes) / records)
+                ideal = min([ideal, self.max_bytes / self.bytes_per_record])
+            if ideal < self.size:
+                self.size = ideal
+            else:
+                self.size = min([ideal, self.size * self.growth, self.ceiling or self.max_size])
+            if self.ceiling:
+                # probe slowly above a size that failed, the failure may have been temporary
+                self.ceiling *= 1.01
+
+    @staticmethod
+    def is_server_failure(error):
+        """Checks if a failed request may succeed with a smaller page: a server error
+                (5xx status or JSON error code), a timeout or a dropped connection.  Client
+                errors such as an invalid where clause or an expired token are not.
+
+        Args:
+            error: The exception raised by the request.
+        """
+        if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+            return True
+        if isinstance(error, requests.HTTPError):
+            code = error.response.status_code if error.response is not None else None
+        else:
+            code = getattr(error, 'code', None)
+        return isinstance(code, six.integer_types) and code >= 500
+
+    def failure(self, size=None):
+        """Shrinks the size after a failed request (server error or timeout).
+
+        Args:
+            size: Optional page size of the failed request, the size will not grow
+                back to it right away.
+        """
+        with self._lock:
+            self.failures += 1
+            size = size or self.size
+            self.ceiling = max([size * 0.9, self.min_size])
+            self.size = min([self.size, size]) * self.shrink
+
+    @property
+    def state(self):
+        """The learned state as a dict that can be stored as JSON, see from_state()."""
+        return {
+            'size': self.size,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'target_seconds': self.target_seconds,
+            'max_bytes': self.max_bytes,
+            'seconds_per_record': self.seconds_per_record,
+            'bytes_per_record': self.bytes_per_record,
+            'ceiling': self.ceiling,
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        """Creates a controller that starts from a saved state.
+
+        Args:
+            state: A dict from the state property.
+            kwargs: Optional arguments that override the saved settings.
+        """
+        settings = {k: state[k] for k in ('size', 'min_size', 'max_size', 'target_seconds', 'max_bytes') if k in state}
+        settings.update(kwargs)
+        controller = cls(**settings)
+        controller.seconds_per_record = state.get('seconds_per_record')
+        controller.bytes_per_record = state.get('bytes_per_record')
+        controller.ceiling = state.get('ceiling')
+        return controller
+
+    def __repr__(self):
+        return '<{}: size={}, requests={}, failures={}>'.format(self.__class__.__name__, self.size, self.requests, self.failures)
+
+
 class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
     """Class to handle advanced layer properties."""
+    # request JSON queries as protocol buffers when the layer supports it, off by default
+    # because the buffer has fewer field properties than JSON (see pbf.decode_feature_collection)
+    prefer_pbf = False
+    # how chunks of object ids are queried on layers without pagination, see OIDQueryPlan
+    oid_strategy = OIDQueryPlan.AUTO
+    # how features returned by more than one tile are matched with strategy="tiles", see TilePlan,
+    # by a hash of the whole feature by default because tiles are used when OIDs are unreliable
+    tile_dedupe = TilePlan.GEOMETRY
+    # default geometry_reduction for queries, see geometry_reduction_params()
+    geometry_reduction = None
+    last_query_plan = None
+    # AdaptiveChunkSize controllers by layer url, shared so later queries start from the learned size
+    _chunk_controllers = {}
 
     @property
     def parent_service(self):
@@ -1528,6 +2050,20 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
         return parent_class(self.url[:self.url.rfind('/')])
 
 
+    def _returns_geometry(self, fields):
+        """Checks if a cursor field list includes the geometry, internal method used
+                for cursors to skip returning geometries that are not used.
+
+        Args:
+            fields: List or comma delimited field list.
+        """
+        if not fields or fields == '*':
+            return True
+        if isinstance(fields, six.string_types):
+            fields = fields.split(',')
+        shape = (self.ShapeFieldName or '').lower()
+        return any(f.strip().upper() == SHAPE_TOKEN or (shape and f.strip().lower() == shape) for f in fields)
+
     def _fix_fields(self, fields):
         """Fixes input fields, accepts esri field tokens too ("SHAPE@", "OID@"), internal
                 method used for cursors.
@@ -1559,6 +2095,19 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
                         field_list.append(f)
         return ','.join(field_list)
 
+    def _as_feature_set(self, page):
+        """Returns a page of a query as a FeatureSet, or a FeatureCollection for GeoJSON.
+
+        Args:
+            page: A query response, FeatureSet or FeatureCollection.
+        """
+        if not isinstance(page, FeatureSetBase):
+            page = self._format_server_response(page)
+        # pages without features are not recognized as feature sets
+        if not isinstance(page, FeatureSetBase):
+            page = FeatureSet(page)
+        return page
+
     def _format_server_response(self, server_response, records=None):
         """Returns a reformatted server response.
 
@@ -1572,7 +2121,8 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
         """
         # set fields to full field definition of the layer
         if isinstance(server_response, requests.Response):
-            server_response = munchify(server_response.json())
+            server_response = lazy_munchify(decode_json(server_response.content))
+        dequantize(server_response)
 
         if PROPERTIES in server_response:
              return FeatureCollection(server_response)
@@ -1626,6 +2176,7 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             F : JSON
         }
 
+        reduction = kwargs.pop('geometry_reduction', self.geometry_reduction)
         params.update(kwargs)
 
         if RESULT_RECORD_COUNT in params and self.compatible_with_version('10.3'):
@@ -1654,8 +2205,57 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
 
         elif self.type == TABLE:
             del params[RETURN_GEOMETRY]
+
+        # geometry payload reduction, explicit parameters take precedence over the preset
+        returns_features = not params.get(OUT_STATISTICS) and not any(str(params.get(option)).lower() == TRUE
+                                                                      for option in (RETURN_IDS_ONLY, RETURN_COUNT_ONLY, RETURN_EXTENT_ONLY))
+        if reduction and returns_features and str(params.get(RETURN_GEOMETRY)).lower() == TRUE:
+            for k, v in six.iteritems(self.geometry_reduction_params(reduction, params.get(OUT_SR))):
+                params.setdefault(k, v)
         return params
 
+    def geometry_reduction_params(self, reduction, outSR=None):
+        """Returns the query parameters to reduce the size of the returned geometries.
+                Quantized responses are decoded back into normal geometries, so the
+                result has the same structure as a full precision query.
+
+        Args:
+            reduction: A preset name from quantization.GEOMETRY_PRESETS ("full", "analysis",
+                "display" or "overview"), a tolerance in the units of the output spatial
+                reference, or a dict of geometryPrecision, maxAllowableOffset and/or
+                quantizationParameters.  Presets are resolutions in meters, use
+                quantization.tile_resolution() for a tolerance matching a web map zoom level.
+            outSR: Optional output spatial reference of the query, defaults to the layer
+                spatial reference.
+
+        Raises:
+            ValueError: The preset name is unknown.
+        """
+        if isinstance(reduction, dict):
+            return dict(reduction)
+        generalize = quantize = True
+        out_wkid = int(outSR) if str(outSR).isdigit() else self._find_wkid(outSR) if outSR else self.getWKID()
+        if isinstance(reduction, six.string_types):
+            if reduction.lower() not in GEOMETRY_PRESETS:
+                raise ValueError('Unknown geometry reduction preset "{}", use one of: {}'.format(
+                    reduction, ', '.join(sorted(GEOMETRY_PRESETS))))
+            preset = GEOMETRY_PRESETS[reduction.lower()]
+            if preset is None:
+                return {}
+            meters, generalize, quantize = preset
+            wkt = projections.projections.get(str(out_wkid)) if out_wkid else (None if outSR else self.getWKT())
+            tolerance = meters * units_per_meter(wkt)
+        else:
+            tolerance = float(reduction)
+
+        # the quantization extent must be in the output spatial reference
+        extent = self.json.get(EXTENT)
+        if extent:
+            sr = extent.get(SPATIAL_REFERENCE) or {}
+            if out_wkid not in (sr.get(WKID), sr.get(LATEST_WKID)):
+                extent = None
+        return reduction_params(tolerance, extent, generalize, quantize)
+
     def iter_queries(self, where='1=1', max_recs=None, chunk_size=None, **kwargs):
         """Generator to form where clauses to query all records.  Will iterate
                 through "chunks" of OID's until all records have been returned
@@ -1672,7 +2272,26 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
                 then return a 500 error. Reducing the number of records (chunk size) per request can fix this issue.
         """
 
+        oids, oid_name = self._query_oids(where, **kwargs)
+        if not oids:
+            return
+
+        for where_clause in self._iter_oid_ranges(oids, oid_name, max_recs, chunk_size):
+            yield where_clause
+
+    def _query_oids(self, where='1=1', **kwargs):
+        """Queries the object ids matching a where clause.
+
+        Args:
+            where: Optional where clause for OID selection.
+            kwargs: Optional extra query parameters.
+
+        Returns:
+            A tuple of (list of object ids, name of the OID field).
+        """
         kwargs[RETURN_IDS_ONLY] = TRUE
+        if kwargs.get(F) == PBF:
+            kwargs[F] = JSON
 
         # get oids
         resp = self.query(where=where, **kwargs)
@@ -1682,30 +2301,125 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             oids = resp.properties.get(OBJECT_IDS, [])
         else:
             oids = resp.get(OBJECT_IDS, [])
-        if not oids:
-            return
-        oids = sorted(oids)[:max_recs]
-        oid_name = resp.get(OID_FIELD_NAME, OBJECTID)
-        print('total records: {0}'.format(len(oids)))
 
         # set returnIdsOnly to False
         kwargs[RETURN_IDS_ONLY] = FALSE
+        return oids or [], resp.get(OID_FIELD_NAME, OBJECTID)
+
+    def _iter_oid_ranges(self, oids, oid_name, max_recs=None, chunk_size=None):
+        """Generator to form where clauses for chunks of OID's.
+
+        Args:
+            oids: List of object ids.
+            oid_name: Name of the OID field.
+            max_recs: Optional maximum amount of records returned for all
+                queries. Defaults to None.
+            chunk_size: Optional. Can be used to override the default chunk size.
+        """
+        for where_clause in self.plan_oid_queries(oids, oid_name, max_recs, chunk_size, OIDQueryPlan.RANGES).iter_where_clauses():
+            yield where_clause
+
+    def plan_oid_queries(self, oids, oid_name, max_recs=None, chunk_size=None, strategy=None):
+        """Plans the chunked queries for a list of object ids, the plan is also
+                kept as last_query_plan.
+
+        Args:
+            oids: List of object ids.
+            oid_name: Name of the OID field.
+            max_recs: Optional maximum amount of records returned for all
+                queries. Defaults to None.
+            chunk_size: Optional. Can be used to override the default chunk size.
+            strategy: Optional OIDQueryPlan strategy ("auto", "ranges" or "objectIds").
+                Defaults to the oid_strategy of the layer.
 
-        # iterate through groups to form queries
+        Returns:
+            An OIDQueryPlan, iterate it for the query parameters of each chunk.
+        """
         # overwrite max_recs here with transfer limit from service
         if chunk_size and chunk_size < self.json.get(MAX_RECORD_COUNT, 1000):
-            max_recs = chunk_size
+            size = chunk_size
+        else:
+            size = self.json.get(MAX_RECORD_COUNT, 1000)
+        plan = OIDQueryPlan(oids, oid_name, size, strategy or self.oid_strategy, max_records=max_recs)
+        print('total records: {0}'.format(len(plan.oids)))
+        self.last_query_plan = plan
+        return plan
+
+    def plan_tiles(self, where='1=1', max_records=None, max_depth=12, max_workers=None, **kwargs):
+        """Partitions the layer into quadtree tiles that each hold at most max_records
+                features, the plan is also kept as last_query_plan.  The extent of the
+                selection is used when the server can return it, otherwise the extent
+                of the layer.
+
+        Args:
+            where: Optional where clause. Defaults to '1=1'.
+            max_records: Optional maximum number of features per tile. Defaults to the
+                maxRecordCount of the layer.
+            max_depth: Optional maximum number of splits. Defaults to 12.
+            max_workers: Optional number of threads used for the count requests.
+            kwargs: Optional extra parameters to add to query string passed as keyword arguments.
+
+        Raises:
+            ValueError: 'Spatial tiling requires a layer with geometry'
+
+        Returns:
+            A TilePlan, iterate it for the query parameters of each tile.
+        """
+        if self.type != FEATURE_LAYER:
+            raise ValueError('Spatial tiling requires a layer with geometry')
+        if kwargs.get(GEOMETRY):
+            raise ValueError('Spatial tiling cannot be combined with a geometry filter')
+        query_url = self.url + '/query'
+        count_params = {k: v for k,v in six.iteritems(self._validate_params(where=where, **kwargs)) if k != OUT_FIELDS}
+        count_params.update({RETURN_GEOMETRY: FALSE, F: JSON})
+
+        extent = self.json.get(EXTENT)
+        if self.json.get(ADVANCED_QUERY_CAPABILITIES, {}).get(SUPPORTS_RETURNING_QUERY_EXTENT):
+            resp = self.request(query_url, dict(count_params, **{RETURN_EXTENT_ONLY: TRUE}))
+            if resp.get(EXTENT) and resp[EXTENT].get(XMIN) is not None:
+                extent = resp[EXTENT]
+        if not extent or extent.get(XMIN) is None:
+            raise ValueError('Layer has no extent to partition')
+
+        def count(envelope_params):
+            params = dict(count_params, **envelope_params)
+            params[RETURN_COUNT_ONLY] = TRUE
+            return self.request(query_url, params).get(COUNT, 0)
+
+        max_recs = self.json.get(MAX_RECORD_COUNT, 1000)
+        plan = TilePlan(extent, min([max_records, max_recs]) if max_records else max_recs, max_depth)
+        plan.build(count, max_workers)
+        print('total tiles: {0}'.format(len(plan)))
+        self.last_query_plan = plan
+        return plan
+
+    def _tile_feature_key(self, feature):
+        """Returns the key used to find features returned by more than one tile."""
+        if self.tile_dedupe == TilePlan.OID and self.OIDFieldName:
+            attributes = feature.get(ATTRIBUTES) or feature.get(PROPERTIES) or {}
+            oid = attributes.get(self.OIDFieldName, feature.get(ID))
+            if oid is not None:
+                return oid
+        return hashlib.sha1(json.dumps(feature, sort_keys=True, cls=RestapiEncoder).encode('utf-8')).digest()
+
+    @staticmethod
+    def _chunk_params(params, where, chunk):
+        """Returns the query parameters for one chunk of an OIDQueryPlan.
+
+        Args:
+            params: The query parameters.
+            where: The where clause of the query.
+            chunk: Parameters of the chunk, either a where clause or objectIds.
+        """
+        chunk_params = params.copy()
+        if WHERE in chunk:
+            chunk_params[WHERE] = ' and '.join(filter(None, [where.replace('1=1', ''), chunk[WHERE]]))
         else:
-            max_recs = self.json.get(MAX_RECORD_COUNT, 1000)
-        for each in zip_longest(*(iter(oids),) * max_recs):
-            theRange = list(filter(lambda x: x != None, each)) # do not want to remove OID "0"
-            if theRange:
-                _min, _max = min(theRange), max(theRange)
-                del each
-                yield '{0} >= {1} and {0} <= {2}'.format(oid_name, _min, _max)
+            chunk_params.update(chunk)
+        return chunk_params
 
 
-    def query(self, where='1=1', fields='*', records=None, exceed_limit=False, fetch_in_chunks=False, f=DEFAULT_REQUEST_FORMAT, kmz=None, chunk_size=None, **kwargs):
+    def query(self, where='1=1', fields='*', records=None, exceed_limit=False, fetch_in_chunks=False, f=DEFAULT_REQUEST_FORMAT, kmz=None, chunk_size=None, max_workers=None, streaming=False, lazy=False, prefetch=None, **kwargs):
         """Queries layer and gets response as JSON.
 
         Args:
@@ -1720,13 +2434,30 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             fetch_in_chunks: Option to return a generator with a FeatureSet in
                 chunks of each query group.  Use this to avoid memory errors when
                 fetching many features. Defaults to False
-            f: Return format, default is JSON.  (html|json|kmz)
+            f: Return format, default is JSON.  (html|json|kmz|pbf)  JSON queries are made in the
+                protocol buffer format when prefer_pbf is set and the layer supports it, the
+                result is the same FeatureSet.
             kmz: Optional full path to output kmz file.  Only used if output
                 format is "kmz". Defaults to ''.
             chunk_size: Optional. Can be used to override the default chunk size. Some servers mistakenly
                 advertise very large maximim record counts, but cannot deliver that may records. They will
                 then return a 500 error. Reducing the number of records (chunk size) per request can fix this issue.
-            kwargs: Optional extra parameters to add to query string passed as key word arguments
+                Use "auto" or an AdaptiveChunkSize to adapt the page size to the server, see query_in_chunks().
+            max_workers: Optional number of threads used to fetch chunks concurrently when exceed_limit
+                is True. See query_in_chunks(). Defaults to None (one request at a time).
+            streaming: Optional boolean to parse the response while it is downloaded and return
+                a FeatureStream that yields one Feature at a time, instead of a FeatureSet.  When
+                exceed_limit is True the chunks are chained into a single FeatureStreamChain.
+                Defaults to False.
+            lazy: Optional boolean to return a PagedFeatureSet when exceed_limit is True.  The
+                chunks are requested while its features are iterated and released afterwards,
+                so memory use does not grow with the number of records. Defaults to False.
+            prefetch: Optional number of chunks to download ahead on a background thread when
+                exceed_limit is True, see query_in_chunks(). Defaults to None.
+            kwargs: Optional extra parameters to add to query string passed as key word arguments.
+                Use geometry_reduction to request smaller geometries with a preset ("analysis",
+                "display", "overview"), a tolerance or a dict of parameters, see
+                geometry_reduction_params().  Defaults to the geometry_reduction of the layer.
 
         # default params for all queries
         params: {'returnGeometry' : 'true', 'outFields' : fields,
@@ -1758,12 +2489,35 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
 
         else:
             server_response = {}
-            max_recs = chunk_size or self.json.get(MAX_RECORD_COUNT, 1000)
+            max_recs = self._resolve_chunk_size(chunk_size)[0] or self.json.get(MAX_RECORD_COUNT, 1000)
             if isinstance(records, int) and records > max_recs:
                 exceed_limit = True
+            if streaming:
+                if exceed_limit:
+                    return FeatureStreamChain(self.query_in_chunks(records=records, where=where, fields=fields, f=f,
+                                                                   chunk_size=chunk_size, max_workers=max_workers,
+                                                                   streaming=True, prefetch=prefetch, **kwargs))
+                if isinstance(records, int) and str(self.currentVersion) >= '10.3':
+                    params[RESULT_RECORD_COUNT] = records
+                return self._stream_request(query_url, params)
+            if exceed_limit and lazy:
+                def iter_pages():
+                    chunks = self.query_in_chunks(records=records, where=where, fields=fields, f=f, chunk_size=chunk_size,
+                                                  max_workers=max_workers, prefetch=prefetch, **kwargs)
+                    try:
+                        for page in chunks:
+                            yield self._as_feature_set(page)
+                    finally:
+                        # stops any chunks read ahead when the feature set is closed
+                        chunks.close()
+
+                return PagedFeatureSet(iter_pages(), records, lambda: self.getCount(where, **kwargs))
             if exceed_limit:
-                for i, result in enumerate(self.query_in_chunks(records=records, where=where,
-                                                                fields=fields, f=f, **kwargs)):
+                for i, result in enumerate(self.query_in_chunks(records=records, where=where, fields=fields, f=f,
+                                                                chunk_size=chunk_size, max_workers=max_workers,
+                                                                prefetch=prefetch, **kwargs)):
+                    if isinstance(result, FeatureSetBase):
+                        result = result.json
                     if i < 1:
                         server_response = result
                     else:
@@ -1773,10 +2527,166 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
                 if isinstance(records, int) and str(self.currentVersion) >= '10.3':
                     params[RESULT_RECORD_COUNT] = records
 
-                server_response = self.request(query_url, params)
+                self._use_pbf(params)
+                server_response = self._request_query(query_url, params)
             return self._format_server_response(server_response, records)
 
-    def query_in_chunks(self, where='1=1', fields='*', records=None, chunk_size=None, **kwargs):
+    @property
+    def supports_pbf(self):
+        """True if the layer supports query results in the protocol buffer format."""
+        return PBF in [f.strip().lower() for f in (self.json.get(SUPPORTED_QUERY_FORMATS) or '').split(',')]
+
+    def _use_pbf(self, params):
+        """Switches a JSON feature query to the protocol buffer format when the layer
+                supports it, the response is decoded back to the same JSON structure.
+
+        Args:
+            params: The query parameters, modified in place.
+        """
+        if not self.prefer_pbf or params.get(F) != JSON or not self.supports_pbf:
+            return False
+        for option in (RETURN_IDS_ONLY, RETURN_COUNT_ONLY, RETURN_EXTENT_ONLY, RETURN_DISTINCT_VALUES):
+            if str(params.get(option)).lower() == TRUE:
+                return False
+        if params.get(OUT_STATISTICS):
+            return False
+        params[F] = PBF
+        return True
+
+    def _request_query(self, query_url, params, on_response=None):
+        """Makes a query request and returns the JSON response, protocol buffer
+                responses (f=pbf) are decoded to the same structure as f=json.  When
+                the query cache is enabled (see set_query_cache()) a cached response is
+                returned while the edit state of the layer is unchanged.
+
+        Args:
+            query_url: The query url.
+            params: The query parameters.
+            on_response: Optional function called with the requests.Response when the
+                query is sent to the server, it is not called for cached responses.
+        """
+        query_cache = get_query_cache()
+        if query_cache is None:
+            return self._request_query_response(query_url, params, on_response)
+
+        key = query_cache.make_key(query_url, params, self._request_token(query_url))
+        version = query_cache.layer_version(self.url, lambda: self.request(self.url, {F: JSON}))
+        cached = query_cache.get(key, version)
+        if cached is not None:
+            return lazy_munchify(cached)
+        response = self._request_query_response(query_url, params, on_response)
+        query_cache.put(key, response, version)
+        return response
+
+    def _request_query_response(self, query_url, params, on_response=None):
+        """Makes a query request without the query cache, see _request_query().
+
+        Args:
+            query_url: The query url.
+            params: The query parameters.
+            on_response: Optional function called with the requests.Response.
+        """
+        if params.get(F) != PBF and on_response is None:
+            return dequantize(self.request(query_url, params))
+        r = self.request(query_url, params, ret_json=False)
+        if on_response is not None:
+            on_response(r)
+        return self._decode_query_response(r, params)
+
+    def _decode_query_response(self, r, params):
+        """Decodes the content of a query response, field properties that protocol buffer
+                responses do not have are taken from the layer fields.
+
+        Args:
+            r: The requests.Response.
+            params: The query parameters.
+        """
+        # errors are always returned as JSON
+        if params.get(F) == PBF and r.content[:1] != b'{':
+            return lazy_munchify(decode_feature_collection(r.content, fields=self.json.get(FIELDS)))
+        response = decode_json(r.content)
+        RequestError(response)
+        return lazy_munchify(dequantize(response))
+
+    def get_chunk_controller(self, **kwargs):
+        """Returns the AdaptiveChunkSize used for this layer with chunk_size="auto".  All
+                instances of the same layer share the controller, so later queries start
+                from the learned size.
+
+        Args:
+            kwargs: Optional arguments for a new AdaptiveChunkSize, ignored if the layer
+                already has one.
+        """
+        key = self.url.lower().rstrip('/')
+        controller = self._chunk_controllers.get(key)
+        if controller is None:
+            kwargs.setdefault('max_size', self.json.get(MAX_RECORD_COUNT, 1000))
+            controller = self._chunk_controllers.setdefault(key, AdaptiveChunkSize(**kwargs))
+        return controller
+
+    def set_chunk_controller(self, controller):
+        """Sets the AdaptiveChunkSize used for this layer with chunk_size="auto", for
+                example one restored with AdaptiveChunkSize.from_state().
+
+        Args:
+            controller: An AdaptiveChunkSize.
+        """
+        self._chunk_controllers[self.url.lower().rstrip('/')] = controller
+
+    def _resolve_chunk_size(self, chunk_size):
+        """Returns a tuple of (page size, AdaptiveChunkSize or None) for a chunk_size argument."""
+        if isinstance(chunk_size, AdaptiveChunkSize):
+            return chunk_size.size, chunk_size
+        if chunk_size == AdaptiveChunkSize.AUTO:
+            controller = self.get_chunk_controller()
+            return controller.size, controller
+        return chunk_size, None
+
+    def _fetch_adaptive(self, query_url, params, controller):
+        """Fetches a page and reports its response time and size to an AdaptiveChunkSize.
+                When the request fails the controller shrinks and the same records are
+                requested again in smaller pages.
+
+        Args:
+            query_url: The query url.
+            params: The query parameters, with resultOffset and resultRecordCount.
+            controller: The AdaptiveChunkSize.
+        """
+        offset, size = params.get(RESULTOFFSET, 0), params[RESULT_RECORD_COUNT]
+        responses = []
+        start = time.time()
+        try:
+            response = self._request_query(query_url, params, responses.append)
+        except (RestAPIException, requests.RequestException) as e:
+            # only server side failures can be helped with smaller pages
+            if size <= controller.min_size or not AdaptiveChunkSize.is_server_failure(e):
+                raise
+            controller.failure(size)
+            step = max([min([controller.size, (size + 1) // 2]), 1])
+            response = None
+            for sub_offset in six.moves.range(offset, offset + size, step):
+                sub_params = dict(params, **{RESULTOFFSET: sub_offset, RESULT_RECORD_COUNT: min([step, offset + size - sub_offset])})
+                part = self._fetch_adaptive(query_url, sub_params, controller)
+                if response is None:
+                    response = part
+                else:
+                    response[FEATURES].extend(part.get(FEATURES, []))
+            return response
+        if responses:
+            # cached responses say nothing about the server
+            controller.record(len(response.get(FEATURES, [])), time.time() - start, len(responses[0].content))
+        return response
+
+    def _stream_request(self, query_url, params):
+        """Makes a query request without reading the body and returns a FeatureStream.
+
+        Args:
+            query_url: The query url.
+            params: The query parameters.
+        """
+        return FeatureStream(self.request(query_url, params, stream_json=True))
+
+    def query_in_chunks(self, where='1=1', fields='*', records=None, chunk_size=None, max_workers=None, streaming=False, oid_strategy=None, strategy=None, prefetch=None, **kwargs):
         """Queries a layer in chunks and returns a generator.
 
         Args:
@@ -1788,30 +2698,132 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             chunk_size: Optional. Can be used to override the default chunk size. Some servers mistakenly
                 advertise very large maximim record counts, but cannot deliver that may records. They will
                 then return a 500 error. Reducing the number of records (chunk size) per request can fix this issue.
+                Use "auto" to let the layer's AdaptiveChunkSize (see get_chunk_controller()) choose the
+                page size from measured response times and sizes, or pass an AdaptiveChunkSize.  Pages
+                that fail are fetched again in smaller pages.
+            max_workers: Optional number of threads used to fetch chunks concurrently.  Chunks are
+                still yielded in order, and at most twice this many chunks are held in memory at once.
+                Defaults to None (one request at a time).
+            streaming: Optional boolean to yield a FeatureStream for each chunk instead of a
+                FeatureSet, see query().  Each stream should be iterated before the next one is
+                requested, so that its connection is released. Defaults to False.
+            oid_strategy: Optional OIDQueryPlan strategy for layers without pagination, "ranges"
+                to query OID ranges, "objectIds" to query exact lists of object ids, or "auto"
+                to choose per chunk from the OID density. Defaults to the oid_strategy of the
+                layer. The plan used is kept as last_query_plan.
+            strategy: Optional chunking strategy.  Defaults to None, which pages the layer
+                when it supports pagination and queries chunks of OIDs otherwise.  Use "tiles"
+                for layers that support neither, or whose OIDs are unreliable: the extent is
+                split into quadtree tiles of at most chunk_size features (see plan_tiles()),
+                the tiles are fetched concurrently with max_workers, and features returned
+                by more than one tile are skipped (matched as set by tile_dedupe).
+            prefetch: Optional number of chunks a background thread keeps downloaded and
+                decoded ahead of the consumer, so requests overlap with processing the
+                current chunk.  Close the generator to stop the thread when iteration
+                ends early.  Cannot be combined with streaming. Defaults to None.
             kwargs: Optional extra parameters to add to query string passed as keyword arguments.
 
         # default params for all queries
         params: {'returnGeometry' : 'true', 'outFields' : fields,
         'where': where, 'f' : 'json'}
         """
+        if prefetch:
+            if streaming:
+                raise ValueError('Streamed chunks cannot be prefetched, each stream holds a connection until it is read')
+            chunks = self.query_in_chunks(where, fields, records, chunk_size, max_workers, streaming, oid_strategy, strategy, **kwargs)
+            with PrefetchIterator(chunks, prefetch) as prefetched:
+                for chunk in prefetched:
+                    yield chunk
+            return
 
         query_url = self.url + '/query'
         params = self._validate_params(where=where, fields=fields, **kwargs).copy()
+        chunk_size, controller = self._resolve_chunk_size(chunk_size)
+        if strategy == TilePlan.TILES:
+            if streaming:
+                raise ValueError('Spatial tiles cannot be streamed, features must be de-duplicated')
+            self._use_pbf(params)
+            plan = self.plan_tiles(where, chunk_size, max_workers=max_workers, **kwargs)
+
+            def fetch_tile(tile):
+                return self._as_feature_set(self._request_query(query_url, dict(params, **tile)))
+
+            seen = set()
+            remaining = records
+            for fs in iter_concurrent(fetch_tile, plan, max_workers):
+                if fs.get(EXCEED_TRANSFER_LIMIT):
+                    warnings.warn('A tile of {} exceeded the transfer limit, some features may not be returned'.format(self.name))
+                features = []
+                for feature in fs.json.get(FEATURES) or []:
+                    key = self._tile_feature_key(feature)
+                    if key not in seen:
+                        seen.add(key)
+                        features.append(feature)
+                if remaining is not None:
+                    features = features[:remaining]
+                    remaining -= len(features)
+                fs.json[FEATURES] = features
+                yield fs
+                if remaining == 0:
+                    return
+            return
+        if not streaming:
+            self._use_pbf(params)
         if self.json.get(ADVANCED_QUERY_CAPABILITIES, {}).get(SUPPORTS_PAGINATION):
             params[ORDER_BY_FIELDS] = '{} ASC'.format(self.OIDFieldName)
             max_recs = chunk_size or self.json.get(MAX_RECORD_COUNT, 1000)
             params[RESULT_RECORD_COUNT] = max_recs
+            if (max_workers and max_workers > 1) or streaming or controller:
+                # page offsets must be known up front to fetch them concurrently, or to stream
+                # pages because exceededTransferLimit may only follow the features
+                count_params = {k: v for k,v in six.iteritems(params) if k not in (ORDER_BY_FIELDS, RESULT_RECORD_COUNT, OUT_FIELDS)}
+                count_params[RETURN_COUNT_ONLY] = TRUE
+                count_params[RETURN_GEOMETRY] = FALSE
+                count_params[F] = JSON
+                total = self.request(query_url, count_params).get(COUNT, 0)
+                if records:
+                    total = min([total, records])
+
+                def iter_pages():
+                    # the page size is read when a page is submitted, so it follows the controller
+                    offset = 0
+                    while offset < total:
+                        size = controller.size if controller else max_recs
+                        yield offset, min([size, total - offset])
+                        offset += size
+
+                def fetch_page(page):
+                    page_params = params.copy()
+                    page_params[RESULTOFFSET], page_params[RESULT_RECORD_COUNT] = page
+                    if streaming:
+                        return self._stream_request(query_url, page_params)
+                    if controller:
+                        return self._fetch_adaptive(query_url, page_params, controller)
+                    return self._request_query(query_url, page_params)
+
+                for next_resp in iter_concurrent(fetch_page, iter_pages(), max_workers):
+                    yield next_resp
+                return
+
             more = True
             while more:
-                next_resp = self.request(query_url, params)
+                next_resp = self._request_query(query_url, params)
                 params[RESULTOFFSET] = params.get(RESULTOFFSET, 0) + max_recs
                 more = next_resp.get(EXCEED_TRANSFER_LIMIT)
                 yield next_resp
-        else:    
-            for where2 in self.iter_queries(max_recs=records, chunk_size=chunk_size, **params):
-                sql = ' and '.join(filter(None, [where.replace('1=1', ''), where2]))
-                params[WHERE] = sql
-                yield self._format_server_response(self.request(query_url, params))
+        else:
+            def fetch_chunk(chunk):
+                chunk_params = self._chunk_params(params, where, chunk)
+                if streaming:
+                    return self._stream_request(query_url, chunk_params)
+                return self._format_server_response(self._request_query(query_url, chunk_params))
+
+            oids, oid_name = self._query_oids(**params)
+            if not oids:
+                return
+            plan = self.plan_oid_queries(oids, oid_name, records, chunk_size, oid_strategy)
+            for chunk in iter_concurrent(fetch_chunk, plan, max_workers):
+                yield chunk
 
 
     def query_related_records(self, objectIds, relationshipId, outFields='*', definitionExpression=None, returnGeometry=None, outSR=None, **kwargs):
@@ -1946,14 +2958,113 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
 
     def getCount(self, where='1=1', **kwargs):
         """Returns count of features, can use optional query and **kwargs to filter.
+                The count is computed by the server (returnCountOnly).
 
         Args:
             where: Optional where clause, defaults to '*'.
             kwargs: Optional keyword arguments for query operation.
         """
+        p = {
+            RETURN_COUNT_ONLY: TRUE,
+            RETURN_GEOMETRY: FALSE,
+            F: JSON
+        }
+
+        # add kwargs if specified
+        for k,v in six.iteritems(kwargs):
+            if k not in p.keys():
+                p[k] = v
+
+        resp = self.query(where=where, **p)
+        if COUNT in resp:
+            return resp[COUNT]
 
+        # servers that do not support returnCountOnly
         return len(self.getOIDs(where, **kwargs))
 
+    def statistics(self, statistics, group_by=None, where='1=1', chunk_size=None, max_workers=None, **kwargs):
+        """Computes statistics with outStatistics queries.  The layer can be split into
+                OID ranges that are queried separately (and concurrently), the partial
+                results are merged on the client.  Pages of groups are requested when the
+                server limits the number of groups returned.
+
+        Args:
+            statistics: The statistics, a list of outStatistics dicts, a list of
+                (statisticType, onStatisticField, outStatisticFieldName) tuples where the
+                out field name is optional, or a dict of {outStatisticFieldName:
+                (statisticType, onStatisticField)}.  Statistic types are count, sum, min,
+                max, avg, var and stddev, other types supported by the server can only be
+                used without chunk_size.
+            group_by: Optional list or comma delimited string of fields to group by.
+            where: Optional where clause. Defaults to '1=1'.
+            chunk_size: Optional width of the OID ranges to query separately, use this when
+                the server cannot compute statistics over the whole layer in one request.
+                Defaults to None (one request).
+            max_workers: Optional number of threads used to query OID ranges concurrently.
+                Defaults to None (one request at a time).
+            kwargs: Optional extra parameters to add to query string passed as keyword arguments.
+
+        Raises:
+            ValueError: '"{}" statistics cannot be merged across parts'
+
+        Returns:
+            A list of Munch objects with the group by fields and the statistics.
+        """
+        query_url = self.url + '/query'
+        merger = StatisticsMerger(statistics, group_by)
+        if chunk_size and merger.unmergeable:
+            raise ValueError('"{}" statistics cannot be merged across parts'.format(merger.unmergeable[0]))
+
+        params = {k: v for k,v in six.iteritems(kwargs) if k not in (OUT_FIELDS, FIELDS)}
+        params.update({
+            WHERE: where or '1=1',
+            OUT_STATISTICS: json.dumps(merger.out_statistics),
+            RETURN_GEOMETRY: FALSE,
+            F: JSON
+        })
+        if merger.group_by:
+            params[GROUP_BY_FIELDS_FOR_STATISTICS] = ','.join(merger.group_by)
+        paged = merger.group_by and self.json.get(ADVANCED_QUERY_CAPABILITIES, {}).get(SUPPORTS_PAGINATION)
+        if paged:
+            params[ORDER_BY_FIELDS] = ','.join(merger.group_by)
+
+        chunks = [{}]
+        if chunk_size:
+            # split the OID range of the selection, without downloading the OIDs
+            oid_name = self.OIDFieldName
+            bounds_params = {k: v for k,v in six.iteritems(params) if k not in (GROUP_BY_FIELDS_FOR_STATISTICS, ORDER_BY_FIELDS)}
+            bounds_params[OUT_STATISTICS] = json.dumps([
+                {STATISTIC_TYPE: 'min', ON_STATISTIC_FIELD: oid_name, OUT_STATISTIC_FIELD_NAME: 'min_oid'},
+                {STATISTIC_TYPE: 'max', ON_STATISTIC_FIELD: oid_name, OUT_STATISTIC_FIELD_NAME: 'max_oid'}
+            ])
+            bounds = self.request(query_url, bounds_params)
+            try:
+                attrs = {k.lower(): v for k,v in six.iteritems(bounds[FEATURES][0][ATTRIBUTES])}
+                low, high = int(attrs['min_oid']), int(attrs['max_oid'])
+            except (IndexError, KeyError, TypeError):
+                return []
+            chunks = [{WHERE: '{0} >= {1} and {0} <= {2}'.format(oid_name, start, min([start + chunk_size - 1, high]))}
+                      for start in six.moves.range(low, high + 1, chunk_size)]
+
+        def fetch_chunk(chunk):
+            chunk_params = self._chunk_params(params, where, chunk)
+            rows = []
+            while True:
+                resp = self.request(query_url, chunk_params)
+                features = resp.get(FEATURES) or []
+                rows.extend(ft.get(ATTRIBUTES, {}) for ft in features)
+                if not resp.get(EXCEED_TRANSFER_LIMIT) or not features:
+                    break
+                if not paged:
+                    warnings.warn('Statistics for {} were truncated by the server, use a smaller chunk_size'.format(self.name))
+                    break
+                chunk_params = dict(chunk_params, **{RESULTOFFSET: len(rows)})
+            return rows
+
+        for rows in iter_concurrent(fetch_chunk, chunks, max_workers):
+            merger.add(rows)
+        return [munch.Munch(row) for row in merger.results()]
+
     def _parse_attachment_infos(self, response, oid=None, globalId=None):
         atts = []
         oid =  oid or response.get(PARENT_OBJECTID)
@@ -2077,11 +3188,15 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
                 option may be time consuming because the ArcGIS REST API uses
                 default maxRecordCount of 1000, so queries must be performed in
                 chunks to get all records.
+            kwargs: Optional keyword arguments for SearchCursor, use lazy=True to fetch the
+                chunks while iterating instead of loading all records first, and prefetch to
+                download chunks ahead of the rows being iterated.
         """
         return SearchCursor(self, fields, where, records, exceed_limit, **kwargs)
 
     def export_layer(self, out_fc, fields='*', where='1=1', records=None, exceed_limit=False, sr=None,
-                     include_domains=True, include_attachments=False, qualified_fieldnames=False, chunk_size=None, **kwargs):
+                     include_domains=True, include_attachments=False, qualified_fieldnames=False, chunk_size=None,
+                     checkpoint=False, resume=False, **kwargs):
         """Method to export a feature class or shapefile from a service layer.
 
         Args:
@@ -2108,9 +3223,17 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             chunk_size: Optional. Can be used to override the default chunk size. Some servers mistakenly
                 advertise very large maximim record counts, but cannot deliver that may records. They will
                 then return a 500 error. Reducing the number of records (chunk size) per request can fix this issue.
+            checkpoint: Optional boolean to write a checkpoint file next to the output while
+                exporting with exceed_limit, recording the pages of the export and which of
+                them have been written.  The checkpoint is removed when the export finishes.
+                Defaults to False.
+            resume: Optional boolean to continue an export from its checkpoint, pages that
+                were already written are skipped and the rest is appended to the partial
+                output.  Implies checkpoint. Defaults to False.
 
         Returns:
-            A feature class or shapefile.
+            A feature class or shapefile, or a GeoParquet file when out_fc ends with
+                ".parquet" (see export_geoparquet()).
         """
         if self.type in (FEATURE_LAYER, TABLE):
 
@@ -2118,6 +3241,13 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             if not kwargs.get(OUT_SR):
                 kwargs[OUT_SR] = sr or self.getSR()
 
+            if os.path.splitext(out_fc)[1].lower() in PARQUET_EXTENSIONS:
+                return self.export_geoparquet(out_fc, fields, where, records, exceed_limit, chunk_size=chunk_size, **kwargs)
+
+            if exceed_limit and (checkpoint or resume):
+                return self._export_with_checkpoint(out_fc, fields, where, records, chunk_size, resume,
+                                                    include_domains, qualified_fieldnames, **kwargs)
+
             if exceed_limit:
 
                 # download in chunks
@@ -2171,6 +3301,210 @@ class MapServiceLayer(RESTEndpoint, SpatialReferenceMixin, FieldsMixin):
             print('Layer: "{}" is not a Feature Layer!'.format(self.name))
 
 
+    def export_geoparquet(self, out_file, fields='*', where='1=1', records=None, exceed_limit=False, chunk_size=None,
+                          compression='snappy', max_workers=None, prefetch=None, **kwargs):
+        """Exports a layer to a GeoParquet file, without arcpy.  Each page is written as a
+                row group when it is fetched, so only one page is held in memory.  Geometries
+                are stored as WKB with the CRS of the output spatial reference.  Requires pyarrow.
+
+        Args:
+            out_file: Full path to the output Parquet file.
+            fields: Optional list of fields to export. Defaults to '*'.
+            where: Optional where clause. Defaults to '1=1'.
+            records: Optional number of records to export. Defaults to None.
+            exceed_limit: Optional boolean to export all records in pages. Defaults to False.
+            chunk_size: Optional page size, see query_in_chunks().
+            compression: Optional Parquet compression codec. Defaults to "snappy".
+            max_workers: Optional number of threads used to fetch pages concurrently.
+            prefetch: Optional number of pages to download ahead of the writer.
+            kwargs: Optional extra query parameters.
+
+        Returns:
+            The path of the Parquet file.
+        """
+        kwargs[F] = JSON
+        if exceed_limit:
+            pages = self.query_in_chunks(where, fields, records=records, chunk_size=chunk_size, max_workers=max_workers,
+                                         prefetch=prefetch, **kwargs)
+        else:
+            pages = [self.query(where, fields, records, **kwargs)]
+
+        # the schema is taken from the layer, a page may not have every column (null geometries)
+        geometry = str(kwargs.get(RETURN_GEOMETRY, TRUE)).lower() != FALSE
+        converter = self.arrow_converter(fields, geometry, coded_values=False, outSR=kwargs.get(OUT_SR))
+        writer = GeoParquetWriter(out_file, compression, converter=converter)
+        try:
+            with writer:
+                for page in pages:
+                    writer.write(self._as_feature_set(page))
+        except:
+            if os.path.exists(out_file):
+                os.remove(out_file)
+            raise
+        print('Created: "{}" ({} records)'.format(out_file, writer.count))
+        return out_file
+
+    def _out_wkid(self, out_sr=None):
+        """Returns the well known id of the geometries returned with an outSR."""
+        if str(out_sr).isdigit():
+            return int(out_sr)
+        return self._find_wkid(out_sr) if out_sr else self.getWKID()
+
+    def arrow_converter(self, fields='*', geometry=True, coded_values=True, outSR=None):
+        """Returns an ArrowConverter with the schema of the layer fields, see iter_record_batches().
+
+        Args:
+            fields: Optional fields to convert. Defaults to '*'.
+            geometry: Optional boolean to include a WKB geometry column. Defaults to True.
+            coded_values: Optional boolean to convert coded value domain fields to dictionary
+                arrays. Defaults to True.
+            outSR: Optional output spatial reference of the geometries.
+        """
+        out_fields = self._fix_fields(fields)
+        if out_fields == '*':
+            field_defs = self.fields
+        else:
+            names = set(f.lower() for f in out_fields.split(','))
+            field_defs = [f for f in self.fields if f.name.lower() in names]
+        geometry_type = self.json.get(GEOMETRY_TYPE) if geometry and self.type == FEATURE_LAYER else None
+        return ArrowConverter(field_defs, geometry_type, self.json.get(HAS_Z), self._out_wkid(outSR), coded_values)
+
+    def iter_record_batches(self, where='1=1', fields='*', records=None, chunk_size=None, max_workers=None, prefetch=None,
+                            geometry=True, coded_values=True, **kwargs):
+        """Queries a layer in chunks and yields each page as an Arrow RecordBatch.  The schema
+                is derived once from the layer fields, so all batches share it: numeric fields
+                keep their width, dates are timestamp[ms] (UTC), coded value domain fields are
+                dictionary arrays of the coded value names, and geometries are WKB with GeoParquet
+                metadata.  Numeric and date columns are wrapped without copying.  Requires pyarrow.
+
+        Args:
+            where: Optional where clause. Defaults to '1=1'.
+            fields: Optional fields to return. Defaults to '*'.
+            records: Optional number of records to return. Defaults to None (all).
+            chunk_size: Optional page size, see query_in_chunks().
+            max_workers: Optional number of threads used to fetch pages concurrently.
+            prefetch: Optional number of pages to download ahead of the consumer.
+            geometry: Optional boolean to return the geometries. Defaults to True.
+            coded_values: Optional boolean to convert coded value domain fields to dictionary
+                arrays, otherwise the codes are returned. Defaults to True.
+            kwargs: Optional extra query parameters.
+        """
+        converter = self.arrow_converter(fields, geometry, coded_values, kwargs.get(OUT_SR))
+        kwargs[F] = JSON
+        if not converter.geometry_column:
+            kwargs[RETURN_GEOMETRY] = FALSE
+        for page in self.query_in_chunks(where, fields, records=records, chunk_size=chunk_size, max_workers=max_workers,
+                                         prefetch=prefetch, **kwargs):
+            page = self._as_feature_set(page)
+            if len(page):
+                yield converter.convert(page)
+
+    def record_batch_reader(self, where='1=1', fields='*', **kwargs):
+        """Returns a pyarrow RecordBatchReader of the pages of a query, which DuckDB, Polars
+                and the Arrow IPC writers read as a stream.  See iter_record_batches() for
+                the arguments.
+
+        Args:
+            where: Optional where clause. Defaults to '1=1'.
+            fields: Optional fields to return. Defaults to '*'.
+            kwargs: Optional keyword arguments for iter_record_batches().
+        """
+        converter = self.arrow_converter(fields, kwargs.get('geometry', True), kwargs.get('coded_values', True), kwargs.get(OUT_SR))
+        return converter.reader(self.iter_record_batches(where, fields, **kwargs))
+
+    def _export_with_checkpoint(self, out_fc, fields='*', where='1=1', records=None, chunk_size=None, resume=False,
+                                include_domains=True, qualified_fieldnames=False, **kwargs):
+        """Exports a layer page by page, keeping an ExportCheckpoint so the export can be
+                resumed.  Each page is appended to the output as it is fetched and the
+                checkpoint records the state of the writer, so a resumed export drops
+                whatever was written after the last recorded page.
+
+        Args:
+            out_fc: Full path to output feature class.
+            fields: Optional list of fields for fc. Defaults to '*'.
+            where: Optional where clause. Defaults to '1=1'.
+            records: Optional number of records to return. Defaults to None.
+            chunk_size: Optional page size. Defaults to the maxRecordCount of the layer.
+            resume: Optional boolean to continue from an existing checkpoint. Defaults to False.
+            include_domains: Optional boolean to add domains to a geodatabase output.
+            qualified_fieldnames: Optional boolean to keep qualified field names.
+            kwargs: Optional extra query parameters.
+
+        Returns:
+            The output feature class or shapefile.
+        """
+        kwargs.setdefault(F, DEFAULT_REQUEST_FORMAT)
+        query_url = self.url + '/query'
+        params = self._validate_params(where=where, fields=fields, **kwargs).copy()
+        paged = self.json.get(ADVANCED_QUERY_CAPABILITIES, {}).get(SUPPORTS_PAGINATION)
+        if paged:
+            params[ORDER_BY_FIELDS] = '{} ASC'.format(self.OIDFieldName)
+        size = chunk_size or self.json.get(MAX_RECORD_COUNT, 1000)
+
+        cp_path = ExportCheckpoint.path_for(out_fc)
+        key = ExportCheckpoint.make_key(self.url, out_fc, where=where, fields=fields, records=records,
+                                        chunk_size=chunk_size, params=kwargs)
+        checkpoint = ExportCheckpoint.load(cp_path) if resume else None
+        if checkpoint is not None and checkpoint.key != key:
+            warnings.warn('Checkpoint "{}" is for a different export, starting over'.format(cp_path))
+            checkpoint.remove()
+            checkpoint = None
+
+        if checkpoint is None:
+            # plan the pages, these must stay the same when the export is resumed
+            if paged:
+                count_params = {k: v for k,v in six.iteritems(params) if k not in (ORDER_BY_FIELDS, OUT_FIELDS)}
+                count_params.update({RETURN_COUNT_ONLY: TRUE, RETURN_GEOMETRY: FALSE, F: JSON})
+                total = self.request(query_url, count_params).get(COUNT, 0)
+                if records:
+                    total = min([total, records])
+                pages = [{RESULTOFFSET: offset, RESULT_RECORD_COUNT: min([size, total - offset])}
+                         for offset in six.moves.range(0, total, size)]
+            else:
+                oids, oid_name = self._query_oids(**params)
+                pages = list(self.plan_oid_queries(oids, oid_name, records, size, OIDQueryPlan.RANGES)) if oids else []
+            checkpoint = ExportCheckpoint(cp_path, key, pages)
+            checkpoint.save()
+        else:
+            print('Resuming export, {} of {} pages already written'.format(len(checkpoint.completed), len(checkpoint.pages)))
+
+        if not checkpoint.pages:
+            checkpoint.remove()
+            print('No records to fetch')
+            return
+
+        self._use_pbf(params)
+        def fetch_page(index):
+            chunk_params = self._chunk_params(params, where, checkpoint.pages[index])
+            return index, self._format_server_response(self._request_query(query_url, chunk_params))
+
+        fs = None
+        if has_arcpy:
+            # drop rows of a page that was written but not recorded before the export stopped
+            if checkpoint.completed and arcpy.Exists(out_fc):
+                keep = checkpoint.writer.get('count', 0)
+                with arcpy.da.UpdateCursor(out_fc, ['OID@']) as rows:
+                    for i, row in enumerate(rows):
+                        if i >= keep:
+                            rows.deleteRow()
+            for index, fs in (fetch_page(i) for i in checkpoint.remaining):
+                exportFeatureSet(fs, out_fc, include_domains=False, qualified_fieldnames=qualified_fieldnames)
+                checkpoint.complete(index, count=int(arcpy.management.GetCount(out_fc).getOutput(0)))
+            if include_domains and not out_fc.endswith('.shp'):
+                if fs is None:
+                    fs = fetch_page(0)[1]
+                add_domains_from_feature_set(out_fc, fs)
+        else:
+            remaining = checkpoint.remaining
+            written = iter(remaining)
+            export_feature_sets_os((fetch_page(i)[1] for i in remaining), out_fc, kwargs.get(OUT_SR),
+                                   state=checkpoint.writer.get('shapefile') if checkpoint.completed else None,
+                                   callback=lambda state: checkpoint.complete(next(written), shapefile=state))
+
+        checkpoint.remove()
+        print('Fetched all records')
+        return out_fc
+
     def clip(self, poly, output, fields='*', outSR=None, where='', envelope=False, 
              include_domains=False, qualified_fieldnames=False, **kwargs):
         """Method for spatial Query, exports geometry that intersect polygon or
@@ -3261,6 +4595,105 @@ class FeatureLayer(MapServiceLayer):
             kwargs[k] = v
         return self.__edit_handler(self.request(edits_url, params, method=POST))
 
+    def _match_keys(self, key_field, keys, chunk_size=500):
+        """Returns a dict of the object ids of the features by their key field value.
+
+        Args:
+            key_field: The key field name.
+            keys: Iterable of key values.
+            chunk_size: Optional number of keys per query. Defaults to 500.
+        """
+        oid_name = self.OIDFieldName
+        keys = sorted(set(k for k in keys if k is not None), key=lambda k: (str(type(k)), k))
+        matches = {}
+        for i in six.moves.range(0, len(keys), chunk_size):
+            values = ', '.join("'{}'".format(k.replace("'", "''")) if isinstance(k, six.string_types) else str(k)
+                               for k in keys[i:i + chunk_size])
+            fs = self.query('{} IN ({})'.format(key_field, values), fields=[oid_name, key_field], f=JSON, returnGeometry=FALSE)
+            for feature in fs.features:
+                attributes = feature.get(ATTRIBUTES) or {}
+                matches[attributes.get(key_field)] = attributes.get(oid_name)
+        return matches
+
+    def apply_dataframe(self, df, mode='add', key_field=None, geometry_column=GEOMETRY_COLUMN, batch_size=1000,
+                        gdbVersion=None, rollbackOnFailure=TRUE):
+        """Applies the rows of a pandas DataFrame as edits, in batches of applyEdits calls.
+                The DataFrame is converted a column at a time: datetimes are written as
+                epoch milliseconds, nulls (NaN, NaT, NA) as null and categoricals of coded
+                value names as their codes.  Columns that are not editable fields are ignored.
+
+        Args:
+            df: The DataFrame, for example from FeatureSet.to_dataframe().
+            mode: Optional edit mode, "add" adds every row, "update" updates the features
+                matching the key field and "upsert" updates matching features and adds the
+                other rows. Defaults to "add".
+            key_field: Optional field to match rows to features. Defaults to the OID field.
+            geometry_column: Optional name of the geometry column, holding WKB, Esri JSON,
+                Geometry objects, shapely geometries or vertex arrays (a list of them per
+                part for polylines and polygons), in the spatial reference of the layer.
+                Defaults to "SHAPE".
+            batch_size: Optional number of rows per applyEdits request. Defaults to 1000.
+            gdbVersion: Optional geodatabase version to apply edits. Defaults to None.
+            rollbackOnFailure: Optional boolean to specify if the edits of a batch should be
+                applied only if all of them succeed. Defaults to True.
+
+        Raises:
+            ValueError: The mode or key field is not valid, or the DataFrame has no key field column.
+
+        Returns:
+            A list of EditResult objects, one per batch.
+        """
+        if mode not in ('add', 'update', 'upsert'):
+            raise ValueError('Mode must be "add", "update" or "upsert", got "{}"'.format(mode))
+        oid_name = self.OIDFieldName
+        if key_field:
+            field = self.fieldLookup.get(key_field) or self.fieldLookup.get(key_field.lower())
+            if field is None:
+                raise ValueError('Field "{}" is not in layer "{}"'.format(key_field, self.name))
+            key_field = field.name
+        else:
+            key_field = oid_name
+        if mode != 'add' and key_field.lower() not in [six.text_type(c).lower() for c in df.columns]:
+            raise ValueError('DataFrame has no "{}" column to match rows to features'.format(key_field))
+
+        keep = (oid_name.lower(), key_field.lower())
+        fields = [f for f in self.json.get(FIELDS) or [] if f.get(TYPE) != SHAPE and (f.get(EDITABLE, True) or f.get(NAME, '').lower() in keep)]
+        geometry_type = self.json.get(GEOMETRY_TYPE)
+        features = dataframe_to_features(df, fields, geometry_column, geometry_type)
+
+        results, missing = [], 0
+        for batch in iter_chunks(features, batch_size):
+            batch = list(batch)
+            if mode == 'add' or (mode == 'update' and key_field == oid_name):
+                matches = None
+            else:
+                matches = self._match_keys(key_field, [f[ATTRIBUTES].get(key_field) for f in batch])
+            adds, updates = [], []
+            for feature in batch:
+                attributes = feature[ATTRIBUTES]
+                if GEOMETRY in feature and feature[GEOMETRY] is None:
+                    # a null geometry would clear the shape of an updated feature
+                    del feature[GEOMETRY]
+                if mode == 'add':
+                    attributes.pop(oid_name, None)
+                    adds.append(feature)
+                    continue
+                oid = attributes.get(oid_name) if matches is None else matches.get(attributes.get(key_field))
+                if oid is not None:
+                    attributes[oid_name] = oid
+                    updates.append(feature)
+                elif mode == 'upsert':
+                    attributes.pop(oid_name, None)
+                    adds.append(feature)
+                else:
+                    missing += 1
+            if adds or updates:
+                results.append(self.applyEdits(adds=adds or None, updates=updates or None, gdbVersion=gdbVersion,
+                                               rollbackOnFailure=rollbackOnFailure))
+        if missing:
+            warnings.warn('{} row(s) did not match a feature by "{}" and were not updated'.format(missing, key_field))
+        return results
+
 
     def addAttachment(self, oid, attachment, content_type='', gdbVersion=''):
         """Adds an attachment to a feature service layer.
@@ -3402,6 +4835,156 @@ class FeatureLayer(MapServiceLayer):
             raise NotImplementedError('FeatureLayer "{}" does not support attachments!'.format(self.name))
 
 
+    @property
+    def supportsChangeTracking(self):
+        """True if the service can extract changes by serverGen (extractChanges)."""
+        return 'changetracking' in (self.json.get(CAPABILITIES) or '').lower().replace(' ', '').split(',')
+
+    def query_changes(self, since=None, fields='*', where='1=1', state_file=None, save_state=True, use_extract_changes=True, **kwargs):
+        """Queries the features added and updated and the object ids deleted since a
+                previous run.  With change tracking the service's extractChanges operation
+                is used, otherwise the edit date field of editor tracking.  Deletes are
+                found by comparing the object ids of the layer with those of the previous
+                run, which are kept in the state file as OID ranges.  The first run
+                without a watermark returns all features as adds.
+
+        Args:
+            since: Optional watermark to query changes from, a datetime or milliseconds of
+                the edit date field.  Defaults to the watermark saved in state_file.
+            fields: Optional fields to return. Default is "*" to return all fields.
+            where: Optional where clause. Defaults to '1=1'.
+            state_file: Optional path of a JSON file with the watermark and object ids of
+                the previous run, the state of this run is written to it.
+            save_state: Optional boolean to write the state file when the changes have been
+                queried.  Use False to call ChangeSet.save() after the changes are applied.
+                Defaults to True.
+            use_extract_changes: Optional boolean to use extractChanges when the service
+                supports change tracking. Defaults to True.
+            kwargs: Optional extra parameters to add to query string passed as keyword arguments.
+
+        Raises:
+            ValueError: 'Layer "{}" has no editor tracking, cannot query changes since a date'
+
+        Returns:
+            A ChangeSet.
+        """
+        oid_name = self.OIDFieldName
+        edit_info = self.json.get(EDIT_FIELDS_INFO) or {}
+        edit_field, creation_field = edit_info.get(EDIT_DATE_FIELD), edit_info.get(CREATION_DATE_FIELD)
+
+        state = ChangeSet.load_state(state_file) if state_file else None
+        if state and state.get('url', '').lower() != self.url.rstrip('/').lower():
+            warnings.warn('State file "{}" is for another layer, querying all features'.format(state_file))
+            state = None
+        previous_oids = state.get('oids') if state else None
+        method = None
+        if since is not None:
+            since = date_to_mil(since) if isinstance(since, datetime.datetime) else int(since)
+            method = ChangeSet.EDITOR_TRACKING
+        elif state and state.get('watermark') is not None:
+            since, method = state['watermark'], state['method']
+
+        if fields != '*':
+            fields = fields.split(',') if isinstance(fields, six.string_types) else list(fields)
+            fields += [f for f in (oid_name, edit_field, creation_field) if f and f not in fields]
+
+        def as_feature_set(features, header):
+            return FeatureSet(dict(header, **{FEATURES: features}))
+
+        layer_header = {
+            FIELDS: self.json.get(FIELDS) or [],
+            GEOMETRY_TYPE: self.json.get(GEOMETRY_TYPE),
+            SPATIAL_REFERENCE: self._spatialReference,
+            OID_FIELD_NAME: oid_name
+        }
+
+        if method == ChangeSet.EXTRACT_CHANGES and use_extract_changes and self.supportsChangeTracking:
+            layer_id = self.json.get(ID)
+            params = {
+                LAYERS: json.dumps([layer_id]),
+                LAYER_SERVER_GENS: json.dumps([{ID: layer_id, SERVER_GEN: since}]),
+                'returnInserts': TRUE,
+                'returnUpdates': TRUE,
+                'returnDeletes': TRUE,
+                RETURN_IDS_ONLY: FALSE,
+                'dataFormat': JSON
+            }
+            if where and where != '1=1':
+                params['layerQueries'] = json.dumps({str(layer_id): {WHERE: where, 'queryOption': 'useFilter'}})
+            params.update(kwargs)
+            resp = self.request(self.url.rstrip('/').rsplit('/', 1)[0] + '/extractChanges', params)
+            edits = [e.get(FEATURES) or {} for e in resp.get(EDITS, []) if e.get(ID) == layer_id]
+            edits = edits[0] if edits else {}
+            server_gens = [g.get(SERVER_GEN) for g in resp.get(LAYER_SERVER_GENS, []) if g.get(ID) == layer_id]
+            deletes = edits.get(DELETE_IDS) or []
+            oids = None
+            if previous_oids is not None:
+                oids = array(INT64_TYPECODE, sorted(set(previous_oids).union(
+                    ft[ATTRIBUTES].get(oid_name) for ft in edits.get(ADDS) or []).difference(deletes)))
+            return self._save_changes(ChangeSet(self.url, as_feature_set(edits.get(ADDS) or [], layer_header),
+                                                as_feature_set(edits.get(UPDATES) or [], layer_header), deletes, since,
+                                                server_gens[0] if server_gens else since, method, oids),
+                                      state_file, save_state)
+
+        if method == ChangeSet.EDITOR_TRACKING and not edit_field:
+            raise ValueError('Layer "{}" has no editor tracking, cannot query changes since a date'.format(self.name))
+
+        # the watermark for the next run is read before the features so edits made while
+        # they are downloaded are found again
+        watermark = None
+        if use_extract_changes and self.supportsChangeTracking:
+            service_json = self.request(self.url.rstrip('/').rsplit('/', 1)[0], {F: JSON})
+            watermark = (service_json.get(SERVER_GENS) or {}).get(SERVER_GEN)
+        oids = array(INT64_TYPECODE, self.getOIDs(where, **kwargs))
+
+        if method == ChangeSet.EDITOR_TRACKING:
+            # timestamps are compared to the second, the milliseconds are checked here
+            stamp = mil_to_date(since).strftime('%Y-%m-%d %H:%M:%S')
+            edit_where = "{} >= timestamp '{}'".format(edit_field, stamp)
+            if where and where.strip() != '1=1':
+                edit_where = '({}) and {}'.format(where, edit_where)
+            fs = self.query(edit_where, fields, exceed_limit=True, f=JSON, **kwargs)
+            features = [ft for ft in fs.json.get(FEATURES, []) if (ft[ATTRIBUTES].get(edit_field) or 0) > since]
+        else:
+            fs = self.query(where, fields, exceed_limit=True, f=JSON, **kwargs)
+            features = fs.json.get(FEATURES, [])
+        header = {k: v for k,v in six.iteritems(fs.json if isinstance(fs, FeatureSetBase) else layer_header) if k != FEATURES}
+
+        adds, updates = [], []
+        for ft in features:
+            if previous_oids is not None:
+                oid = ft[ATTRIBUTES].get(oid_name)
+                i = bisect.bisect_left(previous_oids, oid)
+                (updates if i < len(previous_oids) and previous_oids[i] == oid else adds).append(ft)
+            elif since is None:
+                adds.append(ft)
+            elif creation_field and (ft[ATTRIBUTES].get(creation_field) or 0) > since:
+                adds.append(ft)
+            else:
+                updates.append(ft)
+
+        if watermark is not None:
+            method = ChangeSet.EXTRACT_CHANGES
+        elif edit_field:
+            edit_dates = [ft[ATTRIBUTES][edit_field] for ft in features if ft[ATTRIBUTES].get(edit_field) is not None]
+            if since is not None:
+                edit_dates.append(since)
+            watermark = max(edit_dates) if edit_dates else None
+            method = ChangeSet.EDITOR_TRACKING
+        else:
+            method = ChangeSet.FULL
+
+        deletes = oid_difference(previous_oids, oids) if previous_oids is not None else []
+        return self._save_changes(ChangeSet(self.url, as_feature_set(adds, header), as_feature_set(updates, header),
+                                            deletes, since, watermark, method, oids), state_file, save_state)
+
+    @staticmethod
+    def _save_changes(changes, state_file=None, save_state=True):
+        """Writes the state of a ChangeSet when requested and returns it."""
+        if state_file and save_state:
+            changes.save(state_file)
+        return changes
+
     def calculate(self, exp, where='1=1', sqlFormat='standard'):
         """Calculates a field in a Feature Layer.
 
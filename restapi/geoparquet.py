@@ -0,0 +1,92 @@
+"""GeoParquet output for feature sets.  Features are written a page at a time as row
+groups of a Parquet file, with the geometries encoded as WKB and the GeoParquet
+metadata (geometry types and CRS) in the file schema, so only one page is held in
+memory while a layer is exported.
+
+Requires pyarrow.
+"""
+from .arrow_utils import ArrowConverter, esri_to_wkb, pyarrow
+from .columnar import ColumnarFeatureSet
+
+if pyarrow is not None:
+    import pyarrow.parquet
+
+__all__ = ['GeoParquetWriter', 'esri_to_wkb', 'PARQUET_EXTENSIONS']
+
+PARQUET_EXTENSIONS = ('.parquet', '.geoparquet')
+
+
+class GeoParquetWriter(object):
+    """Writes feature sets to a GeoParquet file, one row group per feature set.
+
+    Attributes:
+        path: The output path.
+        compression: The Parquet compression codec.
+        count: The number of features written.
+    """
+
+    def __init__(self, path, compression='snappy', wkid=None, converter=None):
+        """Inits class with the output file.
+
+        Args:
+            path: Path of the Parquet file.
+            compression: Optional compression codec ("snappy", "zstd", "gzip", "none").
+                Defaults to "snappy".
+            wkid: Optional well known id of the geometries, defaults to the spatial reference
+                of the first feature set.
+            converter: Optional ArrowConverter for the schema of the file, defaults to one for
+                the fields of the first feature set.  Pass the converter of the layer (see
+                MapServiceLayer.arrow_converter()) when the first feature set may not have
+                all columns, for example when all of its geometries are null.
+
+        Raises:
+            ImportError: pyarrow is not installed.
+        """
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to write Parquet files')
+        self.path = path
+        self.compression = compression
+        self.wkid = wkid
+        self.converter = converter
+        self.count = 0
+        self._writer = None
+
+    @property
+    def schema(self):
+        """The Arrow schema of the file, None until the first feature set is written."""
+        return self.converter.schema if self.converter is not None else None
+
+    def write(self, feature_set):
+        """Writes a feature set as a row group.
+
+        Args:
+            feature_set: A FeatureSet, PagedFeatureSet or ColumnarFeatureSet.  All feature
+                sets must have the fields of the first one.
+        """
+        columns = feature_set if isinstance(feature_set, ColumnarFeatureSet) else feature_set.to_columns()
+        if self.converter is None:
+            # codes are written as they are, domains are not part of the file
+            self.converter = ArrowConverter.from_feature_set(columns, wkid=self.wkid, coded_values=False)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self._writer.write_batch(self.converter.convert(columns))
+        self.count += len(columns)
+
+    def close(self):
+        """Finishes the file, a file without feature sets has the schema of the converter
+                and no rows.
+        """
+        if self._writer is None and self.converter is not None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<{}: {} ({} features)>'.format(self.__class__.__name__, self.path, self.count)
@@ -1,12 +1,310 @@
+import socket
+import threading
+import random
+import time
 from requests import Session
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE, DEFAULT_POOLBLOCK
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+class _SocketCounterMixin(object):
+    """Counts the sockets a connection pool opens.  urllib3 reconnects dropped
+    connections without creating a new connection object, so num_connections
+    alone does not tell whether a connection was reused.
+    """
+    num_sockets = 0
+
+    def _new_conn(self):
+        conn = super(_SocketCounterMixin, self)._new_conn()
+        connect = conn.connect
+        def counted_connect(*args, **kwargs):
+            self.num_sockets += 1
+            return connect(*args, **kwargs)
+        conn.connect = counted_connect
+        return conn
+
+class CountingHTTPConnectionPool(_SocketCounterMixin, HTTPConnectionPool):
+    pass
+
+class CountingHTTPSConnectionPool(_SocketCounterMixin, HTTPSConnectionPool):
+    pass
+
+class PoolStatsAdapter(HTTPAdapter):
+    """HTTPAdapter that keeps track of how many connections were opened and
+    how many requests reused a pooled connection.
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ['keep_alive']
+
+    def __init__(self, pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE, pool_block=DEFAULT_POOLBLOCK, keep_alive=True, **kwargs):
+        self.keep_alive = keep_alive
+        self._lock = threading.Lock()
+        self._closed_stats = {'connections_opened': 0, 'requests': 0}
+        super(PoolStatsAdapter, self).__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                               pool_block=pool_block, **kwargs)
+
+    def __setstate__(self, state):
+        super(PoolStatsAdapter, self).__setstate__(state)
+        self._lock = threading.Lock()
+        self._closed_stats = {'connections_opened': 0, 'requests': 0}
+
+    def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK, **pool_kwargs):
+        if getattr(self, 'keep_alive', True):
+            # enable TCP keep-alive so idle pooled connections are not silently dropped
+            from urllib3.connection import HTTPConnection
+            pool_kwargs.setdefault('socket_options', HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        super(PoolStatsAdapter, self).init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+        # remember stats of host pools that are evicted from the pool manager
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+        def dispose_func(pool):
+            self._record_closed(pool)
+            if dispose:
+                dispose(pool)
+        pools.dispose_func = dispose_func
+
+    def _record_closed(self, pool):
+        with self._lock:
+            self._closed_stats['connections_opened'] += pool.num_sockets
+            self._closed_stats['requests'] += pool.num_requests
+
+    def pool_stats(self):
+        """Returns connection statistics for this adapter.
+
+        Returns:
+            A dict with the number of connections opened, requests made, requests that
+                reused a connection, and a "hosts" breakdown for the active host pools.
+        """
+        with self._lock:
+            stats = dict(self._closed_stats)
+        hosts = {}
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = '{}://{}:{}'.format(pool.scheme, pool.host, pool.port)
+            hosts[host] = {
+                'connections_opened': pool.num_sockets,
+                'requests': pool.num_requests,
+                'reused': max([pool.num_requests - pool.num_sockets, 0]),
+                'idle': pool.pool.qsize() if pool.pool else 0,
+                'maxsize': pool.pool.maxsize if pool.pool else 0
+            }
+            stats['connections_opened'] += pool.num_sockets
+            stats['requests'] += pool.num_requests
+        stats['reused'] = max([stats['requests'] - stats['connections_opened'], 0])
+        stats['hosts'] = hosts
+        return stats
+
+
+class RetryPolicy(object):
+    """Retry policy for transient server failures.  Waits with exponential backoff and
+    jitter between attempts and honours the Retry-After header.  Read requests (queries,
+    metadata and tokens) have a separate retry budget from all other requests, such as
+    edits and geoprocessing jobs, which are only retried when the server did not process
+    the request.
+    """
+    # operations that only read, these are safe to send again with GET or POST
+    read_operations = ('query', 'queryRelatedRecords', 'queryAttachments', 'queryDomains', 'queryTopFeatures',
+                       'queryAnalytic', 'identify', 'find', 'export', 'legend', 'layers', 'info', 'generateToken',
+                       'jobs', 'results')
+    # operations that change state even when they are sent with GET
+    non_idempotent_operations = ('applyEdits', 'addFeatures', 'updateFeatures', 'deleteFeatures', 'addAttachment',
+                                 'updateAttachment', 'deleteAttachments', 'calculate', 'append', 'truncate',
+                                 'submitJob', 'execute', 'cancel', 'createReplica', 'synchronizeReplica',
+                                 'unRegisterReplica', 'addToDefinition', 'deleteFromDefinition', 'updateDefinition',
+                                 'createService', 'delete', 'edit', 'upload', 'register', 'unregister', 'uploadPart',
+                                 'commit', 'extractChanges', 'exportTiles', 'createFeatureService')
+
+    def __init__(self, max_retries=3, max_edit_retries=2, backoff_factor=0.5, max_backoff=60, jitter=True,
+                 status_codes=(429, 500, 502, 503, 504), error_codes=(500, 503, 504), edit_status_codes=(429, 503),
+                 respect_retry_after=True):
+        """Inits class with retry budgets and backoff settings.
+
+        Args:
+            max_retries: Optional maximum number of retries for read requests. Defaults to 3.
+            max_edit_retries: Optional maximum number of retries for other requests. Defaults to 2.
+            backoff_factor: Optional base delay in seconds, the delay doubles with each attempt.
+                Defaults to 0.5.
+            max_backoff: Optional maximum delay in seconds between attempts. Defaults to 60.
+            jitter: Optional boolean to randomize the delay (full jitter). Defaults to True.
+            status_codes: Optional HTTP status codes to retry.
+            error_codes: Optional codes of JSON error responses (returned with HTTP 200) to retry.
+            edit_status_codes: Optional HTTP status codes to retry for requests that are not
+                reads, these must mean the server did not process the request.
+            respect_retry_after: Optional boolean to wait as long as the Retry-After header asks.
+                Defaults to True.
+        """
+        self.max_retries = max_retries
+        self.max_edit_retries = max_edit_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.status_codes = status_codes
+        self.error_codes = error_codes
+        self.edit_status_codes = edit_status_codes
+        self.respect_retry_after = respect_retry_after
+
+    def is_idempotent(self, url, method='GET'):
+        """Checks if a request to a url is safe to repeat.  Read operations are, other
+                POST requests are not, and GET requests are unless they call an operation
+                that changes state (metadata requests are GETs of the resource url).
+
+        Args:
+            url: The request url.
+            method: Optional HTTP method of the request. Defaults to 'GET'.
+        """
+        operation = url.split('?')[0].rstrip('/').split('/')[-1]
+        if operation in self.read_operations:
+            return True
+        if (method or 'GET').upper() != 'GET':
+            return False
+        return operation not in self.non_idempotent_operations
+
+    def should_retry(self, attempt, url, status_code=None, error_code=None, exception=None, method='GET'):
+        """Checks if a failed request should be retried.
+
+        Args:
+            attempt: Number of retries already made for the request.
+            url: The request url.
+            status_code: Optional HTTP status code of the response.
+            error_code: Optional error code of a JSON error response.
+            exception: Optional exception raised while sending the request.
+            method: Optional HTTP method of the request. Defaults to 'GET'.
+        """
+        idempotent = self.is_idempotent(url, method)
+        if attempt >= (self.max_retries if idempotent else self.max_edit_retries):
+            return False
+        if exception is not None:
+            never_sent, transient = self._exception_types()
+            if not idempotent:
+                # the request may have reached the server, only retry if it never connected
+                return isinstance(exception, never_sent)
+            return isinstance(exception, transient)
+        if status_code is not None:
+            return status_code in (self.status_codes if idempotent else self.edit_status_codes)
+        if error_code is not None:
+            return idempotent and error_code in self.error_codes
+        return False
+
+    @staticmethod
+    def _exception_types():
+        """Returns a tuple of (exceptions raised before a request is sent, transient exceptions)."""
+        from requests.exceptions import ConnectTimeout, ConnectionError, Timeout
+        never_sent = (ConnectTimeout,)
+        transient = (ConnectionError, Timeout)
+        try:
+            import asyncio
+            import aiohttp
+            never_sent += (aiohttp.ClientConnectorError,)
+            transient += (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        except ImportError:
+            pass
+        return never_sent, transient
+
+    def get_backoff(self, attempt, retry_after=None):
+        """Returns the number of seconds to wait before the next attempt.
+
+        Args:
+            attempt: Number of retries already made for the request.
+            retry_after: Optional value of the Retry-After header.
+        """
+        delay = min([self.backoff_factor * (2 ** attempt), self.max_backoff])
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after and self.respect_retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                from email.utils import parsedate_tz, mktime_tz
+                date = parsedate_tz(retry_after)
+                wait = mktime_tz(date) - time.time() if date else 0
+            delay = max([delay, min([wait, self.max_backoff])])
+        return max([delay, 0])
+
+    def sleep(self, attempt, retry_after=None):
+        """Waits before the next attempt.
+
+        Args:
+            attempt: Number of retries already made for the request.
+            retry_after: Optional value of the Retry-After header.
+        """
+        time.sleep(self.get_backoff(attempt, retry_after))
+
+    def __repr__(self):
+        return '<{}: max_retries={}, max_edit_retries={}>'.format(self.__class__.__name__, self.max_retries, self.max_edit_retries)
+
 
 class RequestClient(object):
     """Represents a RequestClient"""
-    def __init__(self, session=None):
+    retry_policy = None
+
+    def __init__(self, session=None, pool_connections=None, pool_maxsize=None, pool_block=None, keep_alive=None, retry_policy=None):
+        """Inits class with an optional session and connection pool settings.
+
+        Args:
+            session: Optional requests.Session to use.
+            pool_connections: Optional number of host pools to cache. Defaults to 10.
+            pool_maxsize: Optional maximum number of connections kept per host. Defaults to 10.
+            pool_block: Optional boolean, if True no more than pool_maxsize connections
+                are opened per host and requests wait for a free connection.  Otherwise
+                extra connections are opened and discarded after use. Defaults to False.
+            keep_alive: Optional boolean to keep connections open between requests.
+                Defaults to True.
+            retry_policy: Optional RetryPolicy for transient failures, or True to use
+                RetryPolicy().  Defaults to None (no retries).
+        """
+        self.retry_policy = RetryPolicy() if retry_policy is True else retry_policy or None
+        pool_settings = (pool_connections, pool_maxsize, pool_block, keep_alive)
         if not session:
             session = Session()
+            self.mount_adapters(session, pool_connections, pool_maxsize, pool_block, keep_alive)
+        elif any(s is not None for s in pool_settings):
+            # only replace the adapters of a user supplied session when pool settings are given
+            self.mount_adapters(session, pool_connections, pool_maxsize, pool_block, keep_alive)
         self.session = session
 
+    @staticmethod
+    def mount_adapters(session, pool_connections=None, pool_maxsize=None, pool_block=None, keep_alive=None):
+        """Mounts a PoolStatsAdapter for http and https on a session.
+
+        Args:
+            session: The requests.Session.
+            pool_connections: Optional number of host pools to cache. Defaults to 10.
+            pool_maxsize: Optional maximum number of connections kept per host. Defaults to 10.
+            pool_block: Optional boolean to block when no connection is free. Defaults to False.
+            keep_alive: Optional boolean to keep connections open between requests.
+                Defaults to True.
+        """
+        keep_alive = keep_alive is not False
+        adapter = PoolStatsAdapter(pool_connections=pool_connections or DEFAULT_POOLSIZE,
+                                   pool_maxsize=pool_maxsize or DEFAULT_POOLSIZE,
+                                   pool_block=bool(pool_block), keep_alive=keep_alive)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        return adapter
+
+    def pool_stats(self):
+        """Returns connection statistics for the session, summed over all
+        mounted PoolStatsAdapters.
+
+        Returns:
+            A dict with "connections_opened", "requests", "reused" and "hosts" keys.
+        """
+        stats = {'connections_opened': 0, 'requests': 0, 'reused': 0, 'hosts': {}}
+        seen = []
+        for adapter in self.session.adapters.values():
+            if isinstance(adapter, PoolStatsAdapter) and adapter not in seen:
+                seen.append(adapter)
+                adapter_stats = adapter.pool_stats()
+                for key in ('connections_opened', 'requests', 'reused'):
+                    stats[key] += adapter_stats[key]
+                stats['hosts'].update(adapter_stats['hosts'])
+        return stats
+
 class DefaultRequestClient(RequestClient):
     """singleton for a DefaultRequestClient, should only be initialized once"""
     _instance = None
@@ -14,5 +312,5 @@ class DefaultRequestClient(RequestClient):
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
-            cls._instance = super(DefaultRequestClient, cls).__new__(cls, *args, **kwargs)
+            cls._instance = super(DefaultRequestClient, cls).__new__(cls)
         return cls._instance
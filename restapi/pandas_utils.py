@@ -0,0 +1,265 @@
+"""Conversion between feature sets and pandas DataFrames.  Feature sets are converted
+from their columnar form, so each field becomes a Series in one step: numeric fields
+keep their width (nullable integer dtypes when there are nulls), dates become UTC
+datetimes and coded value domains can be categoricals of the coded value names.
+DataFrames are converted back to Esri JSON features a column at a time for applyEdits.
+
+Requires pandas.
+"""
+import six
+from ._strings import *
+from .columnar import ColumnarFeatureSet, TYPECODES
+from .arrow_utils import esri_to_wkb, wkb_to_esri, WKB_POINT
+
+try:
+    import numpy
+    import pandas
+except ImportError:
+    numpy = None
+    pandas = None
+
+__all__ = ['to_dataframe', 'dataframe_to_features', 'GEOMETRY_COLUMN', 'GEOMETRY_FORMATS']
+
+# name of the geometry column of DataFrames
+GEOMETRY_COLUMN = 'SHAPE'
+
+# wkb: WKB bytes, coords: (n, stride) arrays of the vertices (a list of them, one per part, for
+# polylines and polygons), json: Esri JSON dicts
+GEOMETRY_FORMATS = ('wkb', 'coords', 'json')
+
+# nullable dtypes of integer fields with nulls
+NULLABLE_DTYPES = {'h': 'Int16', 'i': 'Int32', 'l': 'Int64', 'q': 'Int64'}
+
+
+def _check_pandas():
+    if pandas is None:
+        raise ImportError('pandas is required to convert feature sets to DataFrames')
+
+
+def _coded_values(field):
+    """Returns a dict of coded value names by code for a field, or None."""
+    domain = field.get(DOMAIN) or {}
+    if domain.get(CODED_VALUES):
+        return {cv.get(CODE): cv.get(NAME) for cv in domain[CODED_VALUES]}
+    return None
+
+
+def _series(column, coded_values=None):
+    """Returns a Series of a Column without going through the values row by row."""
+    if coded_values:
+        # mapped from the typed values, codes not in the domain are kept as text
+        names = [None if code is None else coded_values.get(code, six.text_type(code)) for code in column.to_list()]
+        return pandas.Series(names, dtype='category', name=column.name)
+    if not column.typecode:
+        series = pandas.Series(column.values, dtype=object)
+    else:
+        values = numpy.frombuffer(column.values, dtype=numpy.dtype(column.typecode)) if len(column) else numpy.array([], dtype=column.typecode)
+        mask = numpy.frombuffer(bytes(column.mask), dtype=numpy.bool_) if len(column) else numpy.zeros(0, dtype=numpy.bool_)
+        has_nulls = bool(column.null_count)
+        if column.type == DATE_FIELD:
+            values = values.astype('datetime64[ms]')
+            if has_nulls:
+                values[mask] = numpy.datetime64('NaT')
+            series = pandas.Series(values).dt.tz_localize('UTC')
+        elif column.typecode in ('f', 'd'):
+            if has_nulls:
+                values = values.copy()
+                values[mask] = numpy.nan
+            series = pandas.Series(values)
+        elif has_nulls:
+            series = pandas.Series(pandas.arrays.IntegerArray(values.copy(), mask.copy()), dtype=NULLABLE_DTYPES[column.typecode])
+        else:
+            series = pandas.Series(values.copy())
+    return series.rename(column.name)
+
+
+def _point_wkb(geometry_column):
+    """Returns the WKB of a point column, packed with a structured array."""
+    dims = 3 if geometry_column.has_z else 2
+    mask = numpy.frombuffer(bytes(geometry_column.mask), dtype=numpy.bool_)
+    record = numpy.dtype([('order', 'u1'), ('type', '<u4'), ('coords', '<f8', (dims,))])
+    points = numpy.zeros(int((~mask).sum()), dtype=record)
+    points['order'] = 1
+    points['type'] = WKB_POINT + (1000 if geometry_column.has_z else 0)
+    points['coords'] = geometry_column.to_numpy()[:, :dims]
+    raw, size = points.tobytes(), record.itemsize
+    wkb, i = [], 0
+    for null in mask:
+        if null:
+            wkb.append(None)
+        else:
+            wkb.append(raw[i * size:(i + 1) * size])
+            i += 1
+    return wkb
+
+
+def _geometry_series(geometry_column, geometry='wkb'):
+    """Returns a Series of the geometries in a format from GEOMETRY_FORMATS."""
+    if geometry == 'json':
+        values = list(geometry_column.iter_geometries())
+    elif geometry == 'coords':
+        coords, part_offsets, geometry_offsets = geometry_column.to_numpy(), geometry_column.part_offsets, geometry_column.geometry_offsets
+        if geometry_column.geometry_type in (ESRI_POINT, ESRI_MULTIPOINT):
+            values = [None if null else coords[part_offsets[geometry_offsets[i]]:part_offsets[geometry_offsets[i + 1]]]
+                      for i, null in enumerate(geometry_column.mask)]
+        else:
+            values = [None if null else [coords[part_offsets[p]:part_offsets[p + 1]] for p in six.moves.range(geometry_offsets[i], geometry_offsets[i + 1])]
+                      for i, null in enumerate(geometry_column.mask)]
+    elif geometry_column.geometry_type == ESRI_POINT:
+        values = _point_wkb(geometry_column)
+    else:
+        values = [esri_to_wkb(g, geometry_column.has_z) for g in geometry_column.iter_geometries()]
+    return pandas.Series(values, dtype=object, name=GEOMETRY_COLUMN)
+
+
+def to_dataframe(feature_set, geometry='wkb', coded_values=False, index=None):
+    """Returns a DataFrame of a feature set.
+
+    Args:
+        feature_set: A FeatureSet, PagedFeatureSet or ColumnarFeatureSet.
+        geometry: Optional format of the geometry column (named "SHAPE"): "wkb", "coords"
+            (an array of the vertices, or a list of arrays of the vertices of each part for
+            polylines and polygons) or "json", None leaves the geometries out. Defaults to "wkb".
+        coded_values: Optional boolean to convert coded value domain fields to categoricals
+            of the coded value names. Defaults to False.
+        index: Optional field name to use as the index, for example the OID field.
+
+    Raises:
+        ImportError: pandas is not installed.
+        ValueError: The geometry format is not supported.
+    """
+    _check_pandas()
+    if geometry and geometry not in GEOMETRY_FORMATS:
+        raise ValueError('Geometry format must be one of {}'.format(', '.join(GEOMETRY_FORMATS)))
+    columns = feature_set if isinstance(feature_set, ColumnarFeatureSet) else feature_set.to_columns()
+    domains = {f[NAME]: _coded_values(f) for f in columns.fields} if coded_values else {}
+    data = [_series(column, domains.get(name)) for name, column in six.iteritems(columns.columns)]
+    if geometry and columns.geometry is not None:
+        data.append(_geometry_series(columns.geometry, geometry))
+    df = pandas.concat(data, axis=1) if data else pandas.DataFrame(index=pandas.RangeIndex(len(columns)))
+    if index:
+        df = df.set_index(index)
+    return df
+
+
+def _code(name, codes, field_type=None):
+    """Returns the code of a coded value name, names that are not in the domain are codes
+            kept as text (see to_dataframe()) and are converted to the type of the field.
+    """
+    if name in codes:
+        return codes[name]
+    typecode = TYPECODES.get(field_type)
+    if typecode and isinstance(name, six.string_types):
+        try:
+            return float(name) if typecode in ('f', 'd') else int(name)
+        except ValueError:
+            pass
+    return name
+
+
+def _column_values(series, field=None):
+    """Returns the values of a Series as a list of JSON values with None for nulls."""
+    field = field or {}
+    if isinstance(series.dtype, pandas.CategoricalDtype):
+        # categoricals of coded value names are written as their codes
+        coded_values = _coded_values(field) or {}
+        codes = {name: code for code, name in six.iteritems(coded_values)}
+        series = series.cat.rename_categories(lambda name: _code(name, codes, field.get(TYPE))).astype(object)
+    if pandas.api.types.is_datetime64_any_dtype(series.dtype):
+        nulls = series.isna().to_numpy()
+        if getattr(series.dtype, 'tz', None) is not None:
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        millis = series.to_numpy(dtype='datetime64[ms]').astype('int64').tolist()
+        if nulls.any():
+            return [None if null else v for v, null in zip(millis, nulls)]
+        return millis
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+def _to_list(value):
+    """Returns nested lists of arrays, tuples or lists of vertices."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_to_list(v) for v in value]
+    return value
+
+
+def _to_geometry(value, geometry_type=None):
+    """Returns an Esri JSON geometry from a WKB, Esri JSON, Geometry, shapely or vertex
+            array value.
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return wkb_to_esri(value)
+    if isinstance(value, dict):
+        return value
+    if hasattr(value, 'wkb'):
+        # shapely geometries
+        return wkb_to_esri(value.wkb)
+    if hasattr(value, 'json') and isinstance(value.json, dict):
+        return dict(value.json)
+    vertices = _to_list(value)
+    if geometry_type == ESRI_POINT:
+        geometry = {'x': vertices[0][0], 'y': vertices[0][1]}
+        if len(vertices[0]) > 2:
+            geometry['z'] = vertices[0][2]
+        return geometry
+    key = {ESRI_MULTIPOINT: POINTS, ESRI_POLYLINE: PATHS, ESRI_POLYGON: RINGS}.get(geometry_type)
+    if key is None:
+        raise ValueError('A geometry type is required to convert vertex arrays')
+    if key == POINTS:
+        return {key: vertices}
+    # a list of arrays of the vertices of each part, or one array for a single part
+    is_parts = any(part and isinstance(part[0], list) for part in vertices)
+    return {key: vertices if is_parts else [vertices]}
+
+
+def dataframe_to_features(df, fields=None, geometry_column=GEOMETRY_COLUMN, geometry_type=None, spatial_reference=None):
+    """Yields the rows of a DataFrame as Esri JSON feature dicts for applyEdits.
+
+    Args:
+        df: The DataFrame, columns that are not fields are ignored when fields are given.
+        fields: Optional list of field definitions, the column names are matched to the
+            field names ignoring case.  Defaults to None (all columns).
+        geometry_column: Optional name of the geometry column, holding WKB, Esri JSON
+            dicts, Geometry objects, shapely geometries, vertex arrays or lists of vertex arrays
+            of each part (see to_dataframe()).  Defaults to "SHAPE".
+        geometry_type: Optional Esri geometry type, required for vertex arrays.
+        spatial_reference: Optional spatial reference dict added to the geometries.
+
+    Raises:
+        ImportError: pandas is not installed.
+    """
+    _check_pandas()
+    field_defs = {f[NAME].lower(): f for f in fields} if fields else None
+    names, values = [], []
+    for column in df.columns:
+        if column == geometry_column:
+            continue
+        if field_defs is None:
+            field = {NAME: column}
+        else:
+            field = field_defs.get(six.text_type(column).lower())
+            if field is None:
+                continue
+        names.append(field[NAME])
+        values.append(_column_values(df[column], field))
+
+    shapes = None
+    if geometry_column in df.columns:
+        shapes = [_to_geometry(v, geometry_type) for v in df[geometry_column].tolist()]
+        if spatial_reference:
+            for shape in shapes:
+                if shape is not None and SPATIAL_REFERENCE not in shape:
+                    shape[SPATIAL_REFERENCE] = spatial_reference
+
+    rows = zip(*values) if values else ([] for _ in six.moves.range(len(df)))
+    if shapes is None:
+        for row in rows:
+            yield {ATTRIBUTES: dict(zip(names, row))}
+        return
+    for row, shape in zip(rows, shapes):
+        yield {ATTRIBUTES: dict(zip(names, row)), GEOMETRY: shape}
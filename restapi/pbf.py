@@ -0,0 +1,477 @@
+"""Decoder for the protocol buffer format of feature layer queries (f=pbf).  ArcGIS
+Server 10.7+ and ArcGIS Online return an esriPBuffer.FeatureCollectionPBuffer
+message, which is decoded here into the same Esri JSON structure as f=json.
+
+The pure Python decoder has no dependencies.  If the protobuf package is installed
+its compiled parser is used instead, which is considerably faster for large pages.
+"""
+import json
+import struct
+
+try:
+    from itertools import accumulate
+except ImportError:
+    # python 2
+    def accumulate(iterable):
+        total = 0
+        for value in iterable:
+            total += value
+            yield total
+
+__all__ = ['decode_feature_collection', 'has_protobuf']
+
+GEOMETRY_TYPES = {
+    0: 'esriGeometryPoint',
+    1: 'esriGeometryMultipoint',
+    2: 'esriGeometryPolyline',
+    3: 'esriGeometryPolygon',
+    4: 'esriGeometryMultiPatch',
+    127: None
+}
+
+FIELD_TYPES = {
+    0: 'esriFieldTypeSmallInteger',
+    1: 'esriFieldTypeInteger',
+    2: 'esriFieldTypeSingle',
+    3: 'esriFieldTypeDouble',
+    4: 'esriFieldTypeString',
+    5: 'esriFieldTypeDate',
+    6: 'esriFieldTypeOID',
+    7: 'esriFieldTypeGeometry',
+    8: 'esriFieldTypeBlob',
+    9: 'esriFieldTypeRaster',
+    10: 'esriFieldTypeGUID',
+    11: 'esriFieldTypeGlobalID',
+    12: 'esriFieldTypeXML',
+    13: 'esriFieldTypeBigInteger',
+    14: 'esriFieldTypeDateOnly',
+    15: 'esriFieldTypeTimeOnly',
+    16: 'esriFieldTypeTimestampOffset'
+}
+
+# field properties that are not in the buffer, taken from the layer fields when given
+FIELD_PROPERTIES = ('type', 'alias', 'length', 'domain', 'nullable', 'editable', 'defaultValue')
+
+# quantizeOriginPostion values
+UPPER_LEFT = 0
+LOWER_LEFT = 1
+
+# message name -> {field number: (field name, type, repeated)}, enums are decoded as integers
+SCHEMA = {
+    'FeatureCollectionPBuffer': {
+        1: ('version', 'string', False),
+        2: ('queryResult', 'QueryResult', False),
+    },
+    'QueryResult': {
+        1: ('featureResult', 'FeatureResult', False),
+        2: ('countResult', 'CountResult', False),
+        3: ('idsResult', 'ObjectIdsResult', False),
+    },
+    'FeatureResult': {
+        1: ('objectIdFieldName', 'string', False),
+        2: ('uniqueIdField', 'UniqueIdField', False),
+        3: ('globalIdFieldName', 'string', False),
+        4: ('geohashFieldName', 'string', False),
+        5: ('geometryProperties', 'GeometryProperties', False),
+        6: ('serverGens', 'ServerGens', False),
+        7: ('geometryType', 'enum', False),
+        8: ('spatialReference', 'SpatialReference', False),
+        9: ('exceededTransferLimit', 'bool', False),
+        10: ('hasZ', 'bool', False),
+        11: ('hasM', 'bool', False),
+        12: ('transform', 'Transform', False),
+        13: ('fields', 'Field', True),
+        14: ('values', 'Value', True),
+        15: ('features', 'Feature', True),
+    },
+    'UniqueIdField': {
+        1: ('name', 'string', False),
+        2: ('isSystemMaintained', 'bool', False),
+    },
+    'GeometryProperties': {
+        1: ('shapeAreaFieldName', 'string', False),
+        2: ('shapeLengthFieldName', 'string', False),
+        3: ('units', 'string', False),
+    },
+    'ServerGens': {
+        1: ('minServerGen', 'uint64', False),
+        2: ('serverGen', 'uint64', False),
+    },
+    'SpatialReference': {
+        1: ('wkid', 'uint32', False),
+        2: ('lastestWkid', 'uint32', False),
+        3: ('vcsWkid', 'uint32', False),
+        4: ('latestVcsWkid', 'uint32', False),
+        5: ('wkt', 'string', False),
+    },
+    'Field': {
+        1: ('name', 'string', False),
+        2: ('fieldType', 'enum', False),
+        3: ('alias', 'string', False),
+        4: ('sqlType', 'enum', False),
+        5: ('domain', 'string', False),
+        6: ('defaultValue', 'string', False),
+    },
+    'Value': {
+        1: ('string_value', 'string', False),
+        2: ('float_value', 'float', False),
+        3: ('double_value', 'double', False),
+        4: ('sint_value', 'sint32', False),
+        5: ('uint_value', 'uint32', False),
+        6: ('int64_value', 'int64', False),
+        7: ('uint64_value', 'uint64', False),
+        8: ('sint64_value', 'sint64', False),
+        9: ('bool_value', 'bool', False),
+    },
+    'Geometry': {
+        2: ('lengths', 'uint32', True),
+        3: ('coords', 'sint64', True),
+    },
+    'esriShapeBuffer': {
+        1: ('bytes', 'bytes', False),
+    },
+    'Feature': {
+        1: ('attributes', 'Value', True),
+        2: ('geometry', 'Geometry', False),
+        3: ('shapeBuffer', 'esriShapeBuffer', False),
+        4: ('centroid', 'Geometry', False),
+    },
+    'Scale': {
+        1: ('xScale', 'double', False),
+        2: ('yScale', 'double', False),
+        3: ('mScale', 'double', False),
+        4: ('zScale', 'double', False),
+    },
+    'Translate': {
+        1: ('xTranslate', 'double', False),
+        2: ('yTranslate', 'double', False),
+        3: ('mTranslate', 'double', False),
+        4: ('zTranslate', 'double', False),
+    },
+    'Transform': {
+        1: ('quantizeOriginPostion', 'enum', False),
+        2: ('scale', 'Scale', False),
+        3: ('translate', 'Translate', False),
+    },
+    'CountResult': {
+        1: ('count', 'uint64', False),
+    },
+    'ObjectIdsResult': {
+        1: ('objectIdFieldName', 'string', False),
+        2: ('serverGens', 'ServerGens', False),
+        3: ('objectIds', 'uint64', True),
+    },
+}
+
+try:
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    has_protobuf = True
+except ImportError:
+    has_protobuf = False
+
+_message_class = None
+
+#-------------------------------------------------------------------------------
+# pure python decoder
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def _convert_varint(value, field_type):
+    if field_type in ('sint32', 'sint64'):
+        return (value >> 1) ^ -(value & 1)
+    if field_type == 'bool':
+        return bool(value)
+    if field_type in ('int64', 'enum') and value >= 1 << 63:
+        return value - (1 << 64)
+    return value
+
+def _read_packed(buf, pos, end, field_type):
+    """Decodes a packed repeated scalar field."""
+    if field_type == 'double':
+        return list(struct.unpack_from('<{}d'.format((end - pos) // 8), buf, pos))
+    if field_type == 'float':
+        return list(struct.unpack_from('<{}f'.format((end - pos) // 4), buf, pos))
+    values = []
+    append = values.append
+    zigzag = field_type in ('sint32', 'sint64')
+    while pos < end:
+        # inline varint decoding, this is the hot loop for coordinates
+        b = buf[pos]
+        pos += 1
+        value = b & 0x7f
+        shift = 7
+        while b & 0x80:
+            b = buf[pos]
+            pos += 1
+            value |= (b & 0x7f) << shift
+            shift += 7
+        append((value >> 1) ^ -(value & 1) if zigzag else value)
+    return values
+
+def _skip(buf, pos, wire_type):
+    if wire_type == 0:
+        return _read_varint(buf, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        length, pos = _read_varint(buf, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError('Unsupported protocol buffer wire type: {}'.format(wire_type))
+
+def _decode_message(buf, pos, end, name):
+    """Decodes a message into a dict, only fields present in the buffer are set."""
+    schema = SCHEMA[name]
+    message = {}
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field = schema.get(key >> 3)
+        wire_type = key & 7
+        if field is None:
+            pos = _skip(buf, pos, wire_type)
+            continue
+        field_name, field_type, repeated = field
+        if wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            stop = pos + length
+            if field_type in SCHEMA:
+                value = _decode_message(buf, pos, stop, field_type)
+            elif field_type == 'string':
+                value = bytes(buf[pos:stop]).decode('utf-8')
+            elif field_type == 'bytes':
+                value = bytes(buf[pos:stop])
+            else:
+                message.setdefault(field_name, []).extend(_read_packed(buf, pos, stop, field_type))
+                pos = stop
+                continue
+            pos = stop
+        elif wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+            value = _convert_varint(value, field_type)
+        elif wire_type == 1:
+            value = struct.unpack_from('<d' if field_type == 'double' else '<Q', buf, pos)[0]
+            pos += 8
+        elif wire_type == 5:
+            value = struct.unpack_from('<f' if field_type == 'float' else '<I', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protocol buffer wire type: {}'.format(wire_type))
+        if repeated:
+            message.setdefault(field_name, []).append(value)
+        else:
+            message[field_name] = value
+    return message
+
+#-------------------------------------------------------------------------------
+# protobuf decoder
+def _get_message_class():
+    """Builds the FeatureCollectionPBuffer message class from SCHEMA."""
+    global _message_class
+    if _message_class is None:
+        Field = descriptor_pb2.FieldDescriptorProto
+        types = {
+            'string': Field.TYPE_STRING, 'bytes': Field.TYPE_BYTES, 'bool': Field.TYPE_BOOL,
+            'uint32': Field.TYPE_UINT32, 'uint64': Field.TYPE_UINT64, 'int64': Field.TYPE_INT64,
+            'sint32': Field.TYPE_SINT32, 'sint64': Field.TYPE_SINT64, 'float': Field.TYPE_FLOAT,
+            'double': Field.TYPE_DOUBLE, 'enum': Field.TYPE_INT32
+        }
+        file_proto = descriptor_pb2.FileDescriptorProto(name='restapi_esriPBuffer.proto', package='restapi_esriPBuffer',
+                                                        syntax='proto3')
+        for name, schema in SCHEMA.items():
+            message = file_proto.message_type.add(name=name)
+            if name == 'Value':
+                # the value fields form a oneof, so a null value can be told apart from 0 or ''
+                message.oneof_decl.add(name='value_type')
+            for number, (field_name, field_type, repeated) in sorted(schema.items()):
+                field = message.field.add(name=field_name, number=number,
+                                          label=Field.LABEL_REPEATED if repeated else Field.LABEL_OPTIONAL)
+                if field_type in SCHEMA:
+                    field.type = Field.TYPE_MESSAGE
+                    field.type_name = '.restapi_esriPBuffer.' + field_type
+                else:
+                    field.type = types[field_type]
+                if name == 'Value':
+                    field.oneof_index = 0
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(file_proto)
+        descriptor = pool.FindMessageTypeByName('restapi_esriPBuffer.FeatureCollectionPBuffer')
+        if hasattr(message_factory, 'GetMessageClass'):
+            _message_class = message_factory.GetMessageClass(descriptor)
+        else:
+            _message_class = message_factory.MessageFactory(pool).GetPrototype(descriptor)
+    return _message_class
+
+def _message_to_dict(message):
+    """Converts a protobuf message to the same dict structure as the pure python decoder."""
+    result = {}
+    for field, value in message.ListFields():
+        # newer protobuf versions replaced the label with is_repeated
+        repeated = field.is_repeated if hasattr(field, 'is_repeated') else field.label == field.LABEL_REPEATED
+        if field.message_type is not None:
+            value = [_message_to_dict(v) for v in value] if repeated else _message_to_dict(value)
+        elif repeated:
+            value = list(value)
+        result[field.name] = value
+    return result
+
+#-------------------------------------------------------------------------------
+# conversion to esri json
+def _value(value):
+    for v in value.values():
+        return v
+    return None
+
+def _decode_geometry(geometry, geometry_type, transform, has_z=False, has_m=False):
+    """Converts a quantized, delta encoded geometry to Esri JSON."""
+    coords = geometry.get('coords', [])
+    if not coords:
+        return None
+    x_scale, y_scale, z_scale, m_scale, x_trans, y_trans, z_trans, m_trans, upper_left = transform
+    dims = 2 + has_z + has_m
+    lengths = geometry.get('lengths') or [len(coords) // dims]
+
+    # x and y are delta encoded, undo that for all parts at once with running sums
+    xs = [x * x_scale + x_trans for x in accumulate(coords[0::dims])]
+    if upper_left:
+        ys = [y_trans - y * y_scale for y in accumulate(coords[1::dims])]
+    else:
+        ys = [y * y_scale + y_trans for y in accumulate(coords[1::dims])]
+    columns = [xs, ys]
+    if has_z:
+        columns.append([z * z_scale + z_trans for z in coords[2::dims]])
+    if has_m:
+        columns.append([m * m_scale + m_trans for m in coords[dims - 1::dims]])
+    points = list(map(list, zip(*columns)))
+
+    parts = []
+    start = 0
+    for length in lengths:
+        parts.append(points[start:start + length])
+        start += length
+
+    if geometry_type == 'esriGeometryPoint':
+        point = parts[0][0]
+        geom = {'x': point[0], 'y': point[1]}
+        if has_z:
+            geom['z'] = point[2]
+        if has_m:
+            geom['m'] = point[-1]
+        return geom
+    elif geometry_type == 'esriGeometryMultipoint':
+        return {'points': [p for part in parts for p in part]}
+    elif geometry_type == 'esriGeometryPolyline':
+        return {'paths': parts}
+    return {'rings': parts}
+
+def _feature_set(result, layer_fields=None):
+    """Converts a decoded FeatureResult to an Esri JSON feature set.
+
+    Args:
+        result: The decoded FeatureResult.
+        layer_fields: Optional field definitions of the layer, used for the properties of
+            the fields that the buffer does not have (length, domain, etc.).
+    """
+    geometry_type = GEOMETRY_TYPES.get(result.get('geometryType', 0))
+    has_z, has_m = result.get('hasZ', False), result.get('hasM', False)
+
+    if 'transform' in result:
+        transform = result['transform']
+        scale, translate = transform.get('scale', {}), transform.get('translate', {})
+        coord_transform = (scale.get('xScale', 1), scale.get('yScale', 1),
+                           scale.get('zScale', 1), scale.get('mScale', 1),
+                           translate.get('xTranslate', 0), translate.get('yTranslate', 0),
+                           translate.get('zTranslate', 0), translate.get('mTranslate', 0),
+                           transform.get('quantizeOriginPostion', UPPER_LEFT) == UPPER_LEFT)
+    else:
+        coord_transform = (1, 1, 1, 1, 0, 0, 0, 0, False)
+
+    lookup = {f.get('name', '').lower(): f for f in layer_fields or []}
+    fields = []
+    for fld in result.get('fields', []):
+        field = {'name': fld.get('name'), 'type': FIELD_TYPES.get(fld.get('fieldType', 0)), 'alias': fld.get('alias', fld.get('name'))}
+        if fld.get('domain'):
+            try:
+                field['domain'] = json.loads(fld['domain'])
+            except ValueError:
+                field['domain'] = fld['domain']
+        if fld.get('defaultValue'):
+            field['defaultValue'] = fld['defaultValue']
+        layer_field = lookup.get((fld.get('name') or '').lower()) or {}
+        for key in FIELD_PROPERTIES:
+            if field.get(key) is None and layer_field.get(key) is not None:
+                field[key] = layer_field[key]
+        fields.append(field)
+    names = [f['name'] for f in fields]
+
+    features = []
+    for feat in result.get('features', []):
+        feature = {'attributes': dict(zip(names, map(_value, feat.get('attributes', []))))}
+        if 'geometry' in feat:
+            geometry = _decode_geometry(feat['geometry'], geometry_type, coord_transform, has_z, has_m)
+            if geometry is not None:
+                feature['geometry'] = geometry
+        features.append(feature)
+
+    feature_set = {'fields': fields, 'features': features}
+    for key in ('objectIdFieldName', 'globalIdFieldName', 'uniqueIdField', 'geometryProperties', 'serverGens'):
+        if result.get(key):
+            feature_set[key] = result[key]
+    if geometry_type:
+        feature_set['geometryType'] = geometry_type
+    sr = result.get('spatialReference')
+    if sr:
+        if sr.get('wkid'):
+            feature_set['spatialReference'] = {'wkid': sr['wkid'], 'latestWkid': sr.get('lastestWkid') or sr['wkid']}
+            if sr.get('vcsWkid'):
+                feature_set['spatialReference'].update({'vcsWkid': sr['vcsWkid'], 'latestVcsWkid': sr.get('latestVcsWkid') or sr['vcsWkid']})
+        elif sr.get('wkt'):
+            feature_set['spatialReference'] = {'wkt': sr['wkt']}
+    if has_z:
+        feature_set['hasZ'] = True
+    if has_m:
+        feature_set['hasM'] = True
+    if result.get('exceededTransferLimit'):
+        feature_set['exceededTransferLimit'] = True
+    return feature_set
+
+def decode_feature_collection(content, use_protobuf=None, fields=None):
+    """Decodes a query response in the protocol buffer format to Esri JSON.
+
+    Args:
+        content: The response content as bytes.
+        use_protobuf: Optional boolean to use the compiled protobuf parser. Defaults to
+            None, which uses it when the protobuf package is installed.
+        fields: Optional field definitions of the layer, the buffer has no field lengths
+            and only some field properties, these are filled in from the layer fields.
+
+    Returns:
+        A dict with a feature set, or the "count" or "objectIds" result of the query.
+    """
+    if use_protobuf is None:
+        use_protobuf = has_protobuf
+    if use_protobuf:
+        message = _get_message_class()()
+        message.ParseFromString(bytes(content))
+        collection = _message_to_dict(message)
+    else:
+        buf = bytearray(content)
+        collection = _decode_message(buf, 0, len(buf), 'FeatureCollectionPBuffer')
+
+    query_result = collection.get('queryResult', {})
+    if 'countResult' in query_result:
+        return {'count': query_result['countResult'].get('count', 0)}
+    if 'idsResult' in query_result:
+        ids = query_result['idsResult']
+        result = {'objectIdFieldName': ids.get('objectIdFieldName'), 'objectIds': ids.get('objectIds', [])}
+        if ids.get('serverGens'):
+            result['serverGens'] = ids['serverGens']
+        return result
+    return _feature_set(query_result.get('featureResult', {}), fields)
@@ -0,0 +1,143 @@
+"""Geometry payload reduction for queries.  Geometries can be requested with fewer
+decimals (geometryPrecision), generalized (maxAllowableOffset) and quantized to
+integer, delta encoded coordinates (quantizationParameters).  Quantized JSON
+responses are decoded here back into normal geometries.
+"""
+import re
+import math
+from ._strings import FEATURES, GEOMETRY, GEOMETRY_PRECISION, MAX_ALLOWABLE_OFFSET, QUANTIZATION_PARAMETERS, TRANSFORM
+
+try:
+    from itertools import accumulate
+except ImportError:
+    # python 2
+    def accumulate(iterable):
+        total = 0
+        for value in iterable:
+            total += value
+            yield total
+
+__all__ = ['GEOMETRY_PRESETS', 'tile_resolution', 'units_per_meter', 'reduction_params', 'dequantize']
+
+# resolution in meters, generalize, quantize
+GEOMETRY_PRESETS = {
+    'full': None,
+    'analysis': (0.001, False, False),
+    'display': (0.5, True, True),
+    'overview': (50.0, True, True)
+}
+
+# approximate length of a degree at the equator
+METERS_PER_DEGREE = 111319.49079327357
+
+UPPER_LEFT = 'upperLeft'
+
+
+def tile_resolution(zoom, tile_size=256):
+    """Returns the size of a pixel in meters for a Web Mercator tile zoom level, use it
+            as the resolution of geometries drawn on web map tiles.
+
+    Args:
+        zoom: The zoom level.
+        tile_size: Optional tile size in pixels. Defaults to 256.
+    """
+    return 2 * math.pi * 6378137.0 / tile_size / 2 ** zoom
+
+
+def units_per_meter(wkt):
+    """Returns the number of map units in one meter for a spatial reference.
+
+    Args:
+        wkt: Well known text of the spatial reference, may be None.
+    """
+    if not wkt:
+        return 1.0
+    if wkt.lstrip().upper().startswith('GEOGCS'):
+        return 1.0 / METERS_PER_DEGREE
+    units = re.findall(r"UNIT\[['\"][^'\"]+['\"],\s*([0-9.Ee+-]+)\]", wkt)
+    try:
+        return 1.0 / float(units[-1])
+    except (IndexError, ValueError, ZeroDivisionError):
+        return 1.0
+
+
+def reduction_params(tolerance, extent=None, generalize=True, quantize=True):
+    """Returns the query parameters to reduce geometries to a tolerance.
+
+    Args:
+        tolerance: The tolerance in map units of the output spatial reference.
+        extent: Optional extent dict of the output spatial reference, required to quantize.
+        generalize: Optional boolean to generalize geometries (maxAllowableOffset).
+            Defaults to True.
+        quantize: Optional boolean to quantize geometries (quantizationParameters).
+            Defaults to True.
+    """
+    params = {GEOMETRY_PRECISION: max([int(math.ceil(-math.log10(tolerance))), 0])}
+    if generalize:
+        params[MAX_ALLOWABLE_OFFSET] = tolerance
+    if quantize and extent:
+        params[QUANTIZATION_PARAMETERS] = {
+            'mode': 'view',
+            'originPosition': UPPER_LEFT,
+            'tolerance': tolerance,
+            'extent': extent
+        }
+    return params
+
+
+def _dequantize_path(path, transform):
+    """Returns the coordinates of a delta encoded path."""
+    x_scale, y_scale, x_trans, y_trans, upper_left = transform
+    xs = accumulate(c[0] for c in path)
+    ys = accumulate(c[1] for c in path)
+    if upper_left:
+        return [[x * x_scale + x_trans, y_trans - y * y_scale] + list(c[2:]) for x, y, c in zip(xs, ys, path)]
+    return [[x * x_scale + x_trans, y * y_scale + y_trans] + list(c[2:]) for x, y, c in zip(xs, ys, path)]
+
+
+def dequantize_geometry(geometry, transform):
+    """Decodes a quantized geometry in place.
+
+    Args:
+        geometry: The geometry dict.
+        transform: Tuple of (x scale, y scale, x translate, y translate, upper left origin).
+    """
+    if not geometry:
+        return geometry
+    x_scale, y_scale, x_trans, y_trans, upper_left = transform
+    if 'x' in geometry and geometry['x'] is not None:
+        geometry['x'] = geometry['x'] * x_scale + x_trans
+        geometry['y'] = y_trans - geometry['y'] * y_scale if upper_left else geometry['y'] * y_scale + y_trans
+    for key in ('paths', 'rings'):
+        if key in geometry:
+            geometry[key] = [_dequantize_path(path, transform) for path in geometry[key]]
+    if 'points' in geometry:
+        geometry['points'] = _dequantize_path(geometry['points'], transform)
+    return geometry
+
+
+def read_transform(transform):
+    """Returns the coordinate transform tuple of a response "transform".
+
+    Args:
+        transform: The transform dict of a quantized response.
+    """
+    scale, translate = transform.get('scale') or [1, 1], transform.get('translate') or [0, 0]
+    return (scale[0], scale[1], translate[0], translate[1], transform.get('originPosition', UPPER_LEFT) == UPPER_LEFT)
+
+
+def dequantize(response):
+    """Decodes the geometries of a quantized query response in place and removes its
+            transform, so it has the same structure as an unquantized response.
+
+    Args:
+        response: The JSON response dict.
+    """
+    transform = response.get(TRANSFORM) if isinstance(response, dict) else None
+    if not transform:
+        return response
+    transform = read_transform(transform)
+    for feature in response.get(FEATURES) or []:
+        dequantize_geometry(feature.get(GEOMETRY), transform)
+    del response[TRANSFORM]
+    return response
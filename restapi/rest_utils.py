@@ -5,6 +5,9 @@ import requests
 import fnmatch
 import datetime
 import collections
+import threading
+import itertools
+import heapq
 import mimetypes
 import warnings
 import tempfile
@@ -17,10 +20,14 @@ import sys
 import munch
 from collections import namedtuple, OrderedDict
 from ._strings import *
-from .exceptions import RequestError
+from .exceptions import RequestError, RestAPIException
 from . import projections
 from . import enums
-from .globals import RequestClient, DefaultRequestClient
+from .globals import RequestClient, DefaultRequestClient, RetryPolicy
+from .quantization import dequantize_geometry, read_transform
+from .columnar import ColumnarFeatureSet
+from .pandas_utils import to_dataframe
+from .cache import MetadataCache, set_metadata_cache, get_metadata_cache, QueryCache, set_query_cache, get_query_cache
 from uuid import UUID
 import warnings
 
@@ -37,11 +44,151 @@ STANDARD_HEADERS = {
     }
 
 
+# GLOBAL JSON DECODER
+jsonDecoder = None
+
+
+def set_json_decoder(decoder=None):
+    """Sets the function used to decode JSON responses.
+
+    Args:
+        decoder: Optional name of a decoder backend ('json', 'orjson' or 'ujson') or
+            a function that takes the response body (bytes) and returns the decoded
+            object.  Defaults to the RESTAPI_JSON_DECODER environment variable, or
+            the standard library json module.
+
+    Returns:
+        The decoder function.
+    """
+    global jsonDecoder
+    decoder = decoder or os.getenv('RESTAPI_JSON_DECODER') or 'json'
+    if hasattr(decoder, '__call__'):
+        jsonDecoder = decoder
+    elif decoder == 'orjson':
+        import orjson
+        jsonDecoder = orjson.loads
+    elif decoder == 'ujson':
+        import ujson
+        jsonDecoder = lambda content: ujson.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+    elif decoder == 'json':
+        jsonDecoder = lambda content: json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+    else:
+        raise ValueError('Unknown JSON decoder: "{}"'.format(decoder))
+    return jsonDecoder
+
+
+def get_json_decoder():
+    """Returns the function used to decode JSON responses."""
+    if not jsonDecoder:
+        set_json_decoder()
+    return jsonDecoder
+
+
+def decode_json(content):
+    """Decodes a JSON response body with the configured decoder.
+
+    Args:
+        content: Response body as bytes or string.
+    """
+    return get_json_decoder()(content)
+
+
+def _lazy_value(value):
+    """Wraps a decoded dict or list of containers so its items are converted on access."""
+    if type(value) is dict:
+        return LazyMunch(value)
+    # only lists of objects or arrays are wrapped, there is nothing to convert in a list of scalars
+    if type(value) is list and value and isinstance(value[0], (dict, list)):
+        return LazyList(value)
+    return value
+
+
+class LazyMunch(munch.Munch):
+    """Munch that converts nested dicts to LazyMunch objects when they are accessed
+            instead of copying the whole structure up front like munch.munchify().
+            Converted values are stored back, so repeated access returns the same object.
+    """
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        converted = _lazy_value(value)
+        if converted is not value:
+            dict.__setitem__(self, key, converted)
+        return converted
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def pop(self, key, *default):
+        return _lazy_value(dict.pop(self, key, *default))
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def copy(self):
+        return self.__class__(self)
+
+
+class LazyList(list):
+    """List that converts its nested dicts to LazyMunch objects when they are accessed."""
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return LazyList(value)
+        converted = _lazy_value(value)
+        if converted is not value:
+            list.__setitem__(self, index, converted)
+        return converted
+
+    def __iter__(self):
+        for i, value in enumerate(list.__iter__(self)):
+            converted = _lazy_value(value)
+            if converted is not value:
+                list.__setitem__(self, i, converted)
+            yield converted
+
+    def pop(self, *index):
+        return _lazy_value(list.pop(self, *index))
+
+
+def lazy_munchify(obj):
+    """Lightweight replacement for munch.munchify(), nested objects are converted
+            when they are accessed.
+
+    Args:
+        obj: A decoded JSON object.
+    """
+    if isinstance(obj, munch.Munch):
+        return obj
+    if isinstance(obj, dict):
+        return LazyMunch(obj)
+    if isinstance(obj, list):
+        return LazyList(obj)
+    return obj
+
+
 def set_request_client(client=None, *args, **kwargs):
+    """Sets the global request client.
+
+    Args:
+        client: Optional restapi.RequestClient, if None the default client is used.
+        kwargs: Optional connection pool settings (pool_connections, pool_maxsize,
+            pool_block, keep_alive) and retry_policy, see restapi.RequestClient.
+    """
     if not isinstance(client, RequestClient):
         warnings.warn('no request client has been set, using default client')
         client = DefaultRequestClient(*args, **kwargs)
         client.session.verify = False if os.getenv('RESTAPI_VERIFY_CERT') == 'FALSE' else True
+    elif kwargs:
+        if 'retry_policy' in kwargs:
+            retry_policy = kwargs.pop('retry_policy')
+            client.retry_policy = RetryPolicy() if retry_policy is True else retry_policy or None
+        if kwargs:
+            client.mount_adapters(client.session, **kwargs)
     client = add_standard_headers(client)
     global requestClient
     requestClient = client
@@ -113,6 +260,166 @@ def munch_repr(self):
 # override repr(Munch)
 munch.Munch.__repr__ = munch_repr
 
+class TokenStore(dict):
+    """Dictionary of tokens keyed by the url they were registered for.  Besides the
+            dict itself, the tokens are indexed in a character trie of the urls, a
+            lookup of the token strings and a heap ordered by expiration, so finding
+            the token for a url is O(length of url) and removing expired tokens is
+            O(number expired).  All access is guarded by a lock so the store can be
+            shared by worker threads.
+    """
+    _END = None
+
+    def __init__(self, *args, **kwargs):
+        super(TokenStore, self).__init__()
+        self._lock = threading.RLock()
+        self._trie = {}
+        self._token_strings = {}
+        self._expiry_heap = []
+        self._counter = itertools.count()
+        self.update(*args, **kwargs)
+
+    @staticmethod
+    def _normalize(url):
+        # fnmatch uses the same normalization, so lookups match the original behavior
+        return os.path.normcase(url)
+
+    @staticmethod
+    def _token_string(token):
+        return str(token) if isinstance(token, Token) else token.get(TOKEN)
+
+    @staticmethod
+    def _expires(token):
+        try:
+            return float(token.get(EXPIRES))
+        except (TypeError, ValueError):
+            return None
+
+    def __setitem__(self, url, token):
+        with self._lock:
+            if dict.__contains__(self, url):
+                self._unindex(url, dict.__getitem__(self, url))
+            dict.__setitem__(self, url, token)
+            node = self._trie
+            for char in self._normalize(url):
+                node = node.setdefault(char, {})
+            node.setdefault(self._END, set()).add(url)
+            token_string = self._token_string(token)
+            if token_string:
+                self._token_strings[token_string] = url
+            expires = self._expires(token)
+            if expires is not None:
+                heapq.heappush(self._expiry_heap, (expires, next(self._counter), url, token))
+
+    def __delitem__(self, url):
+        with self._lock:
+            token = dict.__getitem__(self, url)
+            dict.__delitem__(self, url)
+            self._unindex(url, token)
+
+    def _unindex(self, url, token):
+        chars = self._normalize(url)
+        path = [self._trie]
+        for char in chars:
+            node = path[-1].get(char)
+            if node is None:
+                break
+            path.append(node)
+        else:
+            urls = path[-1].get(self._END, set())
+            urls.discard(url)
+            if not urls:
+                path[-1].pop(self._END, None)
+            # prune branches that no longer lead to a url
+            for i in range(len(chars), 0, -1):
+                if path[i]:
+                    break
+                del path[i - 1][chars[i - 1]]
+        token_string = self._token_string(token)
+        if token_string and self._token_strings.get(token_string) == url:
+            del self._token_strings[token_string]
+        # expired heap entries are dropped lazily in flush_expired()
+
+    def pop(self, url, *default):
+        with self._lock:
+            if url in self:
+                token = self[url]
+                del self[url]
+                return token
+            if default:
+                return default[0]
+            raise KeyError(url)
+
+    def popitem(self):
+        with self._lock:
+            url = next(iter(self))
+            return url, self.pop(url)
+
+    def setdefault(self, url, default=None):
+        with self._lock:
+            if url not in self:
+                self[url] = default
+            return self[url]
+
+    def update(self, *args, **kwargs):
+        with self._lock:
+            for url, token in six.iteritems(dict(*args, **kwargs)):
+                self[url] = token
+
+    def clear(self):
+        with self._lock:
+            dict.clear(self)
+            self._trie = {}
+            self._token_strings = {}
+            self._expiry_heap = []
+
+    def copy(self):
+        with self._lock:
+            return TokenStore(self)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def match(self, url):
+        """Returns the (url, token) pairs registered for a prefix of a url (or for the
+                token string itself), longest prefix first.
+
+        Args:
+            url: URL for secured resource, or token as a string.
+        """
+        with self._lock:
+            matches = []
+            node = self._trie
+            for char in self._normalize(url):
+                node = node.get(char)
+                if node is None:
+                    break
+                if self._END in node:
+                    matches.extend(node[self._END])
+            matches = [(u, dict.__getitem__(self, u)) for u in reversed(matches)]
+            if url in self._token_strings:
+                u = self._token_strings[url]
+                matches.insert(0, (u, dict.__getitem__(self, u)))
+            return matches
+
+    def flush_expired(self):
+        """Removes the expired tokens.
+
+        Returns:
+            A list of the removed tokens.
+        """
+        now = time.time() * 1000
+        removed = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] < now:
+                _, _, url, token = heapq.heappop(self._expiry_heap)
+                # skip stale heap entries for tokens that were replaced or removed
+                if dict.get(self, url) is token:
+                    del self[url]
+                    removed.append(token)
+        return removed
+
+
 class IdentityManager(object):
     """Identity Manager for secured services.  This will allow the user to only have
             to sign in once (until the token expires) when accessing a services
@@ -122,15 +429,214 @@ class IdentityManager(object):
         tokens: Dictionary of the tokens.
         proxies: Dictionary of the proxies.
         portal_tokens: Dictionary of the portal tokens.
+        refresh_threshold: Fraction of a token's lifetime after which it is refreshed,
+            if credentials are registered for it. Defaults to 0.8.
+        auto_refresh: If True, generate_token() registers the credentials it was called
+            with so the token is refreshed before it expires. Defaults to False.
     """
+    refresh_threshold = 0.8
+    auto_refresh = False
+
     def __init__(self):
-        self.tokens = {}
+        self.tokens = TokenStore()
         self.proxies = {}
-        self._portal_tokens = {}
+        self._portal_tokens = TokenStore()
+        self._credentials = {}
+        self._refresh_locks = {}
+        self._pending_refreshes = set()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._refresh_thread = None
+        self._stop_refresh = threading.Event()
+
+    def register_credentials(self, url, usr=None, pw=None, callback=None, expiration=60, client=None, **kwargs):
+        """Keeps credentials for a url so its tokens are refreshed before they expire.
+
+        Args:
+            url: URL the credentials are used for, usually a services directory.
+            usr: Optional username for generate_token().
+            pw: Optional password for generate_token().
+            callback: Optional function called with the url that returns a new Token (or
+                the JSON response of a token request), use instead of usr and pw.
+            expiration: Optional arg for time (in minutes) for token lifetime. Defaults to 60.
+            client: Optional restapi.RequestClient used to request tokens.
+            kwargs: Optional extra keyword arguments for generate_token().
+        """
+        if not callback and not (usr and pw):
+            raise ValueError('either a callback or a username and password are required')
+        with self._lock:
+            self._credentials[url] = munch.munchify({'usr': usr, 'pw': pw, 'expiration': expiration, 'kwargs': kwargs})
+            self._credentials[url].callback = callback
+            self._credentials[url].client = client
+
+    def unregister_credentials(self, url):
+        """Removes credentials registered for a url.
+
+        Args:
+            url: URL the credentials were registered for.
+        """
+        with self._lock:
+            self._credentials.pop(url, None)
+
+    def _find_credentials(self, url):
+        """Returns a tuple of (registered url, credentials) for the longest registered url that
+                is a prefix of the url, or (None, None)."""
+        # urls are compared like the token urls in TokenStore
+        url = TokenStore._normalize(url)
+        with self._lock:
+            matches = [u for u in self._credentials if url.startswith(TokenStore._normalize(u))]
+            if not matches:
+                return None, None
+            registered_url = max(matches, key=len)
+            return registered_url, self._credentials[registered_url]
+
+    def _latest_token(self, url):
+        """Returns the valid token registered for a url without refreshing it."""
+        for registered_url, token in sorted(self.tokens.match(url) + self._portal_tokens.match(url), key=lambda m: -len(m[0])):
+            if not token.isExpired:
+                return token
+        return None
+
+    def needs_refresh(self, token):
+        """Checks if a token has reached the refresh threshold of its lifetime.
+
+        Args:
+            token: A restapi.Token.
+        """
+        issued, expires = getattr(token, 'issued', None), token.get(EXPIRES) if isinstance(token, Token) else None
+        if not issued or not expires:
+            return False
+        lifetime = float(expires) - issued
+        return lifetime <= 0 or (time.time() * 1000 - issued) >= lifetime * self.refresh_threshold
+
+    def refresh_token(self, url, block=True):
+        """Requests a new token for a url with the registered credentials.  Refreshing is
+                single-flight: while one thread requests a token, other threads either wait
+                for it (block=True) or keep using the current token (block=False).
+
+        Args:
+            url: URL for secured resource.
+            block: Optional boolean to wait for a refresh in progress. Defaults to True.
+
+        Returns:
+            The new token, or None if no credentials are registered or another thread
+                is already refreshing and block is False.
+        """
+        registered_url, credentials = self._find_credentials(url)
+        if not credentials or getattr(self._local, 'refreshing', False):
+            return None
+        with self._lock:
+            lock = self._refresh_locks.setdefault(registered_url, threading.Lock())
+        if not lock.acquire(block):
+            return None
+        try:
+            # another thread may have refreshed the token while this one was waiting
+            current = self._latest_token(url)
+            if current is not None and not self.needs_refresh(current):
+                return current
+            self._local.refreshing = True
+            if credentials.callback:
+                token = credentials.callback(registered_url)
+                if not isinstance(token, Token):
+                    token = Token(dict({DOMAIN: registered_url}, **token))
+                self.tokens[token.domain] = token
+            else:
+                token = generate_token(registered_url, credentials.usr, credentials.pw, credentials.expiration,
+                                       client=credentials.client, **credentials.kwargs)
+            return token
+        finally:
+            self._local.refreshing = False
+            lock.release()
+
+    def refresh_in_background(self, url):
+        """Refreshes the token for a url on a daemon thread, so the requesting thread keeps
+                using the current token instead of waiting for the new one.  Only one
+                background refresh runs per registered url at a time.
+
+        Args:
+            url: URL for secured resource.
+
+        Returns:
+            The thread refreshing the token, or None if no credentials are registered
+                or a refresh is already in progress.
+        """
+        registered_url, credentials = self._find_credentials(url)
+        if not credentials or getattr(self._local, 'refreshing', False):
+            return None
+        with self._lock:
+            if registered_url in self._pending_refreshes:
+                return None
+            self._pending_refreshes.add(registered_url)
+
+        def refresh():
+            try:
+                self.refresh_token(url, block=False)
+            except Exception as e:
+                warnings.warn('failed to refresh token for "{}": {}'.format(url, e))
+            finally:
+                with self._lock:
+                    self._pending_refreshes.discard(registered_url)
+
+        thread = threading.Thread(target=refresh, name='restapi-token-refresh')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def start_auto_refresh(self, interval=30):
+        """Starts a daemon thread that refreshes tokens with registered credentials
+                before they expire, so no request has to wait for a token.
+
+        Args:
+            interval: Optional number of seconds between checks. Defaults to 30.
+        """
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return self._refresh_thread
+        self._stop_refresh.clear()
+
+        def refresh_loop():
+            while not self._stop_refresh.wait(interval):
+                with self._lock:
+                    urls = list(self._credentials.keys())
+                for url in urls:
+                    token = self._latest_token(url)
+                    if token is None or self.needs_refresh(token):
+                        try:
+                            self.refresh_token(url, block=False)
+                        except Exception as e:
+                            warnings.warn('failed to refresh token for "{}": {}'.format(url, e))
+
+        self._refresh_thread = threading.Thread(target=refresh_loop, name='restapi-token-refresh')
+        self._refresh_thread.daemon = True
+        self._refresh_thread.start()
+        return self._refresh_thread
+
+    def stop_auto_refresh(self):
+        """Stops the background token refresh thread."""
+        self._stop_refresh.set()
+        if self._refresh_thread:
+            self._refresh_thread.join()
+        self._refresh_thread = None
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens if isinstance(tokens, TokenStore) else TokenStore(tokens or {})
+
+    @property
+    def _portal_tokens(self):
+        return self.__portal_tokens
+
+    @_portal_tokens.setter
+    def _portal_tokens(self, tokens):
+        self.__portal_tokens = tokens if isinstance(tokens, TokenStore) else TokenStore(tokens or {})
 
     def findToken(self, url):
         """Returns a token for a specific domain from token store if one has been
-                generated for the ArcGIS Server resource.
+                generated for the ArcGIS Server resource.  If several tokens are
+                registered for the url, the one with the longest matching url wins.
 
         Args:
             url: URL for secured resource, or token as a string.
@@ -139,31 +645,33 @@ class IdentityManager(object):
             TokenExpired: 'Token expired at {}! Please sign in again.'
         """
 
-        if self.tokens:
-            # if fnmatch.fnmatch(url, PORTAL_BASE_PATTERN) and not fnmatch.fnmatch(url, PORTAL_SERVICES_PATTERN):
-            #     url = get_portal_base(url)
-            # elif '/admin/' in url:
-            #     url = url.split('/admin/')[0] + '/admin'
-            # else:
-            #     url = url.split('/rest/services')[0] + '/rest/services'
+        if self.tokens or self._portal_tokens:
             to_remove = []
-            for registered_url, token in list(self.tokens.items()) + list(self._portal_tokens.items()):
-                if fnmatch.fnmatch(url, registered_url + '*') or token['token'] == url:
-                    if not token.isExpired:
-                        return token
-                    else:
-                        to_remove.append(token)
+            matches = sorted(self.tokens.match(url) + self._portal_tokens.match(url), key=lambda m: -len(m[0]))
+            for registered_url, token in matches:
+                if not token.isExpired:
+                    if self._credentials and self.needs_refresh(token):
+                        # the token is still valid, use it while a new one is requested
+                        self.refresh_in_background(url)
+                    return token
+                else:
+                    to_remove.append((registered_url, token))
 
             if to_remove:
-                for token in to_remove:
-                    if token.domain in self.tokens:
-                        del self.tokens[token.domain]
-                    elif token.domain in self._portal_tokens:
-                        del self._portal_tokens[token.domain]
+                refreshed = self._credentials and self.refresh_token(url)
+                if refreshed:
+                    return refreshed
+                for registered_url, token in to_remove:
+                    for tokens in (self.tokens, self._portal_tokens):
+                        if tokens.get(registered_url) is token:
+                            del tokens[registered_url]
 
                 msg = 'Token expired at {}! Please sign in again. ({})'
-                raise TokenExpired('\n'.join([msg.format(token.time_expires, token.domain) for token in to_remove]))
+                raise TokenExpired('\n'.join([msg.format(token.time_expires, token.domain) for _, token in to_remove]))
 
+        # expired tokens are flushed before each request, sign in again if credentials are known
+        if self._credentials:
+            return self.refresh_token(url)
         return None
 
     def findProxy(self, url):
@@ -192,11 +700,9 @@ class IdentityManager(object):
         """
         if expired_only:
             for tokens in (self.tokens, self._portal_tokens):
-                for url in list(tokens.keys()):
-                    token = tokens[url]
-                    if token.isExpired:
-                        del tokens[url]
+                tokens.flush_expired()
         else:
+            self.stop_auto_refresh()
             self.__init__()
 
 
@@ -258,6 +764,158 @@ def iter_chunks(iterable, n):
     for group in six.moves.zip_longest(*args, fillvalue=None):
         yield filter(None, group)
 
+def iter_concurrent(func, iterable, max_workers=None, window=None):
+    """Maps a function over an iterable on a bounded thread pool, yielding
+            results in the same order as the input.  Only a limited window of
+            calls are in flight at any time, so memory stays bounded no matter
+            how large the input is.
+
+    Args:
+        func: Function to call for each item.
+        iterable: A valid iterable of function inputs.
+        max_workers: Optional number of worker threads.  If None or less than 2,
+            the items are processed serially in the calling thread.
+        window: Optional maximum number of submitted calls whose results have not
+            been yielded yet. Defaults to twice the number of workers.
+    """
+    if not max_workers or max_workers < 2:
+        for item in iterable:
+            yield func(item)
+        return
+
+    window = max([window or max_workers * 2, 1])
+    pending = collections.deque()
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        # python 2 without the futures backport
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(processes=max_workers)
+        try:
+            for item in iterable:
+                pending.append(pool.apply_async(func, (item,)))
+                if len(pending) >= window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            # calls that have not started are dropped
+            pool.terminate()
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for item in iterable:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # consumer stopped early or a call failed, do not start anything else
+            for future in pending:
+                future.cancel()
+
+class PrefetchIterator(object):
+    """Iterates an iterable on a background thread that keeps up to a number of items
+            ahead of the consumer, so the next pages of a query are downloaded and
+            decoded while the current page is processed.  Items are returned in order
+            and errors are raised in the consumer.  Call close(), or use a with
+            statement, to stop the worker when iteration ends early.
+    """
+    _done = object()
+
+    def __init__(self, iterable, prefetch=1, poll_interval=0.1):
+        """Inits class and starts the worker thread.
+
+        Args:
+            iterable: The iterable to read ahead, a generator is closed on the worker
+                thread when iteration is stopped.
+            prefetch: Optional maximum number of items held ahead of the consumer. Defaults to 1.
+            poll_interval: Optional seconds between checks for cancellation while the worker
+                waits for the consumer. Defaults to 0.1.
+        """
+        self.prefetch = max([int(prefetch), 1])
+        self.poll_interval = poll_interval
+        self._source = iter(iterable)
+        self._queue = six.moves.queue.Queue(maxsize=self.prefetch)
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, name='restapi-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """Waits for room in the queue, returns False if the iterator was closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=self.poll_interval)
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            for item in self._source:
+                if not self._put((item, None)):
+                    break
+        except BaseException as e:
+            self._put((None, e))
+        finally:
+            close = getattr(self._source, 'close', None)
+            if close is not None:
+                close()
+            self._put((self._done, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item, error = self._queue.get()
+        if error is not None or item is self._done:
+            self._finished = True
+            self._thread.join()
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    next = __next__
+
+    @property
+    def closed(self):
+        """True when the worker has stopped."""
+        return self._finished or self._stop.is_set()
+
+    def close(self, timeout=None):
+        """Stops the worker and discards the items read ahead.  A request in progress is
+                completed first, no further requests are made.
+
+        Args:
+            timeout: Optional seconds to wait for the worker to stop. Defaults to None (wait).
+        """
+        self._stop.set()
+        self._finished = True
+        # unblock a worker waiting for room in the queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except six.moves.queue.Empty:
+                break
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<{}: prefetch={}{}>'.format(self.__class__.__name__, self.prefetch, ' (closed)' if self.closed else '')
+
 def tmp_json_file():
     """Returns a valid path for a temporary json file"""
     global TEMP_DIR
@@ -265,13 +923,14 @@ def tmp_json_file():
         TEMP_DIR = tempfile.mkdtemp()
     return os.path.join(TEMP_DIR, 'restapi_{}.json'.format(time.strftime('%Y%m%d%H%M%S')))
 
-def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None, proxy=None, referer=None, client=None, method='get', **kwargs):
-    """Post Request to REST Endpoint through query string, to post
-            request with data in body, use requests.post(url, data:{k : v}).
+def prepare_request(service, params, ret_json=True, token='', cookies=None, proxy=None, **kwargs):
+    """Resolves the credentials (token, cookies or proxy) for a request and encodes
+            the parameters.  This is shared by do_request() and the async request engine
+            so both always authenticate the same way.
 
     Args:
         service: Full path to REST endpoint of service.
-        params: Optional parameters for posting a request. Defaults to {F: JSON}.
+        params: Parameters for the request, this dict is modified in place.
         ret_json: Optional boolean that returns the response as JSON if True.
             Default is True.
         token: Optional token to handle security (only required if security is enabled).
@@ -280,18 +939,15 @@ def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None,
             Defaults to None.
         proxy: Option to use proxy page to handle security, need to provide
             full path to proxy url. Defaults to None.
-        referer: Option to specify a custom referer.
-        client: Option to specify a custom restapi.RequestClient session object
-            to perform the request.
-
-    Raises:
-        NameError: '"{0}" service not found!\n{1}'
+        kwargs: Optional keyword arguments to pass to the request.  Use stream_json=True
+            to stream a JSON response without reading the body (see FeatureStream).
 
     Returns:
-        The post request.
+        A tuple of (service, params, proxy, kwargs, ret_json).
     """
     ID_MANAGER.flush()
-    global PROTOCOL
+    # stream a JSON response, unlike stream=True this keeps the response format
+    stream_json = kwargs.pop('stream_json', False)
     if PROTOCOL != '':
         service = '{}://{}'.format(PROTOCOL, service.split('://')[-1])
     if not cookies and not proxy:
@@ -325,8 +981,8 @@ def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None,
         if isinstance(p, dict) or hasattr(p, 'json'):
             params[pName] = json.dumps(p, ensure_ascii=False, cls=RestapiEncoder)
 
-    # merge in any kwargs
-    params.update(kwargs)
+    # merge in any kwargs, except request headers
+    params.update({k: v for k,v in six.iteritems(kwargs) if k != 'headers'})
     if F not in params:
         params[enums.params.f] = JSON
 
@@ -358,6 +1014,9 @@ def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None,
             del params[F]
         stream = True
         ret_json = False
+    elif stream_json:
+        stream = True
+        ret_json = False
 
     # mixin default kwargs for requests
     defaults = {
@@ -367,33 +1026,96 @@ def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None,
         if k not in kwargs:
             kwargs[k] = v
 
-    if proxy:
-        # IMPORTANT: this is not a regular proxy, this is the Esri Proxy
-        # see: https://github.com/Esri/resource-proxy
-        r = do_proxy_request(proxy, service, params, referer, client=client)
-        ID_MANAGER.proxies[service.split('/rest')[0].lower() + '/rest/services'] = proxy
-    else:
-        request_method = get_request_method(service, params, client=client, method=method)
-        if request_method.__name__ == 'get':
-            # must use kwargs after url in GET
-            r = request_method(service, params=params, **kwargs)
-        else:
-            r = request_method(service, params, **kwargs)
+    return service, params, proxy, kwargs, ret_json
 
-    # make sure return
-    if r.status_code != 200:
-        raise NameError('"{0}" service not found!\n{1}'.format(service, r.raise_for_status()))
-    else:
-        if ret_json:# is True and params.get(F) in (JSON, PJSON):
-            try:
-                _json = r.json()
-            except:
-                return r
-            RequestError(_json)
-            return munch.munchify(_json)
-        else:
+
+def do_request(service, params={F: JSON}, ret_json=True, token='', cookies=None, proxy=None, referer=None, client=None, method='get', **kwargs):
+    """Post Request to REST Endpoint through query string, to post
+            request with data in body, use requests.post(url, data:{k : v}).
+
+    Args:
+        service: Full path to REST endpoint of service.
+        params: Optional parameters for posting a request. Defaults to {F: JSON}.
+        ret_json: Optional boolean that returns the response as JSON if True.
+            Default is True.
+        token: Optional token to handle security (only required if security is enabled).
+            Defaults to ''.
+        cookies: Optional arg for cookie object {'agstoken': 'your_token'}.
+            Defaults to None.
+        proxy: Option to use proxy page to handle security, need to provide
+            full path to proxy url. Defaults to None.
+        referer: Option to specify a custom referer.
+        client: Option to specify a custom restapi.RequestClient session object
+            to perform the request.  Transient failures are retried according to
+            the client's retry_policy.
+
+    Raises:
+        NameError: '"{0}" service not found!\n{1}'
+
+    Returns:
+        The post request.
+    """
+    request = (service, dict(params), ret_json, token, cookies, proxy, kwargs)
+    retry_policy = get_request_client(client).retry_policy
+
+    attempt = 0
+    while True:
+        # credentials are resolved for each attempt, a token can expire while waiting to retry
+        url, in_params, in_ret_json, in_token, in_cookies, in_proxy, in_kwargs = request
+        service, params, proxy, kwargs, ret_json = prepare_request(url, dict(in_params), in_ret_json, in_token, in_cookies, in_proxy, **dict(in_kwargs))
+        http_method = 'POST'
+        try:
+            if proxy:
+                # IMPORTANT: this is not a regular proxy, this is the Esri Proxy
+                # see: https://github.com/Esri/resource-proxy
+                r = do_proxy_request(proxy, service, params.copy(), referer, client=client)
+                ID_MANAGER.proxies[service.split('/rest')[0].lower() + '/rest/services'] = proxy
+            else:
+                request_method = get_request_method(service, params, client=client, method=method)
+                http_method = request_method.__name__.upper()
+                if request_method.__name__ == 'get':
+                    # must use kwargs after url in GET
+                    r = request_method(service, params=params, **kwargs)
+                else:
+                    r = request_method(service, params, **kwargs)
+        except requests.RequestException as e:
+            if retry_policy and retry_policy.should_retry(attempt, service, exception=e, method=http_method):
+                retry_policy.sleep(attempt)
+                attempt += 1
+                continue
+            raise
+
+        # a conditional request (see MetadataCache) can be answered with "304 Not Modified"
+        if r.status_code == 304 and any(h in (kwargs.get('headers') or {}) for h in ('If-None-Match', 'If-Modified-Since')):
             return r
 
+        # make sure return
+        if r.status_code != 200:
+            if retry_policy and retry_policy.should_retry(attempt, service, status_code=r.status_code, method=http_method):
+                r.close()
+                retry_policy.sleep(attempt, r.headers.get('Retry-After'))
+                attempt += 1
+                continue
+            raise NameError('"{0}" service not found!\n{1}'.format(service, r.raise_for_status()))
+        else:
+            if ret_json:# is True and params.get(F) in (JSON, PJSON):
+                try:
+                    _json = decode_json(r.content)
+                except:
+                    return r
+                try:
+                    RequestError(_json)
+                except RestAPIException as e:
+                    # ArcGIS Server reports some transient failures as JSON errors with a 200 status
+                    if retry_policy and retry_policy.should_retry(attempt, service, error_code=e.code, method=http_method):
+                        retry_policy.sleep(attempt)
+                        attempt += 1
+                        continue
+                    raise
+                return lazy_munchify(_json)
+            else:
+                return r
+
 
 def do_proxy_request(proxy, url, params={}, referer=None, ret_json=True, client=None, method='post', request_method=None):
     """Makes request against ArcGIS service through a proxy.  This is designed for a
@@ -741,6 +1463,8 @@ def generate_token(url, user, pw, expiration=60, client=None, **kwargs):
                     admin_tok['isAdmin'] = True
                     ID_MANAGER.tokens[serv.adminUrl] = Token(admin_tok)
 
+    if ID_MANAGER.auto_refresh and not getattr(ID_MANAGER._local, 'refreshing', False):
+        ID_MANAGER.register_credentials(token.domain, user, pw, expiration=expiration, client=client, **kwargs)
     return token
 
 def get_portal_base(url, root=False):
@@ -871,11 +1595,19 @@ class JsonGetter(object):
         return json.dumps(self.json, sort_keys=True, indent=2, cls=NameEncoder, ensure_ascii=False)
 
 
+# the parts of a response kept by RESTEndpoint.raw_response, without the body
+ResponseInfo = namedtuple('ResponseInfo', ['url', 'status_code', 'headers', 'elapsed'])
+
+def _response_info(r):
+    """Returns the ResponseInfo of a requests.Response, or None."""
+    if r is None:
+        return None
+    return ResponseInfo(r.url, r.status_code, r.headers, r.elapsed)
+
 class RESTEndpoint(JsonGetter):
     """Base REST Endpoint Object to handle credentials and get JSON response."""
     url = None
     raw_response = None
-    response = None
     token = None
     elapsed = None
     json = {}
@@ -883,6 +1615,15 @@ class RESTEndpoint(JsonGetter):
     _proxy = None
     _referer = None
 
+    @property
+    def response(self):
+        """The decoded JSON response, shares its data with the json property."""
+        return self.json
+
+    @response.setter
+    def response(self, value):
+        self.json = lazy_munchify(value) if value is not None else {}
+
     def __init__(self, url, usr='', pw='', token='', proxy=None, referer=None, client=None, **kwargs):
         """Inits class with login info for service URL.
 
@@ -971,12 +1712,22 @@ class RESTEndpoint(JsonGetter):
         if isinstance(self.token, Token):
             if self.token.get(IS_AGOL) or self.token.get(IS_PORTAL):
                 params[TOKEN] = str(self.token)
-        self.raw_response = do_request(self.url, params, ret_json=False,
-            token=self.token, cookies=self._cookie, proxy=self._proxy,
-            referer=self._referer, client=self.client)
-        self.elapsed = self.raw_response.elapsed
-        self.response = self.raw_response.json()
-        self.json = munch.munchify(self.response)
+        metadata_cache = get_metadata_cache()
+        if metadata_cache:
+            def request(headers):
+                return do_request(self.url, params.copy(), ret_json=False, token=self.token, cookies=self._cookie,
+                                  proxy=self._proxy, referer=self._referer, client=self.client, headers=headers)
+            self.response, r = metadata_cache.fetch(metadata_cache.make_key(self.url, params, self._request_token()), request, decode_json)
+            self.elapsed = r.elapsed if r is not None else datetime.timedelta(0)
+        else:
+            r = do_request(self.url, params, ret_json=False,
+                token=self.token, cookies=self._cookie, proxy=self._proxy,
+                referer=self._referer, client=self.client)
+            self.elapsed = r.elapsed
+            self.response = decode_json(r.content)
+        # the body is not kept once it is decoded
+        self.raw_response = _response_info(r)
+        self.json = lazy_munchify(self.response)
         RequestError(self.json)
 
     def compatible_with_version(self, version):
@@ -1006,8 +1757,14 @@ class RESTEndpoint(JsonGetter):
         except AttributeError:
             return False
 
-    def request(self, *args, **kwargs):
-        """Wrapper for request to automatically pass in credentials."""
+    def _request_kwargs(self, kwargs):
+        """Fills in the credentials of this endpoint for a request.
+
+        Args:
+            kwargs: Keyword arguments for the request, missing credentials are added.
+        """
+        if 'token' not in kwargs and isinstance(self.token, Token):
+            self._sync_token()
         for key, value in six.iteritems({
             'token': 'token',
             'cookies': '_cookie',
@@ -1019,12 +1776,49 @@ class RESTEndpoint(JsonGetter):
 
         if 'ret_json' not in kwargs:
             kwargs['ret_json'] = True
+        return kwargs
 
+    def _request_token(self, url=None):
+        """Returns the token sent with requests from this endpoint, which is the endpoint
+                token or, like prepare_request(), the one ID_MANAGER finds for the url.
+
+        Args:
+            url: Optional url of the request. Defaults to the endpoint url.
+        """
+        if self.token:
+            if isinstance(self.token, Token):
+                self._sync_token()
+            return self.token
+        if self._cookie or self._proxy:
+            return None
+        try:
+            return ID_MANAGER.findToken(url or self.url)
+        except TokenExpired:
+            return None
+
+    def _sync_token(self):
+        """Switches to the newest token for this endpoint's domain, so requests pick up
+                a token that was refreshed after the endpoint was created."""
+        try:
+            latest = ID_MANAGER.findToken(self.url)
+        except TokenExpired:
+            return
+        if isinstance(latest, Token) and latest is not self.token and latest.domain.lower() == self.token.domain.lower():
+            self.token = latest
+            if self._cookie:
+                self._cookie = latest._cookie
+
+    def request(self, *args, **kwargs):
+        """Wrapper for request to automatically pass in credentials."""
+        kwargs = self._request_kwargs(kwargs)
         kwargs['client'] = self.client
         return do_request(*args, **kwargs)
 
     def refresh(self):
-        """Refreshes the service."""
+        """Refreshes the service, bypassing the metadata cache."""
+        metadata_cache = get_metadata_cache()
+        if metadata_cache:
+            metadata_cache.invalidate(self.url)
         self.__init__(self.url, token=self.token)
 
     @classmethod
@@ -1216,6 +2010,36 @@ class FeatureSetBase(JsonGetter, SpatialReferenceMixin, FieldsMixin):
         """Returns total number of records in Cursor (user queried)."""
         return len(self)
 
+    def to_columns(self, fields=None):
+        """Returns the features as a ColumnarFeatureSet, with a typed array per field and
+                the geometries in a flat coordinate buffer.
+
+        Args:
+            fields: Optional list of field names to keep.  Defaults to None (all fields).
+
+        Raises:
+            ValueError: The feature set is not in the Esri JSON format.
+        """
+        if self._format != ESRI_JSON_FORMAT:
+            raise ValueError('Only Esri JSON feature sets can be converted to columns')
+        return ColumnarFeatureSet.from_feature_set(self, fields)
+
+    def to_dataframe(self, fields=None, geometry='wkb', coded_values=False, index=None):
+        """Returns the features as a pandas DataFrame, converted a column at a time.  Numeric
+                fields keep their width, dates are UTC datetimes and the geometries are in
+                a "SHAPE" column.  Requires pandas.
+
+        Args:
+            fields: Optional list of field names to keep.  Defaults to None (all fields).
+            geometry: Optional format of the geometries, "wkb", "coords" (an array of the
+                vertices, or a list of them per part for polylines and polygons) or "json",
+                None leaves them out. Defaults to "wkb".
+            coded_values: Optional boolean to convert coded value domain fields to categoricals
+                of the coded value names. Defaults to False.
+            index: Optional field name to use as the index.
+        """
+        return to_dataframe(self.to_columns(fields), geometry, coded_values, index)
+
     def __getitem__(self, key):
         """Supports grabbing feature by index and json keys by name."""
 
@@ -1263,7 +2087,7 @@ class FeatureSet(FeatureSetBase):
         if isinstance(in_json, self.__class__):
             self.json = in_json.json
         elif isinstance(in_json, dict):
-            self.json = munch.munchify(in_json)
+            self.json = lazy_munchify(in_json)
         if not all(map(lambda k: k in self.json.keys(), [FIELDS, FEATURES])):
             # print(self.json.keys())
             raise ValueError('Not a valid Feature Set!')
@@ -1366,7 +2190,7 @@ class FeatureCollection(FeatureSetBase):
         if isinstance(in_json, self.__class__):
             self.json = in_json.json
         elif isinstance(in_json, dict):
-            self.json = munch.munchify(in_json)
+            self.json = lazy_munchify(in_json)
 
 
     def extend(other):
@@ -1401,6 +2225,108 @@ class FeatureCollection(FeatureSetBase):
         return FeatureCollection(fsd)
 
 
+class PagedFeatureSet(FeatureSetBase):
+    """Feature set backed by a generator of pages (FeatureSets or FeatureCollections), as
+            returned by a query in chunks.  Only the schema of the first page is kept in the
+            json property, each page is requested when the features before it have been
+            consumed and is released afterwards, so the features can only be iterated once.
+    """
+
+    def __init__(self, pages, records=None, count=None):
+        """Inits class with the pages of a query.
+
+        Args:
+            pages: An iterable of FeatureSet or FeatureCollection objects.
+            records: Optional maximum number of features to return. Defaults to None.
+            count: Optional total number of features, or a function that returns it when
+                first needed (see count). Defaults to None.
+        """
+        self._pages = iter(pages)
+        self._first = next(self._pages, None)
+        self._records = records
+        self._count = count
+        self._consumed = False
+        self._has_features = self._first is not None and bool(self._first.json.get(FEATURES))
+        self._has_geometry = self._has_features and bool(self._first.json[FEATURES][0].get(enums.params.geometry))
+        if self._first is not None:
+            self._format = self._first._format
+            self.json = munch.Munch((k, v) for k,v in six.iteritems(self._first.json) if k != FEATURES)
+        else:
+            self.json = munch.Munch()
+        self.json[FEATURES] = []
+
+    @property
+    def features(self):
+        """Generator of the feature dicts of all pages."""
+        return self.iter_features()
+
+    def iter_features(self):
+        """Yields the feature dicts page by page.
+
+        Raises:
+            RuntimeError: 'PagedFeatureSet features can only be iterated once'
+        """
+        if self._consumed:
+            raise RuntimeError('{} features can only be iterated once'.format(self.__class__.__name__))
+        self._consumed = True
+        page, self._first = self._first, None
+        remaining = self._records
+        try:
+            while page is not None and remaining != 0:
+                for feature in page.json.get(FEATURES) or []:
+                    yield feature
+                    if remaining is not None:
+                        remaining -= 1
+                        if not remaining:
+                            break
+                page = next(self._pages, None) if remaining != 0 else None
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops requesting pages, pages that were read ahead are discarded."""
+        self._first = None
+        close = getattr(self._pages, 'close', None)
+        if close is not None:
+            close()
+
+    @property
+    def count(self):
+        """Returns the total number of features, this may require a request to the server."""
+        if callable(self._count):
+            self._count = self._count()
+        if self._count is None:
+            raise TypeError('{} has no known count'.format(self.__class__.__name__))
+        if self._records is not None:
+            return min([self._count, self._records])
+        return self._count
+
+    @property
+    def hasGeometry(self):
+        """Returns True if the first page has geometry."""
+        return self._has_geometry
+
+    def __getitem__(self, key):
+        """Supports grabbing json keys by name, features cannot be indexed."""
+        if isinstance(key, int):
+            raise TypeError('{} features cannot be indexed'.format(self.__class__.__name__))
+        return self.json.get(key)
+
+    def __len__(self):
+        # len() never requests the count, see the count property
+        if self._count is None or callable(self._count):
+            raise TypeError('{} has no known length, use the count property'.format(self.__class__.__name__))
+        return self.count
+
+    def __bool__(self):
+        return self._has_features
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+
 class Feature(JsonGetter):
     """Class that represents a single feature."""
     def __init__(self, feature):
@@ -1410,7 +2336,7 @@ class Feature(JsonGetter):
             feature: Input json for feature.
         """
 
-        self.json = munch.munchify(feature)
+        self.json = lazy_munchify(feature)
         self._propsGetter = ATTRIBUTES if ATTRIBUTES in self.json else PROPERTIES
         self._type = GEOJSON if self._propsGetter == PROPERTIES else ESRI_JSON_FORMAT
 
@@ -1431,6 +2357,217 @@ class Feature(JsonGetter):
     def __str__(self):
         return self.__repr__()
 
+class FeatureStream(JsonGetter):
+    """Iterates the features of a query response while it is downloaded.  The
+            "features" array is parsed one feature at a time from the response
+            stream, so only a single feature is held in memory instead of the whole
+            page.  The other keys of the response (fields, spatialReference,
+            geometryType, etc.) are available from the json property; keys that
+            follow the features array are only known once iteration is finished.
+            Quantized geometries are decoded as the features are iterated.
+    """
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, response, chunk_size=65536):
+        """Inits class with a streamed response.
+
+        Args:
+            response: A requests.Response that was requested with stream=True, or an
+                iterable of byte strings.
+            chunk_size: Optional number of bytes read from the stream at a time.
+                Defaults to 65536.
+        """
+        self.response = response if isinstance(response, requests.Response) else None
+        self.chunk_size = chunk_size
+        self.header = munch.Munch()
+        self.transform = None
+        self._chunks = iter(response.iter_content(chunk_size) if self.response is not None else response)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+        self._state = 'start'
+
+    @property
+    def json(self):
+        """The response keys that are not features, read up to the features array."""
+        self._read_header()
+        return self.header
+
+    @property
+    def done(self):
+        """True when the whole response has been parsed."""
+        return self._state == 'done'
+
+    def _fill(self, size=1):
+        """Reads from the stream until at least size characters are unread, returns False at the end."""
+        chunks = []
+        available = len(self._buffer) - self._pos
+        while available < size and not self._exhausted:
+            try:
+                data = next(self._chunks)
+            except StopIteration:
+                self._exhausted = True
+                data = None
+            text = self._text_decoder.decode(data or b'', final=data is None)
+            chunks.append(text)
+            available += len(text)
+        if chunks:
+            # drop the consumed part so the buffer only ever holds the current feature
+            self._buffer = self._buffer[self._pos:] + ''.join(chunks)
+            self._pos = 0
+        return len(self._buffer) - self._pos >= size
+
+    def _peek(self):
+        """Skips whitespace and returns the next character, or None at the end of the stream."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Invalid query response, expected "{}" at position {}'.format(char, self._pos))
+        self._pos += 1
+
+    def _decode_value(self):
+        """Decodes the next JSON value, reading more of the stream until it is complete."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._exhausted:
+                    raise
+            else:
+                # a number cut off by the end of a chunk still decodes, so it only counts
+                # as complete once the next character is a delimiter
+                following = self._buffer[end:end + 64].lstrip(self._whitespace)
+                if self._exhausted or (following and following[0] in ',:]}'):
+                    self._pos = end
+                    return value
+            # read at least as much again as is buffered, so large features are not re-parsed too often
+            self._fill((len(self._buffer) - self._pos) * 2 or 1)
+
+    def _read_header(self):
+        """Parses the response keys up to the start of the features array or the end of the response."""
+        if self._state == 'start':
+            self._expect('{')
+            self._state = 'header'
+        while self._state == 'header':
+            char = self._peek()
+            if char == ',':
+                self._pos += 1
+                continue
+            if char == '}':
+                self._pos += 1
+                self.close()
+                break
+            key = self._decode_value()
+            self._expect(':')
+            if key == FEATURES:
+                self._expect('[')
+                self._state = FEATURES
+                break
+            value = self._decode_value()
+            if key == TRANSFORM:
+                # features of a quantized response are decoded while they are iterated
+                self.transform = read_transform(value)
+                continue
+            self.header[key] = lazy_munchify(value)
+            if key == ERROR:
+                RequestError({ERROR: self.header[key]})
+
+    def _next_feature(self):
+        """Returns the json of the next feature, or None when there are no more features."""
+        while True:
+            if self._state in ('start', 'header'):
+                self._read_header()
+                if self._state == 'done':
+                    return None
+            char = self._peek()
+            if char == ',':
+                self._pos += 1
+                char = self._peek()
+            if char == ']':
+                self._pos += 1
+                self._state = 'header'
+                continue
+            return self._decode_value()
+
+    def read_all(self):
+        """Parses the rest of the response, any features not yet iterated are skipped."""
+        while self._next_feature() is not None:
+            pass
+        return self.header
+
+    def close(self):
+        """Releases the connection of the response."""
+        self._state = 'done'
+        self._buffer, self._pos = '', 0
+        if self.response is not None:
+            self.response.close()
+
+    def __iter__(self):
+        while True:
+            feature = self._next_feature()
+            if feature is None:
+                break
+            if self.transform is not None:
+                dequantize_geometry(feature.get(GEOMETRY), self.transform)
+            yield Feature(feature)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, 'done' if self.done else 'streaming')
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class FeatureStreamChain(JsonGetter):
+    """Iterates the features of several FeatureStreams (one per chunk of a query)
+            as if they were a single stream.  The json property is taken from the
+            first stream.
+    """
+    def __init__(self, streams):
+        """Inits class with the streams to chain.
+
+        Args:
+            streams: An iterable of FeatureStream objects, these are consumed one at a time.
+        """
+        self._streams = iter(streams)
+        self._first = None
+
+    @property
+    def json(self):
+        """The response keys of the first stream."""
+        if self._first is None:
+            self._first = next(self._streams, None)
+        return self._first.json if self._first is not None else munch.Munch()
+
+    def __iter__(self):
+        streams = self._streams if self._first is None else itertools.chain([self._first], self._streams)
+        for stream in streams:
+            with stream:
+                for feature in stream:
+                    yield feature
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+    def __str__(self):
+        return self.__repr__()
+
 class RelatedRecords(JsonGetter, SpatialReferenceMixin):
     """Class that handles related records response.
 
@@ -1446,7 +2583,7 @@ class RelatedRecords(JsonGetter, SpatialReferenceMixin):
             in_json: json response for query related records operation.
         """
 
-        self.json = munch.munchify(in_json)
+        self.json = lazy_munchify(in_json)
         self.geometryType = self.json.get(enums.geometry.type)
         self.spatialReference = self.json.get(SPATIAL_REFERENCE)
 
@@ -1559,6 +2696,7 @@ class Token(JsonGetter):
         """Response JSON object from generate_token."""
         self.json = munch.munchify(response)
         super(JsonGetter, self).__init__()
+        self.issued = time.time() * 1000
         self._cookie = {AGS_TOKEN: self.token}
         self._portal = self.json.get('_{}'.format(PORTAL_INFO))
         if '_portalInfo' in self.json:
@@ -8,6 +8,7 @@
 #-------------------------------------------------------------------------------
 from __future__ import print_function
 from .. import shapefile
+import os
 import datetime
 import json
 import unicodedata
@@ -44,21 +45,57 @@ class ShpWriter(object):
         path: Path of shapefile.
     """
 
-    def __init__(self, path, shapeType='NULL', autoBalance=True):
+    def __init__(self, path, shapeType='NULL', autoBalance=True, state=None):
         """Inits class with the shapefile.
         
         Args:
             shapeType: Type of shape. Defaults to 'NULL'.
             path: String for the path of the shapefile.
             autoBalance (bool): option to make sure the record and shape count is matched, default is True.
+            state: Optional dict from get_state() to keep appending to a shapefile that was
+                not saved, anything written after the state was taken is discarded.
         """
-        self.w = shapefile.Writer(path, 
-            shapeType=shp_dict[shapeType.upper()] if isinstance(shapeType, six.string_types) else shapeType, 
-            autoBalance=autoBalance
-        )
+        shapeType = shp_dict[shapeType.upper()] if isinstance(shapeType, six.string_types) else shapeType
+        self._files = []
+        if state:
+            base = os.path.splitext(path)[0]
+            for ext in ('shp', 'shx', 'dbf'):
+                f = open(base + '.' + ext, 'r+b')
+                f.truncate(state[ext])
+                self._files.append(f)
+            shp, shx, dbf = self._files
+            # the writer puts placeholder headers at the start, they are written on save()
+            self.w = shapefile.Writer(shp=shp, shx=shx, dbf=dbf, shapeType=state['shapeType'], autoBalance=autoBalance)
+            for f in self._files:
+                f.seek(0, 2)
+            for name, fieldType, size, decimal in state['fields']:
+                self.w.field(name.encode('utf-8'), fieldType, size, decimal)
+            self.w.recNum = self.w.shpNum = state['count']
+            self.w._bbox, self.w._zbox, self.w._mbox = state['bbox'], state['zbox'], state['mbox']
+        else:
+            self.w = shapefile.Writer(path, shapeType=shapeType, autoBalance=autoBalance)
         self.shapeType = self.w.shapeType
         self.path = path
 
+    def get_state(self):
+        """Returns a dict with the shape type, fields, record count, extent and file sizes
+                written so far, see the state argument of ShpWriter.
+        """
+        state = {
+            'shapeType': self.w.shapeType,
+            'fields': [[f[0].decode('utf-8') if isinstance(f[0], bytes) else f[0]] + list(f[1:]) for f in self.w.fields],
+            'count': len(self.w),
+            'bbox': self.w.bbox(),
+            'zbox': self.w.zbox(),
+            'mbox': self.w.mbox()
+        }
+        for ext in ('shp', 'shx', 'dbf'):
+            f = getattr(self.w, ext)
+            f.flush()
+            f.seek(0, 2)
+            state[ext] = f.tell()
+        return state
+
     def add_field(self, name, fieldType="C", size="50", decimal=0):
         """Adds a dbf field descriptor to the shapefile.
 
@@ -117,6 +154,8 @@ class ShpWriter(object):
             path: The path to be saved.
         """
         self.w.close()
+        for f in self._files:
+            f.close()
 
 class ShpEditor(object):
     """Class that handles the editing of shapefiles.
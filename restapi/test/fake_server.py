@@ -0,0 +1,113 @@
+#-------------------------------------------------------------------------------
+# Name:        fake_server
+# Purpose:     answers requests to an ArcGIS REST API from handler functions
+#   instead of the network, so services can be tested offline.
+#-------------------------------------------------------------------------------
+import json
+import datetime
+import requests
+from six.moves.urllib.parse import urlparse, parse_qsl
+import restapi as r
+
+BASE_URL = 'https://fake.host/arcgis/rest/services'
+
+
+class FakeServer(requests.adapters.BaseAdapter):
+    """Transport adapter that answers each path with a handler.
+
+    Attributes:
+        handlers: Dict of handler functions by url path, each takes a dict of the
+            request parameters and returns a dict, or a tuple of (status code, dict).
+        requests: List of (path, params) tuples of the requests sent.
+    """
+
+    def __init__(self, handlers=None):
+        super(FakeServer, self).__init__()
+        self.handlers = handlers or {}
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        params = dict(parse_qsl(url.query))
+        if request.body:
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            params.update(parse_qsl(body))
+        path = url.path.rstrip('/')
+        self.requests.append((path, params))
+        handler = self.handlers.get(path)
+        result = handler(params) if handler else (404, {})
+        status, content = result if isinstance(result, tuple) else (200, result)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'Fake'
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(0)
+        response._content = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+        # streamed responses are read from the content
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
+
+    def client(self):
+        """Returns a RequestClient that sends its requests to this server."""
+        session = requests.Session()
+        session.mount('https://', self)
+        session.mount('http://', self)
+        return r.RequestClient(session)
+
+
+
+def layer_json(fields=None, geometry_type='esriGeometryPoint', pagination=True, max_record_count=1000):
+    """Returns the JSON of a feature layer."""
+    return {
+        'currentVersion': 10.91,
+        'id': 0,
+        'name': 'Test',
+        'type': 'Feature Layer',
+        'geometryType': geometry_type,
+        'objectIdField': 'OBJECTID',
+        'maxRecordCount': max_record_count,
+        'advancedQueryCapabilities': {'supportsPagination': pagination},
+        'supportedQueryFormats': 'JSON',
+        'extent': {'xmin': 0, 'ymin': 0, 'xmax': 100, 'ymax': 100, 'spatialReference': {'wkid': 4326}},
+        'fields': fields or [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID', 'alias': 'OBJECTID'}],
+    }
+
+
+def query_handler(layer, features):
+    """Returns a handler for the query endpoint of a layer that pages with
+            resultOffset and resultRecordCount.
+    """
+    def query(params):
+        if params.get('returnCountOnly') == 'true':
+            return {'count': len(features)}
+        if params.get('returnIdsOnly') == 'true':
+            return {'objectIdFieldName': 'OBJECTID', 'objectIds': [f['attributes']['OBJECTID'] for f in features]}
+        offset = int(params.get('resultOffset', 0))
+        count = int(params.get('resultRecordCount', layer['maxRecordCount']))
+        page = features[offset:offset + count]
+        response = {
+            'objectIdFieldName': 'OBJECTID',
+            'geometryType': layer['geometryType'],
+            'spatialReference': {'wkid': 4326},
+            'fields': layer['fields'],
+            'features': page,
+        }
+        if offset + count < len(features):
+            response['exceededTransferLimit'] = True
+        return response
+    return query
+
+
+def feature_layer(features, url=BASE_URL + '/Test/FeatureServer/0', **kwargs):
+    """Returns a tuple of (FeatureLayer, FakeServer) for a layer with the features."""
+    layer = layer_json(**kwargs)
+    server = FakeServer()
+    path = urlparse(url).path.rstrip('/')
+    server.handlers[path] = lambda params: layer
+    server.handlers[path + '/query'] = query_handler(layer, features)
+    return r.FeatureLayer(url, client=server.client()), server
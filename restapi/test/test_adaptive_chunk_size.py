@@ -0,0 +1,105 @@
+#-------------------------------------------------------------------------------
+# Name:        test_adaptive_chunk_size
+# Purpose:     tests how AdaptiveChunkSize shrinks and grows the page size of
+#   chunked queries from measured responses.
+#-------------------------------------------------------------------------------
+import unittest
+import requests
+import restapi as r
+from fake_server import feature_layer, query_handler
+
+
+class TestAdaptiveChunkSize(unittest.TestCase):
+
+    def test_starts_at_max_size(self):
+        self.assertEqual(r.AdaptiveChunkSize(max_size=2000).size, 2000)
+        self.assertEqual(r.AdaptiveChunkSize(size=5000, max_size=2000).size, 2000)
+        self.assertEqual(r.AdaptiveChunkSize(size=1, min_size=10).size, 10)
+
+    def test_shrinks_on_slow_pages(self):
+        chunks = r.AdaptiveChunkSize(max_size=1000, target_seconds=5)
+        # 10 seconds for 1000 records, the target is met with 500
+        chunks.record(1000, 10.0)
+        self.assertEqual(chunks.size, 500)
+
+    def test_shrinks_on_large_pages(self):
+        chunks = r.AdaptiveChunkSize(max_size=1000, max_bytes=1000000)
+        chunks.record(1000, 0.1, nbytes=4000000)
+        self.assertEqual(chunks.size, 250)
+
+    def test_grows_gradually(self):
+        chunks = r.AdaptiveChunkSize(size=100, max_size=1000, growth=1.5)
+        sizes = []
+        for _ in range(6):
+            chunks.record(chunks.size, 0.01)
+            sizes.append(chunks.size)
+        self.assertEqual(sizes, [150, 225, 337, 505, 757, 1000])
+
+    def test_failure(self):
+        chunks = r.AdaptiveChunkSize(max_size=1000, min_size=10, shrink=0.5)
+        chunks.failure()
+        self.assertEqual((chunks.size, chunks.ceiling, chunks.failures), (500, 900, 1))
+        # fast pages do not grow back to the size that failed right away
+        for _ in range(5):
+            chunks.record(chunks.size, 0.01)
+        self.assertLess(chunks.size, 1000)
+        for _ in range(20):
+            chunks.failure()
+        self.assertEqual(chunks.size, 10)
+
+    def test_state(self):
+        chunks = r.AdaptiveChunkSize(max_size=1000)
+        chunks.record(1000, 10.0, nbytes=100000)
+        chunks.failure()
+        restored = r.AdaptiveChunkSize.from_state(chunks.state)
+        self.assertEqual((restored.size, restored.seconds_per_record, restored.ceiling),
+                         (chunks.size, chunks.seconds_per_record, chunks.ceiling))
+        self.assertEqual(r.AdaptiveChunkSize.from_state(chunks.state, max_size=100).size, 100)
+
+    def test_server_failures(self):
+        def http_error(status):
+            response = requests.Response()
+            response.status_code = status
+            return requests.HTTPError(response=response)
+        self.assertTrue(r.AdaptiveChunkSize.is_server_failure(http_error(503)))
+        self.assertTrue(r.AdaptiveChunkSize.is_server_failure(requests.Timeout()))
+        self.assertTrue(r.AdaptiveChunkSize.is_server_failure(requests.ConnectionError()))
+        self.assertTrue(r.AdaptiveChunkSize.is_server_failure(r.RestAPIException({'error': {'code': 500}})))
+        self.assertFalse(r.AdaptiveChunkSize.is_server_failure(http_error(403)))
+        self.assertFalse(r.AdaptiveChunkSize.is_server_failure(r.RestAPIException({'error': {'code': 400}})))
+
+
+class TestFetchAdaptive(unittest.TestCase):
+
+    def setUp(self):
+        features = [{'attributes': {'OBJECTID': i}, 'geometry': {'x': i, 'y': i}} for i in range(1, 9)]
+        self.layer, self.server = feature_layer(features)
+        self.query_path = self.server.requests[0][0] + '/query'
+        self.query = query_handler(self.layer.json, features)
+
+    def fetch(self, chunk_size):
+        pages = self.layer.query_in_chunks(chunk_size=chunk_size)
+        return [f['attributes']['OBJECTID'] for page in pages for f in page['features']]
+
+    def query_requests(self):
+        return [params for path, params in self.server.requests if path == self.query_path and 'resultOffset' in params]
+
+    def test_server_errors_split_pages(self):
+        # pages of more than two records fail on the server
+        self.server.handlers[self.query_path] = lambda params: (500, {}) if int(params.get('resultRecordCount', 0)) > 2 else self.query(params)
+        chunks = r.AdaptiveChunkSize(size=8, min_size=1, max_size=8)
+        self.assertEqual(self.fetch(chunks), list(range(1, 9)))
+        self.assertGreater(chunks.failures, 0)
+
+    def test_client_errors_are_raised(self):
+        self.server.handlers[self.query_path] = lambda params: (400, {}) if 'resultOffset' in params else self.query(params)
+        chunks = r.AdaptiveChunkSize(size=8, min_size=1, max_size=8)
+        self.assertRaises(requests.HTTPError, self.fetch, chunks)
+        self.assertEqual((len(self.query_requests()), chunks.failures), (1, 0))
+        # errors returned as JSON
+        self.server.handlers[self.query_path] = lambda params: {'error': {'code': 400, 'message': 'Invalid query'}} if 'resultOffset' in params else self.query(params)
+        self.assertRaises(r.RestAPIException, self.fetch, chunks)
+        self.assertEqual(len(self.query_requests()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#-------------------------------------------------------------------------------
+# Name:        test_aggregates
+# Purpose:     tests merging outStatistics results of several parts of a layer
+#   against statistics computed in a single pass over all values.
+#-------------------------------------------------------------------------------
+import math
+import random
+import unittest
+from restapi.aggregates import StatisticsMerger, normalize_statistics
+
+
+def variance(values):
+    mean = sum(values) / float(len(values))
+    return sum((v - mean) ** 2 for v in values) / float(len(values) - 1)
+
+def part_statistics(merger, rows, group_field=None):
+    """Returns the rows the server would return for the outStatistics of the merger."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.get(group_field), []).append(row)
+    results = []
+    for key, group in sorted(groups.items()):
+        result = {group_field: key} if group_field else {}
+        for stat in merger.out_statistics:
+            values = [row[stat['onStatisticField']] for row in group]
+            result[stat['outStatisticFieldName']] = {
+                'count': lambda: len(values),
+                'sum': lambda: sum(values),
+                'min': lambda: min(values),
+                'max': lambda: max(values),
+                'avg': lambda: sum(values) / float(len(values)),
+                'var': lambda: variance(values) if len(values) > 1 else None,
+            }[stat['statisticType']]()
+        results.append(result)
+    return results
+
+
+class TestStatisticsMerger(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        self.rows = [{'VAL': rnd.gauss(1000, 250), 'TYPE': rnd.choice('ABC')} for _ in range(1000)]
+
+    def merge(self, statistics, parts, group_field=None):
+        merger = StatisticsMerger(statistics, group_field)
+        for part in parts:
+            merger.add(part_statistics(merger, part, group_field))
+        return merger
+
+    def test_var_and_stddev_match_single_pass(self):
+        statistics = [('var', 'VAL', 'V'), ('stddev', 'VAL', 'S'), ('avg', 'VAL', 'A')]
+        values = [row['VAL'] for row in self.rows]
+        # uneven parts, including one with a single value (no variance from the server)
+        bounds = [0, 1, 150, 151, 600, 1000]
+        parts = [self.rows[a:b] for a, b in zip(bounds, bounds[1:])]
+        result = self.merge(statistics, parts).results()[0]
+        self.assertAlmostEqual(result['V'], variance(values), places=6)
+        self.assertAlmostEqual(result['S'], math.sqrt(variance(values)), places=9)
+        self.assertAlmostEqual(result['A'], sum(values) / len(values), places=9)
+
+    def test_simple_statistics(self):
+        statistics = {'n': ('count', 'VAL'), 'total': ('sum', 'VAL'), 'lo': ('MIN', 'VAL'), 'hi': ('max', 'VAL')}
+        values = [row['VAL'] for row in self.rows]
+        result = self.merge(statistics, [self.rows[:300], self.rows[300:]]).results()[0]
+        self.assertEqual(result['n'], 1000)
+        self.assertAlmostEqual(result['total'], sum(values), places=6)
+        self.assertEqual((result['lo'], result['hi']), (min(values), max(values)))
+
+    def test_group_by(self):
+        merger = self.merge([('stddev', 'VAL')], [self.rows[:500], self.rows[500:]], 'TYPE')
+        self.assertEqual(len(merger), 3)
+        for result in merger.results():
+            values = [row['VAL'] for row in self.rows if row['TYPE'] == result['TYPE']]
+            self.assertAlmostEqual(result['stddev_VAL'], math.sqrt(variance(values)), places=9)
+
+    def test_shared_components(self):
+        # avg, var and stddev of the same field request count, sum, avg and var once each
+        merger = StatisticsMerger([('avg', 'VAL'), ('var', 'VAL'), ('stddev', 'VAL')])
+        self.assertEqual(sorted(s['statisticType'] for s in merger.out_statistics), ['avg', 'count', 'sum', 'var'])
+
+    def test_unmergeable(self):
+        merger = StatisticsMerger([('percentile_cont', 'VAL', 'P')])
+        self.assertEqual(merger.unmergeable, ['percentile_cont'])
+        merger.add([{'P': 1}])
+        self.assertRaises(ValueError, merger.add, [{'P': 2}])
+
+    def test_normalize_statistics(self):
+        self.assertEqual(normalize_statistics([('AVG', 'VAL')]),
+                         [{'statisticType': 'avg', 'onStatisticField': 'VAL', 'outStatisticFieldName': 'avg_VAL'}])
+
+if __name__ == '__main__':
+    unittest.main()
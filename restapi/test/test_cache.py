@@ -0,0 +1,120 @@
+#-------------------------------------------------------------------------------
+# Name:        test_cache
+# Purpose:     tests the query cache: canonical keys, invalidation by the edit
+#   state of the layer and least recently used eviction.
+#-------------------------------------------------------------------------------
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from restapi.cache import MetadataCache, QueryCache
+
+URL = 'https://example.com/arcgis/rest/services/Parcels/FeatureServer/0'
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = QueryCache(self.cache_dir, max_bytes=None)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_equivalent_queries_share_a_key(self):
+        key = self.cache.make_key(URL + '/query', {'where': "NAME = 'a'  and  VAL > 1", 'outFields': 'VAL,NAME',
+                                                   'returnGeometry': True, 'geometry': {'y': 2, 'x': 1}, 'f': 'json'})
+        same = self.cache.make_key(URL.upper() + '/query/', {'outFields': ' name, val', 'where': "NAME = 'a' and VAL > 1",
+                                                             'returnGeometry': 'TRUE', 'geometry': '{"x": 1, "y": 2}',
+                                                             'f': 'pbf', 'token': 'abc', 'orderByFields': ''})
+        self.assertEqual(key, same)
+
+    def test_different_queries_and_tokens(self):
+        params = {'where': '1=1', 'outFields': '*'}
+        key = self.cache.make_key(URL, params)
+        self.assertNotEqual(key, self.cache.make_key(URL, dict(params, where='1=0')))
+        self.assertNotEqual(key, self.cache.make_key(URL, dict(params, f='geojson')))
+        self.assertNotEqual(key, self.cache.make_key(URL, params, token='user1'))
+        self.assertNotEqual(self.cache.make_key(URL, params, token='user1'), self.cache.make_key(URL, params, token='user2'))
+        # the token itself is not stored in the key
+        self.assertNotIn('user1', self.cache.make_key(URL, params, token='user1'))
+
+    def test_version_invalidation(self):
+        layer = {'editingInfo': {'lastEditDate': 1}}
+        version = self.cache.layer_version(URL, lambda: layer)
+        key = self.cache.make_key(URL + '/query', {'where': '1=1'})
+        self.cache.put(key, {'features': [{'attributes': {'A': 1}}]}, version)
+        self.assertEqual(self.cache.get(key, version), {'features': [{'attributes': {'A': 1}}]})
+
+        # the edit state is reused until the check interval has passed
+        layer['editingInfo']['lastEditDate'] = 2
+        self.assertEqual(self.cache.layer_version(URL, lambda: layer), version)
+        self.cache.check_interval = 0
+        new_version = self.cache.layer_version(URL, lambda: layer)
+        self.assertNotEqual(new_version, version)
+        self.assertIsNone(self.cache.get(key, new_version))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl_without_version(self):
+        self.assertIsNone(self.cache.layer_version(URL, lambda: {'name': 'Parcels'}))
+        key = self.cache.make_key(URL, {'where': '1=1'})
+        self.cache.put(key, {'features': []})
+        self.assertEqual(self.cache.get(key), {'features': []})
+        self.cache.ttl = 0
+        self.assertIsNone(self.cache.get(key))
+
+    def test_errors_are_not_stored(self):
+        key = self.cache.make_key(URL, {'where': 'bad'})
+        self.cache.put(key, {'error': {'code': 400}})
+        self.assertIsNone(self.cache.get(key))
+
+    def test_lru_eviction(self):
+        keys = [self.cache.make_key(URL, {'where': 'VAL = {}'.format(i)}) for i in range(4)]
+        for i, key in enumerate(keys[:3]):
+            self.cache.put(key, {'features': [{'attributes': {'VAL': i}}]})
+            # make the order of the entries independent of the file time resolution
+            stamp = time.time() - 100 + i
+            os.utime(self.cache._path(key), (stamp, stamp))
+        # reading the oldest entry makes it the most recently used
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        # room for three entries, whose compressed sizes differ by a few bytes
+        self.cache.max_bytes = self.cache.size + 20
+        self.cache.put(keys[3], {'features': [{'attributes': {'VAL': 3}}]})
+        self.assertIsNone(self.cache.get(keys[1]))
+        for key in (keys[0], keys[2], keys[3]):
+            self.assertIsNotNone(self.cache.get(key))
+        self.assertEqual(self.cache.evicted, 1)
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+
+    def test_invalidate(self):
+        other = URL.replace('/0', '/1')
+        key = self.cache.make_key(URL + '/query', {'where': '1=1'})
+        other_key = self.cache.make_key(other + '/query', {'where': '1=1'})
+        self.cache.put(key, {'features': []})
+        self.cache.put(other_key, {'features': []})
+        self.cache.invalidate(URL)
+        self.assertIsNone(self.cache.get(key))
+        self.assertIsNotNone(self.cache.get(other_key))
+        self.cache.invalidate()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def test_lru_entries(self):
+        cache = MetadataCache(max_entries=2)
+        keys = [cache.make_key(URL, {'f': 'json'}, token) for token in ('a', 'b', 'c')]
+        cache.put(keys[0], {'name': 'a'})
+        cache.put(keys[1], {'name': 'b'})
+        # reading the oldest entry makes it the most recently used
+        self.assertEqual(cache.get(keys[0])['json'], {'name': 'a'})
+        cache.put(keys[2], {'name': 'c'})
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertEqual([cache.get(key)['json']['name'] for key in (keys[0], keys[2])], ['a', 'c'])
+        # storing a key again replaces the entry and keeps one entry per key
+        cache.put(keys[0], {'name': 'a2'})
+        self.assertEqual(len(cache._entries), 2)
+
+if __name__ == '__main__':
+    unittest.main()
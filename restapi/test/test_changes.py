@@ -0,0 +1,70 @@
+#-------------------------------------------------------------------------------
+# Name:        test_changes
+# Purpose:     tests the compact OID ranges and the state file of change sets.
+#-------------------------------------------------------------------------------
+import os
+import shutil
+import random
+import tempfile
+import unittest
+from restapi.changes import ChangeSet, encode_oid_ranges, decode_oid_ranges, oid_difference
+
+
+class TestOIDRanges(unittest.TestCase):
+
+    def test_encode(self):
+        self.assertEqual(encode_oid_ranges([]), [])
+        self.assertEqual(encode_oid_ranges([5]), [[5, 5]])
+        self.assertEqual(encode_oid_ranges([7, 1, 2, 3, 9, 8, 3, 20]), [[1, 3], [7, 9], [20, 20]])
+
+    def test_round_trip(self):
+        rnd = random.Random(3)
+        oids = sorted(set(rnd.randint(1, 5000) for _ in range(3000)))
+        ranges = encode_oid_ranges(oids)
+        self.assertLess(len(ranges), len(oids))
+        self.assertEqual(list(decode_oid_ranges(ranges)), oids)
+
+    def test_large_oids(self):
+        oids = [2 ** 40, 2 ** 40 + 1, 2 ** 40 + 2]
+        self.assertEqual(list(decode_oid_ranges(encode_oid_ranges(oids))), oids)
+
+    def test_difference(self):
+        self.assertEqual(list(oid_difference([1, 2, 3, 5, 8, 13], [2, 3, 4, 13])), [1, 5, 8])
+        self.assertEqual(list(oid_difference([1, 2], [])), [1, 2])
+        self.assertEqual(list(oid_difference([], [1, 2])), [])
+        self.assertEqual(list(oid_difference([1, 2], [1, 2, 3])), [])
+
+    def test_difference_matches_sets(self):
+        rnd = random.Random(5)
+        a = sorted(set(rnd.randint(1, 1000) for _ in range(600)))
+        b = sorted(set(rnd.randint(1, 1000) for _ in range(600)))
+        self.assertEqual(list(oid_difference(a, b)), sorted(set(a) - set(b)))
+
+
+class TestChangeSetState(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.folder, 'state.json')
+        changes = ChangeSet('https://example.com/FeatureServer/0/', [], [], [4], 100, 200,
+                            ChangeSet.EDITOR_TRACKING, oids=decode_oid_ranges([[1, 3], [5, 10]]))
+        changes.save(path)
+        # saving again replaces the state file
+        changes.watermark = 300
+        changes.save(path)
+        state = ChangeSet.load_state(path)
+        self.assertEqual((state['url'], state['watermark'], state['method']),
+                         ('https://example.com/FeatureServer/0', 300, 'editorTracking'))
+        self.assertEqual(list(state['oids']), [1, 2, 3, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(os.listdir(self.folder), ['state.json'])
+
+    def test_missing_state(self):
+        self.assertIsNone(ChangeSet.load_state(os.path.join(self.folder, 'missing.json')))
+
+if __name__ == '__main__':
+    unittest.main()
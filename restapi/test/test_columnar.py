@@ -0,0 +1,124 @@
+#-------------------------------------------------------------------------------
+# Name:        test_columnar
+# Purpose:     tests the round trip of feature sets through columns and of
+#   Esri JSON geometries through WKB.
+#-------------------------------------------------------------------------------
+import struct
+import unittest
+from restapi.columnar import ColumnarFeatureSet, GeometryColumn
+from restapi.arrow_utils import esri_to_wkb, wkb_to_esri
+
+FIELDS = [
+    {'name': 'OBJECTID', 'type': 'esriFieldTypeOID'},
+    {'name': 'NAME', 'type': 'esriFieldTypeString'},
+    {'name': 'AREA', 'type': 'esriFieldTypeDouble'},
+    {'name': 'CREATED', 'type': 'esriFieldTypeDate'},
+    {'name': 'Shape', 'type': 'esriFieldTypeGeometry'},
+]
+
+FEATURES = [
+    {'attributes': {'OBJECTID': 2 ** 40, 'NAME': 'a', 'AREA': 1.5, 'CREATED': 1600000000000},
+     'geometry': {'paths': [[[0.0, 0.0], [1.0, 1.0]], [[2.0, 2.0], [3.0, 3.0], [4.0, 2.0]]]}},
+    {'attributes': {'OBJECTID': 2 ** 40 + 1, 'NAME': None, 'AREA': None, 'CREATED': None},
+     'geometry': None},
+    {'attributes': {'OBJECTID': 2 ** 40 + 2, 'NAME': 'c', 'AREA': 3.25, 'CREATED': 1700000000000},
+     'geometry': {'paths': [[[5.0, 5.0], [6.0, 7.0]]]}},
+]
+
+JSON = {'geometryType': 'esriGeometryPolyline', 'spatialReference': {'wkid': 3857},
+        'fields': FIELDS, 'features': FEATURES}
+
+# a clockwise exterior ring with a counter clockwise hole
+SQUARE = [[0.0, 0.0], [0.0, 10.0], [10.0, 10.0], [10.0, 0.0], [0.0, 0.0]]
+HOLE = [[2.0, 2.0], [4.0, 2.0], [4.0, 4.0], [2.0, 4.0], [2.0, 2.0]]
+
+
+class TestColumnarFeatureSet(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = ColumnarFeatureSet.from_features(iter(FEATURES), JSON)
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.columns), 3)
+        self.assertEqual(self.columns.field_names, ['OBJECTID', 'NAME', 'AREA', 'CREATED'])
+        self.assertEqual(self.columns.to_features(), FEATURES)
+        json = self.columns.to_json()
+        self.assertEqual(json['spatialReference'], {'wkid': 3857})
+        self.assertEqual(json['features'], FEATURES)
+
+    def test_nulls(self):
+        self.assertEqual(self.columns['AREA'].null_count, 1)
+        self.assertEqual(self.columns['created'].to_list(), [1600000000000, None, 1700000000000])
+        self.assertIsNone(self.columns['SHAPE@'][1])
+
+    def test_fields(self):
+        columns = ColumnarFeatureSet.from_features(FEATURES, JSON, fields=['objectid', 'NAME'])
+        self.assertEqual([f['name'] for f in columns.fields], ['OBJECTID', 'NAME'])
+        self.assertEqual(columns.to_features(geometry=False)[2], {'attributes': {'OBJECTID': 2 ** 40 + 2, 'NAME': 'c'}})
+
+    def test_take_and_where(self):
+        indices = self.columns.where(lambda row: row['AREA'] is not None)
+        self.assertEqual(indices, [0, 2])
+        subset = self.columns.take(indices[::-1])
+        self.assertEqual(subset.to_features(), [FEATURES[2], FEATURES[0]])
+
+    def test_points_with_z(self):
+        column = GeometryColumn('esriGeometryPoint', has_z=True)
+        for geometry in ({'x': 1.0, 'y': 2.0, 'z': 3.0}, None, {'x': 4.0, 'y': 5.0}):
+            column.append(geometry)
+        self.assertEqual(list(column.iter_geometries()),
+                         [{'x': 1.0, 'y': 2.0, 'z': 3.0}, None, {'x': 4.0, 'y': 5.0, 'z': None}])
+        self.assertEqual(column.take([2])[0], {'x': 4.0, 'y': 5.0, 'z': None})
+
+    def test_unsupported_geometry(self):
+        self.assertRaises(ValueError, GeometryColumn, 'esriGeometryEnvelope')
+        column = GeometryColumn('esriGeometryPolyline')
+        self.assertRaises(ValueError, column.append, {'curvePaths': []})
+
+
+class TestWKB(unittest.TestCase):
+
+    def round_trip(self, geometry, has_z=False):
+        return wkb_to_esri(esri_to_wkb(geometry, has_z))
+
+    def test_point(self):
+        self.assertEqual(self.round_trip({'x': 1.5, 'y': -2.0}), {'x': 1.5, 'y': -2.0})
+        self.assertEqual(self.round_trip({'x': 1.5, 'y': -2.0, 'z': 7.0}, has_z=True), {'x': 1.5, 'y': -2.0, 'z': 7.0})
+        self.assertEqual(self.round_trip({'x': None, 'y': None}), {'x': None, 'y': None})
+        self.assertIsNone(esri_to_wkb(None))
+        self.assertIsNone(wkb_to_esri(None))
+
+    def test_multipoint(self):
+        geometry = {'points': [[1.0, 2.0], [3.0, 4.0]]}
+        self.assertEqual(self.round_trip(geometry), geometry)
+
+    def test_polylines(self):
+        single = {'paths': [[[0.0, 0.0], [1.0, 1.0]]]}
+        multi = {'paths': [[[0.0, 0.0], [1.0, 1.0]], [[2.0, 2.0], [3.0, 3.0]]]}
+        self.assertEqual(self.round_trip(single), single)
+        self.assertEqual(self.round_trip(multi), multi)
+        self.assertEqual(self.round_trip({'paths': [[[0.0, 0.0, 1.0], [1.0, 1.0, 2.0]]]}, has_z=True),
+                         {'paths': [[[0.0, 0.0, 1.0], [1.0, 1.0, 2.0]]], 'hasZ': True})
+
+    def test_polygon_with_hole(self):
+        geometry = {'rings': [SQUARE, HOLE]}
+        self.assertEqual(self.round_trip(geometry), geometry)
+
+    def test_multipolygon(self):
+        other = [[[x + 20, y] for x, y in ring] for ring in (SQUARE, HOLE)]
+        geometry = {'rings': [SQUARE, other[0], HOLE, other[1]]}
+        # the hole follows the exterior ring that contains it
+        self.assertEqual(self.round_trip(geometry), {'rings': [SQUARE, HOLE] + other})
+
+    def test_ring_orientation(self):
+        # OGC rings (counter clockwise exterior) are reoriented as Esri rings
+        rings = [SQUARE[::-1], HOLE[::-1]]
+        ogc = struct.pack('<BII', 1, 3, len(rings)) + b''.join(
+            struct.pack('<I' + 'd' * 2 * len(ring), len(ring), *[c for v in ring for c in v]) for ring in rings)
+        self.assertEqual(wkb_to_esri(ogc), {'rings': [SQUARE, HOLE]})
+
+    def test_curves(self):
+        self.assertRaises(ValueError, esri_to_wkb, {'curveRings': []})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        test_feature_stream
+# Purpose:     tests parsing the features of a query response one at a time
+#   while it is read, no matter where the chunks of the stream are cut.
+#-------------------------------------------------------------------------------
+import json
+import unittest
+import restapi as r
+from restapi.rest_utils import FeatureStream, FeatureStreamChain
+from fake_server import feature_layer
+
+RESPONSE = {
+    'objectIdFieldName': 'OBJECTID',
+    'geometryType': 'esriGeometryPoint',
+    'fields': [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID'}, {'name': 'NAME', 'type': 'esriFieldTypeString'}],
+    'features': [{'attributes': {'OBJECTID': i, 'NAME': u'café ☃ {}'.format(i)},
+                  'geometry': {'x': -93.123456789 * i, 'y': 1e-7 * i}} for i in range(1, 21)],
+    'exceededTransferLimit': True
+}
+
+
+def chunked(content, size):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+class CountingChunks(object):
+    """Iterable of chunks that counts how many were read."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class TestFeatureStream(unittest.TestCase):
+
+    def setUp(self):
+        self.content = json.dumps(RESPONSE, indent=1).encode('utf-8')
+
+    def test_any_chunk_size(self):
+        # chunks cut multi-byte characters, numbers and keys in half
+        for size in (1, 2, 3, 7, 64, len(self.content)):
+            stream = FeatureStream(chunked(self.content, size))
+            self.assertEqual([f.json for f in stream], RESPONSE['features'])
+            self.assertTrue(stream.done)
+            self.assertEqual(stream.json['exceededTransferLimit'], True)
+
+    def test_header_before_features(self):
+        stream = FeatureStream(chunked(self.content, 16))
+        self.assertEqual(stream.json['geometryType'], 'esriGeometryPoint')
+        self.assertEqual(len(stream.json['fields']), 2)
+        # keys after the features are only known once they are parsed
+        self.assertNotIn('exceededTransferLimit', stream.json)
+        self.assertEqual(stream.read_all()['exceededTransferLimit'], True)
+
+    def test_reads_incrementally(self):
+        chunks = CountingChunks(chunked(self.content, 32))
+        features = iter(FeatureStream(chunks))
+        self.assertEqual(next(features).get('OBJECTID'), 1)
+        self.assertLess(chunks.read, len(chunks.chunks) // 4)
+
+    def test_quantized(self):
+        response = {'transform': {'originPosition': 'upperLeft', 'scale': [0.5, 0.5], 'translate': [100, 200]},
+                    'features': [{'attributes': {'OBJECTID': 1}, 'geometry': {'x': 2, 'y': 4}}]}
+        stream = FeatureStream(chunked(json.dumps(response).encode('utf-8'), 5))
+        self.assertEqual([f.json['geometry'] for f in stream], [{'x': 101.0, 'y': 198.0}])
+
+    def test_empty_and_error(self):
+        self.assertEqual(list(FeatureStream([b'{"features": []}'])), [])
+        self.assertEqual(list(FeatureStream([b'{"count": 0}'])), [])
+        stream = FeatureStream([b'{"error": {"code": 400, "message": "Invalid query"}}'])
+        self.assertRaises(r.RestAPIException, list, stream)
+
+    def test_chain(self):
+        streams = [FeatureStream(chunked(self.content, 50)) for _ in range(3)]
+        chain = FeatureStreamChain(streams)
+        self.assertEqual(chain.json['objectIdFieldName'], 'OBJECTID')
+        self.assertEqual(len(list(chain)), 60)
+        self.assertTrue(all(stream.done for stream in streams))
+
+    def test_layer_query(self):
+        layer, server = feature_layer(RESPONSE['features'], max_record_count=8)
+        with layer.query(streaming=True) as stream:
+            self.assertEqual([f.get('OBJECTID') for f in stream], list(range(1, 9)))
+        chain = layer.query(streaming=True, exceed_limit=True, chunk_size=8)
+        self.assertEqual([f.get('OBJECTID') for f in chain], list(range(1, 21)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#-------------------------------------------------------------------------------
+# Name:        test_geoparquet
+# Purpose:     tests exporting a layer to GeoParquet against a fake server,
+#   the schema of the file comes from the layer and not from the first page.
+#-------------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import unittest
+from restapi.arrow_utils import pyarrow, wkb_to_esri
+from fake_server import feature_layer
+
+if pyarrow is not None:
+    import pyarrow.parquet
+
+FIELDS = [
+    {'name': 'OBJECTID', 'type': 'esriFieldTypeOID', 'alias': 'OBJECTID'},
+    {'name': 'NAME', 'type': 'esriFieldTypeString', 'alias': 'NAME', 'length': 50},
+]
+
+
+@unittest.skipUnless(pyarrow, 'pyarrow is not installed')
+class TestExportGeoParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.out_file = os.path.join(self.folder, 'out.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_first_page_without_geometries(self):
+        features = [
+            {'attributes': {'OBJECTID': 1, 'NAME': 'a'}, 'geometry': None},
+            {'attributes': {'OBJECTID': 2, 'NAME': None}, 'geometry': {'x': 1.5, 'y': 2.5}},
+        ]
+        layer, server = feature_layer(features, fields=FIELDS)
+        layer.export_geoparquet(self.out_file, exceed_limit=True, chunk_size=1)
+        table = pyarrow.parquet.read_table(self.out_file)
+        self.assertEqual(table.schema.names, ['OBJECTID', 'NAME', 'geometry'])
+        self.assertIn(b'geo', table.schema.metadata)
+        self.assertEqual(table.column('NAME').to_pylist(), ['a', None])
+        self.assertEqual([wkb_to_esri(g) for g in table.column('geometry').to_pylist()], [None, {'x': 1.5, 'y': 2.5}])
+
+    def test_no_features(self):
+        layer, server = feature_layer([], fields=FIELDS)
+        layer.export_geoparquet(self.out_file, exceed_limit=True, returnGeometry='false')
+        table = pyarrow.parquet.read_table(self.out_file)
+        self.assertEqual((table.schema.names, table.num_rows), (['OBJECTID', 'NAME'], 0))
+
+if __name__ == '__main__':
+    unittest.main()
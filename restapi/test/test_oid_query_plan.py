@@ -0,0 +1,56 @@
+#-------------------------------------------------------------------------------
+# Name:        test_oid_query_plan
+# Purpose:     tests planning chunked queries by OID ranges or objectIds lists.
+#-------------------------------------------------------------------------------
+import unittest
+import restapi as r
+
+
+class TestOIDQueryPlan(unittest.TestCase):
+
+    def test_dense_oids_use_ranges(self):
+        plan = r.OIDQueryPlan(range(1, 2501), 'OBJECTID', chunk_size=1000)
+        self.assertEqual(plan.strategy, r.OIDQueryPlan.RANGES)
+        self.assertEqual(list(plan), [{'where': 'OBJECTID >= 1 and OBJECTID <= 1000'},
+                                      {'where': 'OBJECTID >= 1001 and OBJECTID <= 2000'},
+                                      {'where': 'OBJECTID >= 2001 and OBJECTID <= 2500'}])
+
+    def test_sparse_oids_use_object_ids(self):
+        plan = r.OIDQueryPlan([1, 100, 1000, 5000, 9000, 9500], 'OID', chunk_size=2)
+        self.assertEqual(plan.strategy, r.OIDQueryPlan.OBJECT_IDS)
+        self.assertEqual(list(plan), [{'objectIds': '1,100'}, {'objectIds': '1000,5000'}, {'objectIds': '9000,9500'}])
+
+    def test_hybrid(self):
+        # a dense block followed by scattered ids
+        oids = list(range(1, 11)) + [100, 200, 300, 400]
+        plan = r.OIDQueryPlan(oids, 'OID', chunk_size=5)
+        self.assertEqual(plan.strategy, r.OIDQueryPlan.HYBRID)
+        self.assertEqual(list(plan), [{'where': 'OID >= 1 and OID <= 5'}, {'where': 'OID >= 6 and OID <= 10'},
+                                      {'objectIds': '100,200,300,400'}])
+        summary = plan.summary()
+        self.assertEqual((summary['requests'], summary['ranges'], summary['objectIds']), (3, 2, 1))
+
+    def test_min_density(self):
+        # every other id exists, so each chunk covers half of its range
+        oids = range(2, 42, 2)
+        self.assertEqual(r.OIDQueryPlan(oids, 'OID', 10, min_density=0.5).strategy, r.OIDQueryPlan.RANGES)
+        self.assertEqual(r.OIDQueryPlan(oids, 'OID', 10, min_density=0.6).strategy, r.OIDQueryPlan.OBJECT_IDS)
+
+    def test_forced_strategy(self):
+        oids = [5, 1, 500]
+        self.assertEqual(list(r.OIDQueryPlan(oids, 'OID', 10, r.OIDQueryPlan.RANGES)), [{'where': 'OID >= 1 and OID <= 500'}])
+        self.assertEqual(list(r.OIDQueryPlan(range(10), 'OID', 10, r.OIDQueryPlan.OBJECT_IDS)),
+                         [{'objectIds': '0,1,2,3,4,5,6,7,8,9'}])
+        self.assertRaises(ValueError, r.OIDQueryPlan, oids, 'OID', 10, 'bogus')
+
+    def test_max_records(self):
+        plan = r.OIDQueryPlan([9, 3, 7, 1, 5], 'OID', chunk_size=2, max_records=3)
+        self.assertEqual(list(plan.oids), [1, 3, 5])
+        self.assertEqual(list(plan.iter_where_clauses()), ['OID >= 1 and OID <= 3', 'OID >= 5 and OID <= 5'])
+
+    def test_empty(self):
+        plan = r.OIDQueryPlan([], 'OID')
+        self.assertEqual((len(plan), list(plan), plan.density), (0, [], 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#-------------------------------------------------------------------------------
+# Name:        test_paged_feature_set
+# Purpose:     tests that lazy feature sets request pages while iterated and
+#   only request their count when asked for it.
+#-------------------------------------------------------------------------------
+import unittest
+import restapi as r
+
+
+def pages(sizes):
+    oid = 0
+    for size in sizes:
+        features = []
+        for _ in range(size):
+            oid += 1
+            features.append({'attributes': {'OBJECTID': oid}, 'geometry': {'x': oid, 'y': oid}})
+        yield r.FeatureSet({'geometryType': 'esriGeometryPoint', 'features': features,
+                            'fields': [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID'}]})
+
+
+class TestPagedFeatureSet(unittest.TestCase):
+
+    def test_count_is_explicit(self):
+        requests = []
+
+        def count():
+            requests.append(1)
+            return 5
+
+        fs = r.PagedFeatureSet(pages([2, 3]), count=count)
+        self.assertTrue(fs)
+        self.assertRaises(TypeError, len, fs)
+        self.assertEqual(requests, [])
+        self.assertEqual((fs.count, fs.count, len(fs)), (5, 5, 5))
+        self.assertEqual(requests, [1])
+        self.assertRaises(TypeError, len, r.PagedFeatureSet(pages([1])))
+
+    def test_records(self):
+        fs = r.PagedFeatureSet(pages([2, 3, 4]), records=4, count=9)
+        self.assertEqual(len(fs), 4)
+        self.assertEqual([f['attributes']['OBJECTID'] for f in fs.features], [1, 2, 3, 4])
+        self.assertRaises(RuntimeError, list, fs.features)
+
+    def test_empty(self):
+        fs = r.PagedFeatureSet(pages([0]))
+        self.assertFalse(fs)
+        self.assertFalse(fs.hasGeometry)
+        self.assertEqual(list(fs.features), [])
+
+    def test_cursor(self):
+        cursor = r.Cursor(r.PagedFeatureSet(pages([2, 1]), count=lambda: 3), ['OID@'])
+        self.assertTrue(cursor)
+        self.assertRaises(TypeError, len, cursor)
+        self.assertEqual(cursor.count, 3)
+        self.assertEqual([row[0] for row in cursor], [1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
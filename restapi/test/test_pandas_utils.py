@@ -0,0 +1,58 @@
+#-------------------------------------------------------------------------------
+# Name:        test_pandas_utils
+# Purpose:     tests the round trip of feature sets through DataFrames and back
+#   to Esri JSON features for applyEdits.
+#-------------------------------------------------------------------------------
+import unittest
+from restapi.columnar import ColumnarFeatureSet
+from restapi.pandas_utils import numpy, pandas, to_dataframe, dataframe_to_features
+
+DOMAIN = {'type': 'codedValue', 'name': 'Status', 'codedValues': [{'code': 1, 'name': 'Open'}, {'code': 2, 'name': 'Closed'}]}
+
+FIELDS = [
+    {'name': 'OBJECTID', 'type': 'esriFieldTypeOID'},
+    {'name': 'STATUS', 'type': 'esriFieldTypeSmallInteger', 'domain': DOMAIN},
+]
+
+# a clockwise exterior ring with a counter clockwise hole
+SQUARE = [[0.0, 0.0], [0.0, 10.0], [10.0, 10.0], [10.0, 0.0], [0.0, 0.0]]
+HOLE = [[2.0, 2.0], [4.0, 2.0], [4.0, 4.0], [2.0, 4.0], [2.0, 2.0]]
+
+
+def feature_set(features, geometry_type='esriGeometryPolygon'):
+    return ColumnarFeatureSet.from_features(features, {'geometryType': geometry_type, 'fields': FIELDS})
+
+
+@unittest.skipUnless(pandas, 'pandas is not installed')
+class TestDataFrames(unittest.TestCase):
+
+    def test_coded_values(self):
+        features = [{'attributes': {'OBJECTID': i + 1, 'STATUS': code}} for i, code in enumerate([1, None, 3, 2])]
+        df = to_dataframe(feature_set(features), coded_values=True)
+        self.assertEqual(df['STATUS'].tolist()[:1] + df['STATUS'].tolist()[2:], ['Open', '3', 'Closed'])
+        self.assertTrue(pandas.isna(df['STATUS'][1]))
+        rows = list(dataframe_to_features(df, FIELDS))
+        self.assertEqual([row['attributes']['STATUS'] for row in rows], [1, None, 3, 2])
+
+    def test_codes(self):
+        features = [{'attributes': {'OBJECTID': 1, 'STATUS': None}}, {'attributes': {'OBJECTID': 2, 'STATUS': 2}}]
+        df = to_dataframe(feature_set(features))
+        self.assertEqual(str(df['STATUS'].dtype), 'Int16')
+        self.assertEqual([row['attributes'] for row in dataframe_to_features(df, FIELDS)], [f['attributes'] for f in features])
+
+    def test_coords_keep_parts(self):
+        polygon = {'rings': [SQUARE, HOLE]}
+        features = [{'attributes': {'OBJECTID': 1, 'STATUS': 1}, 'geometry': polygon},
+                    {'attributes': {'OBJECTID': 2, 'STATUS': 1}, 'geometry': None}]
+        df = to_dataframe(feature_set(features), geometry='coords')
+        self.assertEqual(len(df['SHAPE'][0]), 2)
+        shapes = [row['geometry'] for row in dataframe_to_features(df, FIELDS, geometry_type='esriGeometryPolygon')]
+        self.assertEqual(shapes, [polygon, None])
+
+    def test_single_vertex_array(self):
+        df = pandas.DataFrame({'SHAPE': [numpy.array(SQUARE)]})
+        rows = dataframe_to_features(df, geometry_type='esriGeometryPolyline')
+        self.assertEqual(next(rows)['geometry'], {'paths': [SQUARE]})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#-------------------------------------------------------------------------------
+# Name:        test_pbf
+# Purpose:     tests the protocol buffer decoder (f=pbf) without a server, the
+#   buffers are encoded by hand.
+#-------------------------------------------------------------------------------
+import struct
+import unittest
+from restapi import pbf
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def key(number, wire_type):
+    return varint(number << 3 | wire_type)
+
+def message(number, *payloads):
+    payload = b''.join(payloads)
+    return key(number, 2) + varint(len(payload)) + payload
+
+def string(number, value):
+    return message(number, value.encode('utf-8'))
+
+def uint(number, value):
+    return key(number, 0) + varint(value)
+
+def double(number, value):
+    return key(number, 1) + struct.pack('<d', value)
+
+def packed(number, values, signed=False):
+    return message(number, *[varint(zigzag(v) if signed else v) for v in values])
+
+def feature_result(*payloads):
+    return message(2, message(1, *payloads))
+
+def transform(origin=pbf.UPPER_LEFT):
+    return message(12, uint(1, origin), message(2, double(1, 0.5), double(2, 0.5)),
+                   message(3, double(1, -10.0), double(2, 2000.0)))
+
+# a polygon with two parts, the coordinates are delta encoded across the parts
+POLYGON = feature_result(
+    string(1, 'OBJECTID'),
+    message(6, uint(1, 5), uint(2, 99)),
+    uint(7, 3),
+    message(8, uint(1, 3857), uint(2, 3857)),
+    transform(),
+    message(13, string(1, 'OBJECTID'), uint(2, 6), string(3, 'Object ID')),
+    message(13, string(1, 'NAME'), uint(2, 4), string(3, 'Name')),
+    message(13, string(1, 'BIG'), uint(2, 13), string(5, '{"type": "range", "range": [0, 10]}')),
+    message(15, message(1, uint(4, zigzag(7))), message(1, string(1, u'caf\xe9')), message(1),
+            message(2, packed(2, [3, 2]), packed(3, [2, 4, 2, 0, 0, -4, -2, 2, 1, 1], signed=True)))
+)
+
+
+class TestVarints(unittest.TestCase):
+
+    def test_read_varint(self):
+        self.assertEqual(pbf._read_varint(bytearray(b'\x01'), 0), (1, 1))
+        self.assertEqual(pbf._read_varint(bytearray(b'\xac\x02'), 0), (300, 2))
+        self.assertEqual(pbf._read_varint(bytearray(varint(2 ** 63)), 0), (2 ** 63, 10))
+
+    def test_convert_varint(self):
+        self.assertEqual([pbf._convert_varint(v, 'sint64') for v in (0, 1, 2, 3)], [0, -1, 1, -2])
+        self.assertEqual(pbf._convert_varint(2 ** 64 - 1, 'int64'), -1)
+        self.assertEqual(pbf._convert_varint(2 ** 64 - 1, 'uint64'), 2 ** 64 - 1)
+        self.assertIs(pbf._convert_varint(1, 'bool'), True)
+
+    def test_read_packed(self):
+        values = [0, -1, 1, -300, 2 ** 40, -2 ** 40]
+        buf = bytearray(b''.join(varint(zigzag(v)) for v in values))
+        self.assertEqual(pbf._read_packed(buf, 0, len(buf), 'sint64'), values)
+        buf = bytearray(b''.join(varint(v) for v in (1, 300, 2 ** 35)))
+        self.assertEqual(pbf._read_packed(buf, 0, len(buf), 'uint64'), [1, 300, 2 ** 35])
+
+    def test_skip_unknown_fields(self):
+        buf = uint(99, 12345) + message(98, b'ignored') + string(1, '1.0')
+        self.assertEqual(pbf._decode_message(bytearray(buf), 0, len(buf), 'FeatureCollectionPBuffer'), {'version': '1.0'})
+
+
+class TestPureDecoder(unittest.TestCase):
+
+    def decode(self, content, **kwargs):
+        return pbf.decode_feature_collection(content, use_protobuf=False, **kwargs)
+
+    def test_delta_geometry_upper_left(self):
+        feature = self.decode(POLYGON)['features'][0]
+        self.assertEqual(feature['geometry'], {'rings': [[[-9.0, 1998.0], [-8.0, 1998.0], [-8.0, 2000.0]],
+                                                         [[-9.0, 1999.0], [-8.5, 1998.5]]]})
+
+    def test_delta_geometry_lower_left(self):
+        content = feature_result(uint(7, 0), transform(pbf.LOWER_LEFT), message(15, message(2, packed(3, [4, 6], signed=True))))
+        self.assertEqual(self.decode(content)['features'][0]['geometry'], {'x': -8.0, 'y': 2003.0})
+
+    def test_feature_set(self):
+        fs = self.decode(POLYGON)
+        self.assertEqual(fs['geometryType'], 'esriGeometryPolygon')
+        self.assertEqual(fs['spatialReference'], {'wkid': 3857, 'latestWkid': 3857})
+        self.assertEqual(fs['serverGens'], {'minServerGen': 5, 'serverGen': 99})
+        self.assertEqual([(f['name'], f['type']) for f in fs['fields']],
+                         [('OBJECTID', 'esriFieldTypeOID'), ('NAME', 'esriFieldTypeString'), ('BIG', 'esriFieldTypeBigInteger')])
+        self.assertEqual(fs['fields'][2]['domain'], {'type': 'range', 'range': [0, 10]})
+        self.assertEqual(fs['features'][0]['attributes'], {'OBJECTID': 7, 'NAME': u'caf\xe9', 'BIG': None})
+
+    def test_layer_field_properties(self):
+        fields = [{'name': 'name', 'type': 'esriFieldTypeString', 'alias': 'Other', 'length': 50, 'nullable': True}]
+        name = self.decode(POLYGON, fields=fields)['fields'][1]
+        self.assertEqual(name, {'name': 'NAME', 'type': 'esriFieldTypeString', 'alias': 'Name', 'length': 50, 'nullable': True})
+
+    def test_count_and_ids(self):
+        self.assertEqual(self.decode(message(2, message(2, uint(1, 42)))), {'count': 42})
+        ids = self.decode(message(2, message(3, string(1, 'OID'), message(2, uint(2, 7)), packed(3, [1, 2, 300]))))
+        self.assertEqual(ids, {'objectIdFieldName': 'OID', 'objectIds': [1, 2, 300], 'serverGens': {'serverGen': 7}})
+
+
+@unittest.skipUnless(pbf.has_protobuf, 'protobuf is not installed')
+class TestProtobufParity(unittest.TestCase):
+
+    def assertSameResult(self, content):
+        self.assertEqual(pbf.decode_feature_collection(content, use_protobuf=False),
+                         pbf.decode_feature_collection(content, use_protobuf=True))
+
+    def test_feature_result(self):
+        self.assertSameResult(POLYGON)
+
+    def test_z_values(self):
+        self.assertSameResult(feature_result(uint(7, 2), uint(10, 1), transform(), message(15, message(
+            2, packed(2, [2]), packed(3, [1, 1, 7, 2, 0, -8], signed=True)))))
+
+    def test_count_and_ids(self):
+        self.assertSameResult(message(2, message(2, uint(1, 42))))
+        self.assertSameResult(message(2, message(3, string(1, 'OID'), packed(3, [1, 2, 300]))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#-------------------------------------------------------------------------------
+# Name:        test_prefetch
+# Purpose:     tests reading the pages of a query ahead of the consumer on a
+#   background thread, and stopping it when iteration ends early.
+#-------------------------------------------------------------------------------
+import time
+import threading
+import unittest
+from restapi.rest_utils import PrefetchIterator
+from fake_server import feature_layer
+
+
+class Source(object):
+    """Generator of numbers that records how many were produced and if it was closed."""
+
+    def __init__(self, count, fail_at=None):
+        self.count = count
+        self.fail_at = fail_at
+        self.produced = 0
+        self.closed = False
+        self.thread = None
+
+    def __iter__(self):
+        try:
+            for i in range(self.count):
+                if i == self.fail_at:
+                    raise ValueError('page {} failed'.format(i))
+                self.produced += 1
+                self.thread = threading.current_thread()
+                yield i
+        finally:
+            self.closed = True
+
+
+def wait_for(condition, timeout=2):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestPrefetchIterator(unittest.TestCase):
+
+    def test_order(self):
+        source = Source(50)
+        with PrefetchIterator(iter(source), prefetch=3) as items:
+            self.assertEqual(list(items), list(range(50)))
+        self.assertTrue(source.closed)
+        self.assertIsNot(source.thread, threading.current_thread())
+
+    def test_bounded_read_ahead(self):
+        source = Source(100)
+        items = PrefetchIterator(iter(source), prefetch=2, poll_interval=0.01)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.1)
+        # the queue holds two items and the worker waits with a third
+        self.assertLessEqual(source.produced, 4)
+        items.close()
+
+    def test_errors_are_raised_in_order(self):
+        items = PrefetchIterator(iter(Source(10, fail_at=3)), prefetch=5)
+        self.assertEqual([next(items) for _ in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, items)
+        self.assertRaises(StopIteration, next, items)
+
+    def test_close_stops_the_worker(self):
+        source = Source(1000)
+        items = PrefetchIterator(iter(source), prefetch=2, poll_interval=0.01)
+        next(items)
+        items.close(timeout=2)
+        self.assertTrue(items.closed)
+        self.assertTrue(wait_for(lambda: source.closed))
+        self.assertFalse(items._thread.is_alive())
+        produced = source.produced
+        time.sleep(0.05)
+        self.assertEqual(source.produced, produced)
+        self.assertRaises(StopIteration, next, items)
+
+    def test_query_stops_requesting_pages(self):
+        features = [{'attributes': {'OBJECTID': i}, 'geometry': {'x': i, 'y': i}} for i in range(1, 101)]
+        layer, server = feature_layer(features)
+        pages = layer.query_in_chunks(chunk_size=5, prefetch=2)
+        self.assertEqual(len(next(pages)['features']), 5)
+        pages.close()
+        time.sleep(0.05)
+        queries = [params for path, params in server.requests if path.endswith('/query')]
+        self.assertLessEqual(len(queries), 5)
+        # all pages in order without closing early
+        pages = layer.query_in_chunks(chunk_size=5, prefetch=2)
+        oids = [f['attributes']['OBJECTID'] for page in pages for f in page['features']]
+        self.assertEqual(oids, list(range(1, 101)))
+
+if __name__ == '__main__':
+    unittest.main()
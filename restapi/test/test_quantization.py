@@ -0,0 +1,70 @@
+#-------------------------------------------------------------------------------
+# Name:        test_quantization
+# Purpose:     tests decoding quantized query responses and the geometry
+#   reduction parameters.
+#-------------------------------------------------------------------------------
+import unittest
+from restapi.quantization import dequantize, reduction_params, units_per_meter, tile_resolution
+
+
+def response(geometry, origin='upperLeft'):
+    return {
+        'transform': {'originPosition': origin, 'scale': [0.5, 0.25], 'translate': [-10, 2000]},
+        'features': [{'attributes': {'OBJECTID': 1}, 'geometry': geometry}]
+    }
+
+
+class TestDequantize(unittest.TestCase):
+
+    def test_upper_left_point(self):
+        result = dequantize(response({'x': 4, 'y': 8}))
+        self.assertEqual(result['features'][0]['geometry'], {'x': -8.0, 'y': 1998.0})
+        self.assertNotIn('transform', result)
+
+    def test_lower_left_point(self):
+        result = dequantize(response({'x': 4, 'y': 8}, 'lowerLeft'))
+        self.assertEqual(result['features'][0]['geometry'], {'x': -8.0, 'y': 2002.0})
+
+    def test_upper_left_delta_paths(self):
+        # each part restarts the running sums, y grows downwards from the origin
+        geometry = {'paths': [[[4, 8], [2, 0], [0, -4]], [[0, 0], [1, 1]]]}
+        result = dequantize(response(geometry))
+        self.assertEqual(result['features'][0]['geometry']['paths'],
+                         [[[-8.0, 1998.0], [-7.0, 1998.0], [-7.0, 1999.0]], [[-10.0, 2000.0], [-9.5, 1999.75]]])
+
+    def test_rings_keep_z_and_m(self):
+        geometry = {'rings': [[[4, 8, 10.5, 1], [2, 0, 11.5, 2], [-2, 0, 12.5, 3]]]}
+        result = dequantize(response(geometry))
+        self.assertEqual(result['features'][0]['geometry']['rings'],
+                         [[[-8.0, 1998.0, 10.5, 1], [-7.0, 1998.0, 11.5, 2], [-8.0, 1998.0, 12.5, 3]]])
+
+    def test_multipoint_and_null_geometry(self):
+        result = dequantize({'transform': {'scale': [1, 1], 'translate': [0, 100]},
+                             'features': [{'geometry': {'points': [[1, 1], [1, 1]]}}, {'geometry': None}, {}]})
+        self.assertEqual(result['features'][0]['geometry'], {'points': [[1, 99], [2, 98]]})
+        self.assertIsNone(result['features'][1]['geometry'])
+
+    def test_unquantized_response(self):
+        unquantized = {'features': [{'geometry': {'x': 4, 'y': 8}}]}
+        self.assertEqual(dequantize(unquantized), {'features': [{'geometry': {'x': 4, 'y': 8}}]})
+
+
+class TestReductionParams(unittest.TestCase):
+
+    def test_params(self):
+        extent = {'xmin': 0, 'ymin': 0, 'xmax': 10, 'ymax': 10}
+        params = reduction_params(0.5, extent)
+        self.assertEqual((params['geometryPrecision'], params['maxAllowableOffset']), (1, 0.5))
+        self.assertEqual(params['quantizationParameters'],
+                         {'mode': 'view', 'originPosition': 'upperLeft', 'tolerance': 0.5, 'extent': extent})
+        self.assertEqual(reduction_params(0.001, extent, generalize=False, quantize=False), {'geometryPrecision': 3})
+        self.assertNotIn('quantizationParameters', reduction_params(0.5))
+
+    def test_units(self):
+        self.assertEqual(units_per_meter(None), 1.0)
+        self.assertAlmostEqual(units_per_meter('GEOGCS["GCS_WGS_1984"]'), 1 / 111319.49079327357)
+        self.assertAlmostEqual(units_per_meter('PROJCS["x",UNIT["Foot_US",0.3048006096012192]]'), 3.280833333, places=6)
+        self.assertAlmostEqual(tile_resolution(0), 156543.03392804097)
+
+if __name__ == '__main__':
+    unittest.main()
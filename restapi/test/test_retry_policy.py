@@ -0,0 +1,99 @@
+#-------------------------------------------------------------------------------
+# Name:        test_retry_policy
+# Purpose:     tests the backoff, the Retry-After header and the separate retry
+#   budget of requests that are not reads, offline against a fake server.
+#-------------------------------------------------------------------------------
+import time
+import unittest
+import requests
+from email.utils import formatdate
+import restapi as r
+from restapi.rest_utils import do_request
+from fake_server import FakeServer, BASE_URL
+
+LAYER_URL = BASE_URL + '/Test/FeatureServer/0'
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff(self):
+        policy = r.RetryPolicy(backoff_factor=0.5, max_backoff=3, jitter=False)
+        self.assertEqual([policy.get_backoff(i) for i in range(4)], [0.5, 1, 2, 3])
+        policy.jitter = True
+        for attempt in range(4):
+            self.assertTrue(0 <= policy.get_backoff(attempt) <= min([0.5 * 2 ** attempt, 3]))
+
+    def test_retry_after(self):
+        policy = r.RetryPolicy(backoff_factor=0.5, max_backoff=10, jitter=False)
+        self.assertEqual(policy.get_backoff(0, '4'), 4)
+        # the header never shortens the backoff and is capped by max_backoff
+        self.assertEqual(policy.get_backoff(2, '1'), 2)
+        self.assertEqual(policy.get_backoff(0, '3600'), 10)
+        self.assertAlmostEqual(policy.get_backoff(0, formatdate(time.time() + 5, usegmt=True)), 5, delta=1.5)
+        self.assertEqual(policy.get_backoff(0, 'not a date'), 0.5)
+        policy.respect_retry_after = False
+        self.assertEqual(policy.get_backoff(0, '4'), 0.5)
+
+    def test_idempotent(self):
+        policy = r.RetryPolicy()
+        self.assertTrue(policy.is_idempotent(LAYER_URL + '/query', 'POST'))
+        self.assertTrue(policy.is_idempotent(LAYER_URL))
+        self.assertFalse(policy.is_idempotent(LAYER_URL + '/applyEdits'))
+        self.assertFalse(policy.is_idempotent(LAYER_URL + '/someOperation', 'POST'))
+
+    def test_budgets(self):
+        policy = r.RetryPolicy(max_retries=3, max_edit_retries=1)
+        query, edits = LAYER_URL + '/query', LAYER_URL + '/applyEdits'
+        self.assertEqual([policy.should_retry(i, query, status_code=503) for i in range(4)], [True, True, True, False])
+        self.assertEqual([policy.should_retry(i, edits, status_code=503, method='POST') for i in range(2)], [True, False])
+        # the edits may have been applied
+        self.assertFalse(policy.should_retry(0, edits, status_code=500, method='POST'))
+        self.assertFalse(policy.should_retry(0, edits, exception=requests.ReadTimeout(), method='POST'))
+        self.assertTrue(policy.should_retry(0, edits, exception=requests.ConnectTimeout(), method='POST'))
+        self.assertTrue(policy.should_retry(0, query, exception=requests.ReadTimeout()))
+        self.assertTrue(policy.should_retry(0, query, error_code=503))
+        self.assertFalse(policy.should_retry(0, edits, error_code=503, method='POST'))
+        self.assertFalse(policy.should_retry(0, query, status_code=404))
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.path = '/arcgis/rest/services/Test/FeatureServer/0'
+        self.client = self.server.client()
+        self.client.retry_policy = r.RetryPolicy(max_retries=3, max_edit_retries=1, backoff_factor=0)
+
+    def respond(self, operation, *responses):
+        responses = list(responses)
+        self.server.handlers[self.path + operation] = lambda params: responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def count(self, operation):
+        return sum(1 for path, params in self.server.requests if path == self.path + operation)
+
+    def test_read_requests_are_retried(self):
+        self.respond('/query', (503, {}), (500, {}), {'error': {'code': 504, 'message': 'Timeout'}}, {'features': []})
+        self.assertEqual(do_request(LAYER_URL + '/query', {'f': 'json'}, client=self.client), {'features': []})
+        self.assertEqual(self.count('/query'), 4)
+
+    def test_retries_run_out(self):
+        self.respond('/query', (503, {}))
+        self.assertRaises(requests.HTTPError, do_request, LAYER_URL + '/query', {'f': 'json'}, client=self.client)
+        self.assertEqual(self.count('/query'), 4)
+
+    def test_edits_have_their_own_budget(self):
+        self.respond('/applyEdits', (503, {}))
+        self.assertRaises(requests.HTTPError, do_request, LAYER_URL + '/applyEdits', {'f': 'json'}, client=self.client, method='post')
+        self.assertEqual(self.count('/applyEdits'), 2)
+        self.respond('/applyEdits', (500, {}), {'addResults': []})
+        self.assertRaises(requests.HTTPError, do_request, LAYER_URL + '/applyEdits', {'f': 'json'}, client=self.client, method='post')
+        self.assertEqual(self.count('/applyEdits'), 3)
+
+    def test_no_policy(self):
+        self.client.retry_policy = None
+        self.respond('/query', (503, {}), {'features': []})
+        self.assertRaises(requests.HTTPError, do_request, LAYER_URL + '/query', {'f': 'json'}, client=self.client)
+        self.assertEqual(self.count('/query'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#-------------------------------------------------------------------------------
+# Name:        test_token_refresh
+# Purpose:     tests that tokens with registered credentials are refreshed once
+#   no matter how many threads need them (single-flight refresh).
+#-------------------------------------------------------------------------------
+import time
+import threading
+import unittest
+from restapi.rest_utils import IdentityManager, Token
+
+ROOT = 'https://example.com/arcgis/rest/services'
+SERVICE = ROOT + '/Secure/MapServer'
+
+
+class TestTokenRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = IdentityManager()
+        self.issued = []
+        self.release = threading.Event()
+        self.release.set()
+        self.manager.register_credentials(ROOT, callback=self.generate)
+
+    def generate(self, url):
+        self.release.wait(5)
+        self.issued.append(url)
+        time.sleep(0.05)
+        return {'token': 'token{}'.format(len(self.issued)), 'expires': (time.time() + 3600) * 1000}
+
+    def test_single_flight(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.manager.refresh_token(SERVICE))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.issued, [ROOT])
+        self.assertEqual(set(str(t) for t in results), set(['token1']))
+        self.assertEqual(str(self.manager.findToken(SERVICE)), 'token1')
+
+    def test_no_wait(self):
+        self.release.clear()
+        thread = threading.Thread(target=self.manager.refresh_token, args=(SERVICE,))
+        thread.start()
+        time.sleep(0.05)
+        # another thread is refreshing
+        self.assertIsNone(self.manager.refresh_token(SERVICE, block=False))
+        self.release.set()
+        thread.join()
+        self.assertEqual(self.issued, [ROOT])
+
+    def test_due_tokens_refresh_in_background(self):
+        current = Token({'token': 'old', 'expires': (time.time() + 60) * 1000, 'domain': ROOT})
+        # issued long enough ago to be past the refresh threshold
+        current.issued -= 3600 * 1000
+        self.manager.tokens[ROOT] = current
+        self.release.clear()
+        self.assertIs(self.manager.findToken(SERVICE), current)
+        self.assertIs(self.manager.findToken(SERVICE), current)
+        # a refresh is already running
+        self.assertIsNone(self.manager.refresh_in_background(SERVICE))
+        self.release.set()
+        for _ in range(100):
+            if not self.manager._pending_refreshes:
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.issued, [ROOT])
+        self.assertEqual(str(self.manager.findToken(SERVICE)), 'token1')
+
+    def test_expired_tokens_are_replaced(self):
+        self.manager.tokens[ROOT] = Token({'token': 'old', 'expires': (time.time() - 60) * 1000, 'domain': ROOT})
+        self.assertEqual(str(self.manager.findToken(SERVICE)), 'token1')
+        self.manager.unregister_credentials(ROOT)
+        self.assertIsNone(self.manager.refresh_token(SERVICE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#-------------------------------------------------------------------------------
+# Name:        test_token_store
+# Purpose:     tests finding tokens by the longest registered url prefix and
+#   removing expired tokens from the expiry heap.
+#-------------------------------------------------------------------------------
+import time
+import pickle
+import unittest
+from restapi.rest_utils import Token, TokenStore
+
+ROOT = 'https://example.com/arcgis/rest/services'
+SECURE = ROOT + '/Secure'
+
+
+def token(value, minutes=60, domain=ROOT):
+    return Token({'token': value, 'expires': (time.time() + minutes * 60) * 1000, 'domain': domain})
+
+
+class TestTokenStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = TokenStore()
+        self.root, self.secure = token('root'), token('secure', domain=SECURE)
+        self.store[ROOT] = self.root
+        self.store[SECURE] = self.secure
+
+    def test_longest_prefix_first(self):
+        self.assertEqual(self.store.match(SECURE + '/Parcels/MapServer/0'), [(SECURE, self.secure), (ROOT, self.root)])
+        self.assertEqual(self.store.match(ROOT + '/Public/MapServer'), [(ROOT, self.root)])
+        self.assertEqual(self.store.match('https://other.com/arcgis/rest/services'), [])
+
+    def test_token_string(self):
+        self.assertEqual(self.store.match('secure'), [(SECURE, self.secure)])
+        # a replaced token is no longer found by its string
+        self.store[SECURE] = token('new', domain=SECURE)
+        self.assertEqual(self.store.match('secure'), [])
+        self.assertEqual(self.store.match('new')[0][0], SECURE)
+
+    def test_delete_prunes_trie(self):
+        del self.store[SECURE]
+        self.assertEqual(self.store.match(SECURE + '/Parcels/MapServer'), [(ROOT, self.root)])
+        self.assertEqual(self.store.pop(ROOT), self.root)
+        self.assertEqual(self.store._trie, {})
+        self.assertEqual(self.store.pop(ROOT, None), None)
+        self.assertRaises(KeyError, self.store.pop, ROOT)
+
+    def test_flush_expired(self):
+        expired = token('expired', minutes=-1, domain=SECURE + '/Old')
+        self.store[SECURE + '/Old'] = expired
+        # the heap entry of a replaced token is skipped
+        self.store[ROOT] = token('expired root', minutes=-1)
+        self.store[ROOT] = self.root
+        self.assertEqual(self.store.flush_expired(), [expired])
+        self.assertEqual(sorted(self.store), [ROOT, SECURE])
+        self.assertEqual(self.store.flush_expired(), [])
+        self.assertEqual(self.store._expiry_heap[0][0], min(float(self.root.expires), float(self.secure.expires)))
+
+    def test_copy_and_pickle(self):
+        for store in (self.store.copy(), pickle.loads(pickle.dumps(self.store))):
+            self.assertIsInstance(store, TokenStore)
+            self.assertEqual(store.match(SECURE)[0][0], SECURE)
+        self.store.clear()
+        self.assertEqual((len(self.store), self.store.match(SECURE)), (0, []))
+
+if __name__ == '__main__':
+    unittest.main()